@@ -4,7 +4,8 @@ from routes.admin import bp as admin_bp
 from routes.error import bp as error_bp
 from routes.photo import bp as photo_bp
 from routes.payment import bp as payment_bp
-from extensions import db, migrate
+from routes.metrics import bp as metrics_bp
+from extensions import db, migrate, generation_queue, background_registry, storage, expiry_sweeper, hitpay, webhook_processor, payment_status_hub, qr_codes, prints, server_sessions, metrics, cartoon, upstreams
 from config import Config
 from models import *   
 
@@ -19,14 +20,29 @@ def create_app(config_class=Config):
     
     # Load configuration from Config class
     app.config.from_object(config_class)  
-    app.config["OPENAI_CLIENT"] = Config.client # Set OpenAI client in app config
+    metrics.init_app(app)                       # Time every request, before the other request hooks
+    upstreams.init_app(app)                     # Circuit breakers and bulkheads of the OpenAI and HitPay calls
     db.init_app(app)                            # Initialize SQLAlchemy with the app
     migrate.init_app(app, db)                   # Initialize Flask-Migrate with the app
+    prints.init_app(app)                        # Print file renderer, its process pool starts on first use
+    cartoon.init_app(app)                       # Local cartoon engine, its process pool starts on first use
+    generation_queue.init_app(app)              # Initialize the AI generation worker pool
+    background_registry.init_app(app)           # Preload the background images
+    storage.init_app(app)                       # Initialize the photo storage executor
+    hitpay.init_app(app)                        # Initialize the pooled HitPay HTTP client
+    server_sessions.init_app(app)               # Keep the session data server-side if configured
     
-    # Create database tables if they do not exist
+    # Create database tables if they do not exist, unless the migrations already did
     with app.app_context():
-        db.create_all()                         # Create database tables if they do not exist
-        print("Models mapped:", list(db.metadata.tables.keys()))
+        if not schema_is_current():
+            db.create_all()                     # Create database tables if they do not exist
+            print("Models mapped:", list(db.metadata.tables.keys()))
+    
+    # Expire abandoned photos, from the first request served
+    expiry_sweeper.init_app(app)
+    webhook_processor.init_app(app)             # Apply received payment webhooks in the background
+    qr_codes.init_app(app)                      # Render and cache the download QR codes, before the clients are woken up
+    payment_status_hub.init_app(app)            # Push payment status changes to the waiting clients
     
     # Register blueprints for different parts of the application
     app.register_blueprint(main_bp)     # Register main blueprint
@@ -34,6 +50,25 @@ def create_app(config_class=Config):
     app.register_blueprint(error_bp)    # Register error handling blueprint
     app.register_blueprint(photo_bp)    # Register photo handling blueprint
     app.register_blueprint(payment_bp)  # Register payment handling blueprint
+    app.register_blueprint(metrics_bp)  # Register metrics blueprint
     
     return app
 
+
+def schema_is_current():
+    """Check if the database is at the latest migration, so the tables already exist.
+
+    Returns:
+        bool: True if the database revision is the head of the migrations.
+    """
+    from alembic.runtime.migration import MigrationContext
+    from alembic.script import ScriptDirectory
+
+    try:
+        heads = set(ScriptDirectory.from_config(migrate.get_config()).get_heads())
+        with db.engine.connect() as connection:
+            current = set(MigrationContext.configure(connection).get_current_heads())
+    except Exception as e:
+        print(f"❌ Could not check the database migrations: {e}")
+        return False
+    return bool(heads) and current == heads
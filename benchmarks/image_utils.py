@@ -0,0 +1,253 @@
+"""Microbenchmarks of the image utilities in utils.py used by the capture and preview path.
+
+Builds kiosk-like captures at each frame size (a photo from static/images fitted to
+the frame and encoded like the browser canvas: JPEG at quality 0.92) and an AI-like
+PNG result, then runs each utility on them. For every case it reports:
+
+- wall time: median and p95 of --repeats timed runs, after --warmup runs
+- py_peak: peak Python heap during one run (tracemalloc: base64 strings, bytes buffers)
+- rss_peak: growth of the process peak RSS during one run, which also counts the
+  Pillow pixel buffers that tracemalloc does not see (Linux only, else null)
+- pil_images: Pillow images allocated during one run
+- retained: Python blocks and bytes still allocated after the run (caches or leaks)
+
+On Linux the benchmark re-runs itself with MALLOC_MMAP_THRESHOLD_ set, so freed
+pixel buffers go back to the OS and rss_peak is measured per call.
+
+Run from the project root:
+    python benchmarks/image_utils.py                                    # print the results
+    python benchmarks/image_utils.py --save benchmarks/baselines/image_utils.json
+    python benchmarks/image_utils.py --compare benchmarks/baselines/image_utils.json
+
+With --compare, exits with status 1 if a case is slower than the baseline by more than
+--time-tolerance, or uses more memory than --memory-tolerance allows. Timings only
+compare well on the machine the baseline was recorded on.
+"""
+import argparse
+import base64
+import contextlib
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from io import BytesIO, StringIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+import PIL
+from flask import Flask
+from PIL import Image, ImageOps
+from config import Config
+from extensions import storage
+from utils import (
+    encode_image_to_data_url,
+    is_valid_base64,
+    pil_to_base64,
+    read_image_from_base64,
+    resize_to_match_height,
+    save_preview_image,
+    stitch_images,
+)
+
+SOURCE_IMAGE = os.path.join("static", "images", "Home-background.jpg")
+CANVAS_JPEG_QUALITY = 92                      # Quality of canvas.toDataURL('image/jpeg')
+AI_SIZES = {"frame1": (1024, 1536), "frame2": (1536, 1024)}   # Sizes requested from OpenAI
+
+
+def make_inputs(photo_size, frame_size):
+    """Capture and AI result of a frame, as the routes receive them."""
+    with Image.open(SOURCE_IMAGE) as source:
+        source = ImageOps.exif_transpose(source).convert("RGB")
+        capture = ImageOps.fit(source, frame_size, Image.LANCZOS)
+        ai_image = ImageOps.fit(source, AI_SIZES[photo_size], Image.LANCZOS)
+
+    buffer = BytesIO()
+    capture.save(buffer, "JPEG", quality=CANVAS_JPEG_QUALITY)
+    capture_bytes = buffer.getvalue()
+    buffer = BytesIO()
+    ai_image.save(buffer, "PNG")
+    return {
+        "capture_bytes": capture_bytes,
+        "capture_data_url": "data:image/jpeg;base64," + base64.b64encode(capture_bytes).decode("utf-8"),
+        "ai_base64": base64.b64encode(buffer.getvalue()).decode("utf-8"),
+        "capture": capture,
+        "ai_image": ai_image,
+    }
+
+
+def make_cases(inputs, preview_dir):
+    """Utility calls to measure for one frame, by name."""
+    def read_image():
+        # Image.open is lazy, load() decodes the pixels as the callers do next
+        read_image_from_base64(inputs["capture_data_url"]).load()
+
+    def save_preview():
+        with contextlib.redirect_stdout(StringIO()):
+            save_preview_image(os.path.join(preview_dir, "preview.jpg"), inputs["capture_bytes"])
+            storage.flush()
+
+    return {
+        "is_valid_base64": lambda: is_valid_base64(inputs["capture_data_url"]),
+        "read_image_from_base64": read_image,
+        "encode_image_to_data_url": lambda: encode_image_to_data_url(inputs["capture_data_url"]),
+        "pil_to_base64": lambda: pil_to_base64(inputs["ai_image"]),
+        "resize_to_match_height": lambda: resize_to_match_height(inputs["capture"], inputs["ai_image"]),
+        "stitch_images": lambda: stitch_images(inputs["capture"], inputs["ai_image"]),
+        "save_preview_image": save_preview,
+    }
+
+
+def read_peak_rss():
+    """Peak and current RSS of the process in bytes, or None where it cannot be read."""
+    try:
+        with open("/proc/self/status") as status:
+            fields = dict(line.split(":", 1) for line in status)
+        return int(fields["VmHWM"].split()[0]) * 1024, int(fields["VmRSS"].split()[0]) * 1024
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def reset_peak_rss():
+    """Reset the peak RSS of the process to its current RSS. Returns False if not supported."""
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def measure(fn, repeats, warmup):
+    """Wall time, memory peaks and retained allocations of a call."""
+    for _ in range(warmup):
+        fn()
+
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+
+    # Native peak, without tracemalloc slowing the call down
+    rss_peak = None
+    if reset_peak_rss():
+        before = read_peak_rss()
+        fn()
+        after = read_peak_rss()
+        if before and after:
+            rss_peak = max(after[0] - before[1], 0)
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    tracemalloc.reset_peak()
+    Image.core.reset_stats()
+    fn()
+    pil_images = Image.core.get_stats()["new_count"]
+    _, py_peak = tracemalloc.get_traced_memory()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    diff = after.compare_to(before, "filename")
+
+    return {
+        "median_ms": round(statistics.median(timings), 3),
+        "p95_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3),
+        "py_peak_bytes": py_peak,
+        "rss_peak_bytes": rss_peak,
+        "pil_images": pil_images,
+        "retained_blocks": sum(stat.count_diff for stat in diff),
+        "retained_bytes": sum(stat.size_diff for stat in diff),
+    }
+
+
+def compare(results, baseline, time_tolerance, memory_tolerance):
+    """Print the changes against a baseline. Returns True if a case regressed."""
+    regressed = False
+    for name, result in results.items():
+        base = baseline["results"].get(name)
+        if base is None:
+            print(f"   {name}: not in the baseline")
+            continue
+        problems = []
+        if result["median_ms"] > base["median_ms"] * (1 + time_tolerance):
+            problems.append(f"median {base['median_ms']:.2f} -> {result['median_ms']:.2f} ms")
+        for key in ("py_peak_bytes", "rss_peak_bytes"):
+            # Ignore changes below 1 MiB, they are allocator noise
+            if result[key] is not None and base.get(key) is not None \
+                    and result[key] > base[key] * (1 + memory_tolerance) + 1024 * 1024:
+                problems.append(f"{key} {base[key] / 1e6:.1f} -> {result[key] / 1e6:.1f} MB")
+        regressed = regressed or bool(problems)
+        print(f"{'❌' if problems else '✅'} {name}" + (f": {'; '.join(problems)}" if problems else ""))
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeats", type=int, default=20, help="Timed runs of each case")
+    parser.add_argument("--warmup", type=int, default=2, help="Untimed runs before the timed ones")
+    parser.add_argument("--only", help="Only run the cases whose name contains this text")
+    parser.add_argument("--save", help="Write the results to this baseline JSON file")
+    parser.add_argument("--compare", help="Compare the results with this baseline JSON file")
+    parser.add_argument("--time-tolerance", type=float, default=0.25, help="Allowed slowdown, 0.25 = 25%%")
+    parser.add_argument("--memory-tolerance", type=float, default=0.10, help="Allowed memory growth, 0.10 = 10%%")
+    args = parser.parse_args()
+
+    # Return freed buffers to the OS right away, so the peak RSS of each call can be measured
+    if sys.platform.startswith("linux") and "MALLOC_MMAP_THRESHOLD_" not in os.environ:
+        env = dict(os.environ, MALLOC_MMAP_THRESHOLD_="131072")
+        os.execve(sys.executable, [sys.executable] + sys.argv, env)
+
+    # save_preview_image needs the app configuration and the storage thread
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    storage.init_app(app)
+    preview_dir = tempfile.mkdtemp()
+
+    results = {}
+    with app.app_context():
+        for photo_size, frame_size in Config.FRAME_SIZES.items():
+            inputs = make_inputs(photo_size, frame_size)
+            print(f"{photo_size} {frame_size[0]}x{frame_size[1]}: capture "
+                  f"{len(inputs['capture_bytes']) / 1024:.0f} KiB JPEG, AI result "
+                  f"{len(inputs['ai_base64']) * 3 / 4 / 1024:.0f} KiB PNG")
+            for case, fn in make_cases(inputs, preview_dir).items():
+                name = f"{case}[{photo_size}]"
+                if args.only and args.only not in name:
+                    continue
+                result = results[name] = measure(fn, args.repeats, args.warmup)
+                rss_peak = "n/a" if result["rss_peak_bytes"] is None else f"{result['rss_peak_bytes'] / 1e6:6.1f} MB"
+                print(f"  {case:<26} median {result['median_ms']:8.2f} ms | p95 {result['p95_ms']:8.2f} ms "
+                      f"| py_peak {result['py_peak_bytes'] / 1e6:6.1f} MB | rss_peak {rss_peak} "
+                      f"| pil_images {result['pil_images']:2d} | retained {result['retained_blocks']} blocks")
+    storage.flush()
+
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "pillow": PIL.__version__,
+        "machine": f"{platform.system()} {platform.machine()}, {os.cpu_count()} CPUs",
+        "repeats": args.repeats,
+        "results": results,
+    }
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, "w") as file:
+            json.dump(report, file, indent=2)
+            file.write("\n")
+        print(f"Baseline saved to {args.save}")
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        print(f"\nCompared with {args.compare} ({baseline['created_at']}, Pillow {baseline['pillow']}):")
+        if compare(results, baseline, args.time_tolerance, args.memory_tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
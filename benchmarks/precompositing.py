@@ -0,0 +1,127 @@
+"""Benchmark of the pre-compositing stage of the AI generation.
+
+Compares what /upload sends to OpenAI without pre-compositing (the capture prepared
+with the AI_CAPTURE_* settings plus the background) with one composed image ("segment" and "stitch"):
+the time to prepare the request, the request payload size and the number of images.
+
+With --live the generations are also run against the OpenAI API (OPENAI_API_KEY must
+be set, each run is a billed image generation). This adds the end-to-end latency
+(preparation + API call) and the input tokens reported by the API.
+
+Run from the project root:
+    python benchmarks/precompositing.py --runs 5
+    python benchmarks/precompositing.py --live --runs 3 --frame frame2
+"""
+import argparse
+import base64
+import json
+import os
+import statistics
+import sys
+import time
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+from PIL import Image, ImageOps
+from config import Config
+from services.cartoon import compose_capture
+from services.generation import COMPOSED_PROMPT_TEXTS, PROMPT_TEXT, generate_image
+from utils import prepare_capture_for_ai
+
+CAPTURE_IMAGE = os.path.join("static", "images", "top-view-circular-frame-with-travel-items.jpg")
+BACKGROUND_IMAGE = os.path.join("static", "images", "Terengganu_Drawbridge.png")
+
+
+def encode_jpeg(path, size, quality):
+    """An image fitted to a size and encoded as JPEG."""
+    with Image.open(path) as image:
+        image = ImageOps.fit(ImageOps.exif_transpose(image).convert("RGB"), size, Image.LANCZOS)
+    buffer = BytesIO()
+    image.save(buffer, "JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def prepare(variant, capture, background, size):
+    """Build the arguments of generate_image for a variant, as the generation queue does."""
+    if variant == "two images":
+        encoded_image, _ = prepare_capture_for_ai(
+            capture, Config.AI_CAPTURE_LONG_EDGE, Config.AI_CAPTURE_FORMAT, Config.AI_CAPTURE_QUALITY)
+        background_data_url = "data:image/jpeg;base64," + base64.b64encode(background).decode("utf-8")
+        return encoded_image, background_data_url, None
+    composed = compose_capture(capture, background, size, variant,
+                               Config.PRECOMPOSITE_LONG_EDGE, Config.PRECOMPOSITE_JPEG_QUALITY)
+    return base64.b64encode(composed).decode("utf-8"), None, variant
+
+
+def payload_size(encoded_image, background_data_url, composition):
+    """Size in bytes of the input sent to the API, and its number of images."""
+    if composition:
+        content = [COMPOSED_PROMPT_TEXTS[composition], f"data:image/jpeg;base64,{encoded_image}"]
+    else:
+        content = [PROMPT_TEXT, f"data:image/{Config.AI_CAPTURE_FORMAT};base64,{encoded_image}", background_data_url]
+    return len(json.dumps(content)), len(content) - 1
+
+
+class UsageRecorder:
+    """Wraps the OpenAI client to keep the usage of the last response."""
+
+    def __init__(self, client):
+        self.client = client
+        self.usage = None
+        self.responses = self
+
+    def create(self, **kwargs):
+        response = self.client.responses.create(**kwargs)
+        self.usage = getattr(response, "usage", None)
+        return response
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="Runs of each variant")
+    parser.add_argument("--frame", choices=sorted(Config.FRAME_SIZES), default="frame1", help="Frame size")
+    parser.add_argument("--live", action="store_true", help="Also call the OpenAI API (billed)")
+    args = parser.parse_args()
+
+    size = Config.FRAME_SIZES[args.frame]
+    capture = encode_jpeg(CAPTURE_IMAGE, size, 92)                          # Like canvas.toDataURL('image/jpeg')
+    background = encode_jpeg(BACKGROUND_IMAGE, size, Config.BACKGROUND_JPEG_QUALITY)  # Like the background registry
+
+    client = None
+    if args.live:
+        from openai import OpenAI
+
+        client = UsageRecorder(OpenAI(api_key=os.environ["OPENAI_API_KEY"], timeout=Config.OPENAI_TIMEOUT))
+
+    print(f"{args.frame} {size[0]}x{size[1]}, capture {len(capture) / 1024:.0f} KiB, "
+          f"background {len(background) / 1024:.0f} KiB, {args.runs} runs")
+    baseline_payload = None
+    for variant in ("two images", "segment", "stitch"):
+        prepare_ms, total_ms, tokens = [], [], []
+        prepare(variant, capture, background, size)        # Warm up the imports
+        for _ in range(args.runs):
+            start = time.perf_counter()
+            encoded_image, background_data_url, composition = prepare(variant, capture, background, size)
+            prepare_ms.append((time.perf_counter() - start) * 1000)
+            if client is not None:
+                generate_image(client, encoded_image, background_data_url, args.frame, composition=composition,
+                               capture_mime=f"image/{Config.AI_CAPTURE_FORMAT}")
+                total_ms.append((time.perf_counter() - start) * 1000)
+                if client.usage is not None:
+                    tokens.append(client.usage.input_tokens)
+
+        payload, images = payload_size(encoded_image, background_data_url, composition)
+        baseline_payload = baseline_payload or payload
+        line = (f"{variant:<11} prepare {statistics.median(prepare_ms):7.1f} ms | payload {payload / 1024:7.0f} KiB "
+                f"({payload / baseline_payload:4.0%}) | {images} image(s)")
+        if total_ms:
+            line += f" | end-to-end {statistics.median(total_ms) / 1000:6.1f} s"
+        if tokens:
+            line += f" | input tokens {statistics.median(tokens):.0f}"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
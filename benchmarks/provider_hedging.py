@@ -0,0 +1,110 @@
+"""Tail latency of the generation router with and without a hedged second provider.
+
+Runs generations through services.providers.ProviderRouter with stub providers,
+whose delays are log-normal like a real API, and prints the latency percentiles
+and the share of jobs that needed a second call, for:
+
+- one provider
+- two providers, hedging at the GENERATION_HEDGE_QUANTILE of the first one
+
+A --bad-day share of the calls of the first provider is made --bad-day-factor times
+slower, the tail a single vendor has on its bad days.
+
+Run from the project root:
+    python benchmarks/provider_hedging.py --jobs 300 --delay 0.05
+"""
+import argparse
+import contextlib
+import os
+import random
+import statistics
+import sys
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+from flask import Flask
+from config import Config
+from services.providers import LatencyTracker, ProviderRouter, StubProvider
+
+
+class BenchmarkStub(StubProvider):
+    """Stub provider that counts its calls, with a share of much slower calls.
+
+    It skips rendering an image, so only the delays and the router are measured.
+    """
+
+    def __init__(self, name, delay, bad_day=0.0, factor=1.0):
+        super().__init__(name, delay)
+        self.bad_day = bad_day
+        self.factor = factor
+        self.calls = 0
+
+    def generate(self, job, encoded_image, background_data_url, cancelled, on_partial=None):
+        self.calls += 1
+        return super().generate(job, encoded_image, background_data_url, cancelled, on_partial)
+
+    def sample_delay(self):
+        delay = super().sample_delay()
+        return delay * self.factor if random.random() < self.bad_day else delay
+
+    def render(self, job, encoded_image):
+        return ""
+
+
+def run(router, jobs, concurrency):
+    """Sorted latencies of the jobs in seconds."""
+    def one(index):
+        job = types.SimpleNamespace(id=str(index), photo_size="frame1", partial_images=0)
+        start = time.perf_counter()
+        router.generate(job, "", "data:image/jpeg;base64,")
+        return time.perf_counter() - start
+
+    # Silence the hedging log lines of the router
+    with contextlib.redirect_stdout(StringIO()), ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return sorted(executor.map(one, range(jobs)))
+
+
+def percentile(values, q):
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=300, help="Generations per configuration")
+    parser.add_argument("--concurrency", type=int, default=3, help="Generations running at once")
+    parser.add_argument("--delay", type=float, default=0.05, help="Median delay of the stub providers (seconds)")
+    parser.add_argument("--bad-day", type=float, default=0.05, help="Share of slow calls of the first provider")
+    parser.add_argument("--bad-day-factor", type=float, default=10, help="How much slower those calls are")
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    app.config.update(GENERATION_PROVIDERS="stub", GENERATION_WORKERS=args.concurrency,
+                      GENERATION_HEDGE_AFTER=args.delay * 3, GENERATION_HEDGE_MIN_SAMPLES=20)
+
+    print(f"{args.jobs} jobs, {args.concurrency} at once, stub median {args.delay * 1000:.0f} ms, "
+          f"{args.bad_day:.0%} of the primary calls {args.bad_day_factor:g}x slower")
+
+    for label, names in (("one provider", ["primary"]), ("hedged", ["primary", "secondary"])):
+        providers = [BenchmarkStub("primary", args.delay, args.bad_day, args.bad_day_factor),
+                     BenchmarkStub("secondary", args.delay)][:len(names)]
+        router = ProviderRouter(app)
+        router.providers = providers
+        router._latencies = {provider.name: LatencyTracker(Config.GENERATION_LATENCY_WINDOW) for provider in providers}
+
+        run(router, 30, args.concurrency)        # Warm up the latency quantiles
+        calls_before = sum(provider.calls for provider in providers)
+        latencies = run(router, args.jobs, args.concurrency)
+        extra_calls = sum(provider.calls for provider in providers) - calls_before - args.jobs
+        print(f"{label:<13} p50 {percentile(latencies, 0.5) * 1000:7.1f} ms | p90 {percentile(latencies, 0.9) * 1000:7.1f} ms "
+              f"| p99 {percentile(latencies, 0.99) * 1000:7.1f} ms | mean {statistics.mean(latencies) * 1000:7.1f} ms "
+              f"| extra calls {extra_calls / args.jobs:5.1%}")
+
+
+if __name__ == "__main__":
+    main()
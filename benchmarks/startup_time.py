@@ -0,0 +1,95 @@
+"""Startup-time benchmark of a worker process.
+
+Starts fresh Python processes that import the app and call create_app, the work a
+gunicorn worker does on every boot, with and without LAZY_STARTUP. Prints the median
+import time, create_app time and total for each mode.
+
+Run from the project root:
+    python benchmarks/startup_time.py --runs 10
+    python benchmarks/startup_time.py --imports 15     # also list the slowest imports
+
+Without DATABASE_URL a temporary SQLite file is used. Run `flask --app run db upgrade`
+on it first to measure the boot of a migrated database, which skips db.create_all().
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in the child process, prints the timings as JSON
+CHILD = """
+import json, time
+start = time.perf_counter()
+from app import create_app
+from config import Config
+imported = time.perf_counter()
+app = create_app(Config)
+created = time.perf_counter()
+print("STARTUP " + json.dumps({"import": imported - start, "create_app": created - imported}))
+"""
+
+
+def run_child(env, extra_args=()):
+    """Start one process and return its timings and stderr."""
+    result = subprocess.run(
+        [sys.executable, *extra_args, "-c", CHILD],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True,
+    )
+    for line in result.stdout.splitlines():
+        if line.startswith("STARTUP "):
+            return json.loads(line[len("STARTUP "):]), result.stderr
+    raise RuntimeError(f"No timings in the output:\n{result.stdout}\n{result.stderr}")
+
+
+def slowest_imports(env, count):
+    """Top-level modules with the largest cumulative import time, from -X importtime."""
+    _, stderr = run_child(env, ("-X", "importtime"))
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        # Only the modules imported directly by app.py, one nesting level below it
+        if name.startswith("   ") and not name.startswith("     "):
+            imports.append((int(cumulative) / 1000, name.strip()))
+    return sorted(imports, reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="Processes started per mode")
+    parser.add_argument("--imports", type=int, default=0, help="Also list the N slowest imports")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env.setdefault("SECRET_KEY", "benchmark")
+    env.setdefault("OPENAI_API_KEY", "benchmark")
+    env.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "startup.db"))
+    env["EXPIRY_SWEEPER_ENABLED"] = "false"
+
+    print(f"Database: {env['DATABASE_URL']}")
+    for lazy in ("false", "true"):
+        env["LAZY_STARTUP"] = lazy
+        run_child(env)      # Warm the file cache and create the tables
+        timings = [run_child(env)[0] for _ in range(args.runs)]
+        import_ms = statistics.median(t["import"] for t in timings) * 1000
+        create_ms = statistics.median(t["create_app"] for t in timings) * 1000
+        total_ms = statistics.median(t["import"] + t["create_app"] for t in timings) * 1000
+        print(f"LAZY_STARTUP={lazy:<5} import {import_ms:7.1f} ms | create_app {create_ms:7.1f} ms "
+              f"| total {total_ms:7.1f} ms (median of {args.runs})")
+
+    if args.imports:
+        print(f"\nSlowest imports (LAZY_STARTUP={env['LAZY_STARTUP']}):")
+        for cumulative_ms, name in slowest_imports(env, args.imports):
+            print(f"  {cumulative_ms:7.1f} ms  {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,5 @@
 # config.py
 import os
-from openai import OpenAI
 from dotenv import load_dotenv
 from flask import request
 
@@ -11,6 +10,9 @@ class Config:
     # Secret Key for session management
     SECRET_KEY = os.getenv("SECRET_KEY")
     
+    # Start workers fast: load the backgrounds in the background instead of at startup
+    LAZY_STARTUP = os.getenv('LAZY_STARTUP', 'false').lower() == 'true'
+    
     # DB configuration
     SQLALCHEMY_DATABASE_URI = os.getenv("DATABASE_URL", "sqlite:///app.db")
     SQLALCHEMY_TRACK_MODIFICATIONS = False
@@ -22,6 +24,7 @@ class Config:
     ADMIN_USERNAME = os.getenv('ADMIN_USERNAME')  
     ADMIN_PASSWORD = os.getenv('ADMIN_PASSWORD') 
     OPENAI_API_KEY = os.getenv('OPENAI_API_KEY') 
+    TOGETHER_API_KEY = os.getenv('TOGETHER_API_KEY')
     
     # Allowed IPs to access the app (Configure IP Address based on location)
     ALLOWED_IPS = ['202.168.65.122', '127.0.0.1']
@@ -30,12 +33,141 @@ class Config:
     ORIGINAL_PHOTO_DIR = 'full_original_photos'
     AI_GENERATED_PHOTO_DIR = 'full_AI_Photos'
     PREVIEW_DIR = 'static/preview_photos'
+    BACKGROUND_DIR = 'static/images'
+    
+    MAX_CAPTURE_BYTES = int(os.getenv('MAX_CAPTURE_BYTES', 20 * 1024 * 1024))  # Largest image accepted by /save_image
+    
+    # Frame sizes in pixels (width, height)
+    FRAME_SIZES = {
+        "frame1": (832, 1184),
+        "frame2": (1664, 1184),
+    }
+    
+    # Frame labels stored on the photos and payments
+    FRAME_LABELS = {
+        "frame1": "7 cm x 10 cm",
+        "frame2": "14 cm x 10 cm",
+    }
+    
+    # Print sizes in centimetres (width, height)
+    FRAME_PRINT_SIZES = {
+        "frame1": (7.0, 10.0),
+        "frame2": (14.0, 10.0),
+    }
+    
+    # Print file rendering, done in a process pool when a photo is paid
+    PRINT_WORKERS = int(os.getenv('PRINT_WORKERS', 2))                  # Processes rendering print files
+    PRINT_DPI = int(os.getenv('PRINT_DPI', 300))                        # Resolution of the print files
+    PRINT_JPEG_QUALITY = int(os.getenv('PRINT_JPEG_QUALITY', 95))       # JPEG quality of the print files
+    PRINT_FORMATS = [f.strip() for f in os.getenv('PRINT_FORMATS', 'jpeg,tiff').split(',') if f.strip()]  # "jpeg" and/or "tiff"
+    BULK_DOWNLOAD_MAX_CODES = int(os.getenv('BULK_DOWNLOAD_MAX_CODES', 100))  # Codes accepted by one admin bulk download
+    
+    # Photo storage executor configuration
+    STORAGE_RETRIES = int(os.getenv('STORAGE_RETRIES', 3))                  # Retries of a failed write or delete
+    STORAGE_RETRY_BACKOFF = float(os.getenv('STORAGE_RETRY_BACKOFF', 0.2))  # Seconds before the first retry, doubled each time
+    STORAGE_FLUSH_TIMEOUT = float(os.getenv('STORAGE_FLUSH_TIMEOUT', 30))   # Seconds to wait for pending writes on shutdown
+    
+    # Expiry sweeper for abandoned PENDING photos
+    EXPIRY_SWEEPER_ENABLED = os.getenv('EXPIRY_SWEEPER_ENABLED', 'true').lower() == 'true'   # Started by the first request, not by CLI commands
+    PHOTO_PENDING_TTL_MINUTES = int(os.getenv('PHOTO_PENDING_TTL_MINUTES', 120))  # Age after which a PENDING photo expires
+    EXPIRY_SWEEP_INTERVAL = float(os.getenv('EXPIRY_SWEEP_INTERVAL', 300))        # Seconds between sweeps
+    EXPIRY_SWEEP_BATCH_SIZE = int(os.getenv('EXPIRY_SWEEP_BATCH_SIZE', 200))      # Photos expired per batch
+    EXPIRY_SWEEP_MAX_BATCHES = int(os.getenv('EXPIRY_SWEEP_MAX_BATCHES', 10))     # Batches per sweep
+    EXPIRY_SWEEP_BATCH_PAUSE = float(os.getenv('EXPIRY_SWEEP_BATCH_PAUSE', 1))    # Seconds to pause between batches
+    
+    # Preview image configuration
+    PREVIEW_JPEG_QUALITY = int(os.getenv('PREVIEW_JPEG_QUALITY', 75))
+    # Long edges (px) of the extra thumbnails written with each preview, e.g. "480,240"
+    PREVIEW_THUMBNAIL_SIZES = [int(size) for size in os.getenv('PREVIEW_THUMBNAIL_SIZES', '').split(',') if size.strip()]
+    
+    # Background registry configuration
+    BACKGROUND_JPEG_QUALITY = int(os.getenv('BACKGROUND_JPEG_QUALITY', 90))     # JPEG quality of the encoded backgrounds
+    BACKGROUND_CHECK_INTERVAL = float(os.getenv('BACKGROUND_CHECK_INTERVAL', 5)) # Seconds between mtime checks of a background
     
     # Hitpay links
-    HITPAY_URL = "https://api.sandbox.hit-pay.com/v1/payment-requests"
+    HITPAY_URL = os.getenv('HITPAY_URL', "https://api.sandbox.hit-pay.com/v1/payment-requests")
+    
+    # Hitpay HTTP client configuration
+    HITPAY_POOL_SIZE = int(os.getenv('HITPAY_POOL_SIZE', 10))                  # Keep-alive connections kept to HitPay
+    HITPAY_RETRIES = int(os.getenv('HITPAY_RETRIES', 2))                       # Retries of connection errors and idempotent calls
+    HITPAY_RETRY_BACKOFF = float(os.getenv('HITPAY_RETRY_BACKOFF', 0.3))       # Backoff factor between retries
+    HITPAY_CONNECT_TIMEOUT = float(os.getenv('HITPAY_CONNECT_TIMEOUT', 3.05))  # Seconds to open a connection
+    HITPAY_CREATE_TIMEOUT = float(os.getenv('HITPAY_CREATE_TIMEOUT', 10))      # Seconds to wait for a created payment request
+    HITPAY_STATUS_TIMEOUT = float(os.getenv('HITPAY_STATUS_TIMEOUT', 5))       # Seconds to wait for a payment request status
+    HITPAY_BREAKER_FAILURES = int(os.getenv('HITPAY_BREAKER_FAILURES', 5))     # Consecutive failures that open the HitPay circuit breaker
+    HITPAY_BREAKER_RESET = float(os.getenv('HITPAY_BREAKER_RESET', 30))        # Seconds the breaker stays open before a probe call
+    HITPAY_MAX_CONCURRENCY = int(os.getenv('HITPAY_MAX_CONCURRENCY', 10))      # HitPay calls running at once
+    HITPAY_MAX_WAITING = int(os.getenv('HITPAY_MAX_WAITING', 10))              # HitPay calls waiting for a free slot, the next ones fail fast
+    HITPAY_WAIT_TIMEOUT = float(os.getenv('HITPAY_WAIT_TIMEOUT', 2))           # Seconds a HitPay call waits for a free slot
+    
+    # Payment webhook and status configuration
+    WEBHOOK_DRAIN_INTERVAL = int(os.getenv('WEBHOOK_DRAIN_INTERVAL', 30))                  # Seconds between checks for unprocessed webhook events
+    PAYMENT_STATUS_WAIT_TIMEOUT = int(os.getenv('PAYMENT_STATUS_WAIT_TIMEOUT', 20))        # Seconds a client waits for the payment status
+    PAYMENT_STATUS_RECHECK_INTERVAL = int(os.getenv('PAYMENT_STATUS_RECHECK_INTERVAL', 10)) # Seconds between database checks of a waiting client, 0 to disable
+    PAYMENT_STATUS_HEARTBEAT = int(os.getenv('PAYMENT_STATUS_HEARTBEAT', 15))              # Seconds between keep-alive comments of the status stream
+    
+    # Download QR code configuration
+    QR_CODE_FORMAT = os.getenv('QR_CODE_FORMAT', 'png')                      # 'png' (pre-scaled, smallest) or 'svg' (sharp at any size)
+    QR_CODE_BOX_SIZE = int(os.getenv('QR_CODE_BOX_SIZE', 6))                 # Pixels per module of the PNG QR codes
+    QR_CODE_BORDER = int(os.getenv('QR_CODE_BORDER', 4))                     # Quiet zone around the QR code, in modules
+    QR_CODE_CACHE_SIZE = int(os.getenv('QR_CODE_CACHE_SIZE', 256))           # QR codes kept in memory
+    SECURE_URL_EXPIRY_BUCKET = int(os.getenv('SECURE_URL_EXPIRY_BUCKET', 60)) # Seconds sharing the same secure link expiry
+    
+    # Secure image delivery
+    SECURE_IMAGE_MAX_AGE = int(os.getenv('SECURE_IMAGE_MAX_AGE', 86400))     # Browser cache seconds, bounded by the link expiry
+    SECURE_IMAGE_SENDFILE = os.getenv('SECURE_IMAGE_SENDFILE', '')           # '', 'x-accel-redirect' (nginx) or 'x-sendfile' (Apache)
+    SECURE_IMAGE_ACCEL_PREFIX = os.getenv('SECURE_IMAGE_ACCEL_PREFIX', '/protected/full_AI_Photos') # Internal nginx location of the AI photos
+    
+    # OpenAI client configuration, the client is created on first use
+    OPENAI_TIMEOUT = float(os.getenv('OPENAI_TIMEOUT', 80))                # Seconds to wait for a generation
+    OPENAI_BREAKER_FAILURES = int(os.getenv('OPENAI_BREAKER_FAILURES', 3))  # Consecutive failures that open the OpenAI circuit breaker
+    OPENAI_BREAKER_RESET = float(os.getenv('OPENAI_BREAKER_RESET', 60))     # Seconds the breaker stays open before a probe call
+    OPENAI_MAX_CONCURRENCY = int(os.getenv('OPENAI_MAX_CONCURRENCY', 3))    # OpenAI calls running at once
+    OPENAI_MAX_WAITING = int(os.getenv('OPENAI_MAX_WAITING', 10))           # OpenAI calls waiting for a free slot, the next ones fail fast
+    OPENAI_WAIT_TIMEOUT = float(os.getenv('OPENAI_WAIT_TIMEOUT', 30))       # Seconds an OpenAI call waits for a free slot
+    
+    # AI generation worker pool
+    GENERATION_WORKERS = int(os.getenv('GENERATION_WORKERS', 3))        # Number of concurrent generations
+    GENERATION_QUEUE_SIZE = int(os.getenv('GENERATION_QUEUE_SIZE', 10))  # Jobs allowed to wait for a free worker
+    GENERATION_JOB_TTL = int(os.getenv('GENERATION_JOB_TTL', 600))       # Seconds a finished job is kept for polling
+    GENERATION_CACHE_DIR = os.getenv('GENERATION_CACHE_DIR', 'instance/generation_cache')                  # Generated images kept for retries
+    GENERATION_FALLBACK_AFTER = float(os.getenv('GENERATION_FALLBACK_AFTER', 75))                         # Seconds before the local cartoon engine answers instead, 0 to disable
+    GENERATION_FALLBACK_ON_ERROR = os.getenv('GENERATION_FALLBACK_ON_ERROR', 'true').lower() == 'true'   # Answer with the local engine when OpenAI is unreachable
+    GENERATION_PRECOMPOSITE = os.getenv('GENERATION_PRECOMPOSITE', '')                                   # '', 'segment' or 'stitch': send OpenAI one composed image
+    PRECOMPOSITE_LONG_EDGE = int(os.getenv('PRECOMPOSITE_LONG_EDGE', 1024))                              # Long edge (px) of the composed image
+    PRECOMPOSITE_JPEG_QUALITY = int(os.getenv('PRECOMPOSITE_JPEG_QUALITY', 90))                          # JPEG quality of the composed image
+    AI_CAPTURE_FORMAT = os.getenv('AI_CAPTURE_FORMAT', 'jpeg')                                           # 'jpeg', 'webp' or 'png' (lossless): format of the capture sent to OpenAI
+    AI_CAPTURE_LONG_EDGE = int(os.getenv('AI_CAPTURE_LONG_EDGE', 1024))                                  # Long edge (px) of the capture sent to OpenAI, 0 to keep its size
+    AI_CAPTURE_QUALITY = int(os.getenv('AI_CAPTURE_QUALITY', 85))                                        # JPEG or WebP quality of the capture sent to OpenAI
+    GENERATION_PARTIAL_IMAGES = int(os.getenv('GENERATION_PARTIAL_IMAGES', 2))                             # Partial images (1-3) streamed to a kiosk that asks for them
+    GENERATION_STREAM_TIMEOUT = int(os.getenv('GENERATION_STREAM_TIMEOUT', 120))                          # Seconds a generation stream stays open
+    GENERATION_STREAM_HEARTBEAT = int(os.getenv('GENERATION_STREAM_HEARTBEAT', 15))                       # Seconds between keep-alive comments of the generation stream
+    GENERATION_CACHE_MAX_BYTES = int(os.getenv('GENERATION_CACHE_MAX_BYTES', 256 * 1024 * 1024))          # Size of the generation cache, 0 to disable
+    
+    # Generation providers, in order: the first gets every job, the next ones hedge and take over its failures
+    GENERATION_PROVIDERS = os.getenv('GENERATION_PROVIDERS', 'openai')                                   # Comma-separated: openai, together, local, stub or stub:<seconds>
+    GENERATION_HEDGE_QUANTILE = float(os.getenv('GENERATION_HEDGE_QUANTILE', 0.9))                       # Latency quantile of a provider after which the next one is tried too
+    GENERATION_HEDGE_AFTER = float(os.getenv('GENERATION_HEDGE_AFTER', 45))                              # Hedging deadline (seconds) until a provider has enough samples, 0 to disable hedging
+    GENERATION_HEDGE_MIN_SAMPLES = int(os.getenv('GENERATION_HEDGE_MIN_SAMPLES', 20))                    # Successful calls needed to use the latency quantile
+    GENERATION_LATENCY_WINDOW = int(os.getenv('GENERATION_LATENCY_WINDOW', 200))                         # Recent calls per provider the quantile is computed on
+    TOGETHER_MODEL = os.getenv('TOGETHER_MODEL', 'black-forest-labs/FLUX.1-kontext-pro')                 # Together image editing model
+    TOGETHER_TIMEOUT = float(os.getenv('TOGETHER_TIMEOUT', 80))                                          # Seconds to wait for a Together generation
+    STUB_PROVIDER_DELAY = float(os.getenv('STUB_PROVIDER_DELAY', 2))                                     # Mean delay (seconds) of the stub provider
+    STUB_PROVIDER_FAILURE_RATE = float(os.getenv('STUB_PROVIDER_FAILURE_RATE', 0))                       # Share of the stub provider calls that fail
+    
+    # Metrics served on /metrics in the Prometheus text format
+    METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+    METRICS_ALLOWED_IPS = [ip.strip() for ip in os.getenv('METRICS_ALLOWED_IPS', '127.0.0.1').split(',') if ip.strip()]  # Scrapers allowed to read /metrics
+    
+    # Local cartoon engine, the fallback and fast mode of the AI generation
+    CARTOON_WORKERS = int(os.getenv('CARTOON_WORKERS', 2))               # Processes rendering cartoon images
+    CARTOON_TIMEOUT = float(os.getenv('CARTOON_TIMEOUT', 20))            # Seconds to wait for a cartoon image
     
-    # OpenAI client configuration
-    client = OpenAI(api_key=OPENAI_API_KEY, timeout=80)
+    # Session storage: 'cookie' (signed cookie), 'sqlite' or 'redis' (the cookie only carries a session id)
+    SESSION_BACKEND = os.getenv('SESSION_BACKEND', 'cookie')
+    SESSION_SQLITE_PATH = os.getenv('SESSION_SQLITE_PATH', 'instance/sessions.db')  # Session database of the sqlite backend
+    SESSION_CACHE_SIZE = int(os.getenv('SESSION_CACHE_SIZE', 1024))                 # Sessions cached in memory by the sqlite backend
+    SESSION_REDIS_URL = os.getenv('SESSION_REDIS_URL', 'redis://localhost:6379/0')  # Redis server of the redis backend
     
 class devConfig(Config):
     DEBUG = True
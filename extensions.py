@@ -1,6 +1,32 @@
 # extensions.py
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
+from services.generation import GenerationQueue
+from services.backgrounds import BackgroundRegistry
+from services.storage import StorageExecutor
+from services.sweeper import ExpirySweeper
+from services.hitpay import HitPayClient
+from services.webhooks import WebhookProcessor
+from services.payment_status import PaymentStatusHub
+from services.qr_codes import QRCodeRenderer
+from services.prints import PrintRenderer
+from services.sessions import ServerSideSessions
+from services.metrics import Metrics
+from services.cartoon import CartoonEngine
+from services.upstreams import UpstreamRegistry
 
 db = SQLAlchemy()
 migrate = Migrate()
+generation_queue = GenerationQueue()
+background_registry = BackgroundRegistry()
+storage = StorageExecutor()
+expiry_sweeper = ExpirySweeper()
+hitpay = HitPayClient()
+webhook_processor = WebhookProcessor()
+payment_status_hub = PaymentStatusHub()
+qr_codes = QRCodeRenderer()
+prints = PrintRenderer()
+server_sessions = ServerSideSessions()
+metrics = Metrics()
+cartoon = CartoonEngine()
+upstreams = UpstreamRegistry()
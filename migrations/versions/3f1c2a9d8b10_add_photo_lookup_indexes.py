@@ -0,0 +1,37 @@
+"""Add photo lookup indexes
+
+Revision ID: 3f1c2a9d8b10
+Revises: 5e0a7c2b19d4
+Create Date: 2026-10-18 12:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c2a9d8b10'
+down_revision = '5e0a7c2b19d4'
+branch_labels = None
+depends_on = None
+
+
+def _existing_indexes(table):
+    return {index['name'] for index in sa.inspect(op.get_bind()).get_indexes(table)}
+
+
+def upgrade():
+    # Tables may already have the indexes when they were created by db.create_all()
+    existing = _existing_indexes('photo')
+    if 'ix_photo_filename_status_type' not in existing:
+        op.create_index('ix_photo_filename_status_type', 'photo', ['filename', 'status', 'type'], unique=False)
+    if 'ix_photo_path' not in existing:
+        op.create_index('ix_photo_path', 'photo', ['path'], unique=False)
+
+
+def downgrade():
+    existing = _existing_indexes('photo')
+    if 'ix_photo_path' in existing:
+        op.drop_index('ix_photo_path', table_name='photo')
+    if 'ix_photo_filename_status_type' in existing:
+        op.drop_index('ix_photo_filename_status_type', table_name='photo')
@@ -0,0 +1,63 @@
+"""Create baseline tables
+
+Revision ID: 5e0a7c2b19d4
+Revises: 
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e0a7c2b19d4'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def _existing_tables():
+    return set(sa.inspect(op.get_bind()).get_table_names())
+
+
+def upgrade():
+    # Databases set up before the migrations already have the tables from db.create_all()
+    existing = _existing_tables()
+    if 'photo' not in existing:
+        op.create_table('photo',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('filename', sa.String(length=100), nullable=False),
+            sa.Column('type', sa.Enum('ORIGINAL', 'AI', name='photo_type_enum'), nullable=False),
+            sa.Column('frame', sa.String(length=50), nullable=False),
+            sa.Column('path', sa.String(length=512), nullable=False),
+            sa.Column('unique_code', sa.String(length=32), nullable=False),
+            sa.Column('date_of_save', sa.DateTime(), nullable=False),
+            sa.Column('status', sa.Enum('PENDING', 'CANCELED', 'PAID', 'FAILED', 'EXPIRED', 'REFUNDED',
+                                        name='photo_status_enum'), nullable=False),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('unique_code')
+        )
+    if 'payment' not in existing:
+        op.create_table('payment',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('payment_request_id', sa.String(length=50), nullable=False),
+            sa.Column('payment_id', sa.String(length=50), nullable=True),
+            sa.Column('reference_id', sa.String(length=50), nullable=False),
+            sa.Column('status', sa.String(length=20), nullable=False),
+            sa.Column('frame', sa.String(length=50), nullable=False),
+            sa.Column('price', sa.Float(), nullable=False),
+            sa.Column('start_time', sa.DateTime(), nullable=False),
+            sa.Column('end_time', sa.DateTime(), nullable=False),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('payment_id'),
+            sa.UniqueConstraint('payment_request_id'),
+            sa.UniqueConstraint('reference_id')
+        )
+
+
+def downgrade():
+    existing = _existing_tables()
+    if 'payment' in existing:
+        op.drop_table('payment')
+    if 'photo' in existing:
+        op.drop_table('photo')
@@ -0,0 +1,30 @@
+"""Add photo status and date index for the expiry sweeper
+
+Revision ID: 8a4e6d2f71c3
+Revises: 3f1c2a9d8b10
+Create Date: 2026-10-18 13:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8a4e6d2f71c3'
+down_revision = '3f1c2a9d8b10'
+branch_labels = None
+depends_on = None
+
+
+def _existing_indexes(table):
+    return {index['name'] for index in sa.inspect(op.get_bind()).get_indexes(table)}
+
+
+def upgrade():
+    if 'ix_photo_status_date_of_save' not in _existing_indexes('photo'):
+        op.create_index('ix_photo_status_date_of_save', 'photo', ['status', 'date_of_save'], unique=False)
+
+
+def downgrade():
+    if 'ix_photo_status_date_of_save' in _existing_indexes('photo'):
+        op.drop_index('ix_photo_status_date_of_save', table_name='photo')
@@ -0,0 +1,42 @@
+"""Add webhook event inbox
+
+Revision ID: c5d91e047b2a
+Revises: 8a4e6d2f71c3
+Create Date: 2026-10-18 14:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5d91e047b2a'
+down_revision = '8a4e6d2f71c3'
+branch_labels = None
+depends_on = None
+
+
+def _existing_tables():
+    return set(sa.inspect(op.get_bind()).get_table_names())
+
+
+def upgrade():
+    if 'webhook_event' not in _existing_tables():
+        op.create_table('webhook_event',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('payment_request_id', sa.String(length=50), nullable=False),
+            sa.Column('payment_id', sa.String(length=50), nullable=True),
+            sa.Column('status', sa.String(length=20), nullable=False),
+            sa.Column('raw_body', sa.Text(), nullable=False),
+            sa.Column('received_at', sa.DateTime(), nullable=False),
+            sa.Column('processed_at', sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('payment_request_id', 'status', name='uq_webhook_event_payment_status')
+        )
+        op.create_index('ix_webhook_event_processed_at', 'webhook_event', ['processed_at'], unique=False)
+
+
+def downgrade():
+    if 'webhook_event' in _existing_tables():
+        op.drop_index('ix_webhook_event_processed_at', table_name='webhook_event')
+        op.drop_table('webhook_event')
@@ -0,0 +1,32 @@
+"""Add payment photo filename
+
+Revision ID: d2b8f4a6c913
+Revises: c5d91e047b2a
+Create Date: 2026-10-18 15:05:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd2b8f4a6c913'
+down_revision = 'c5d91e047b2a'
+branch_labels = None
+depends_on = None
+
+
+def _existing_columns(table):
+    return {column['name'] for column in sa.inspect(op.get_bind()).get_columns(table)}
+
+
+def upgrade():
+    if 'photo_filename' not in _existing_columns('payment'):
+        with op.batch_alter_table('payment', schema=None) as batch_op:
+            batch_op.add_column(sa.Column('photo_filename', sa.String(length=100), nullable=True))
+
+
+def downgrade():
+    if 'photo_filename' in _existing_columns('payment'):
+        with op.batch_alter_table('payment', schema=None) as batch_op:
+            batch_op.drop_column('photo_filename')
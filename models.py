@@ -18,6 +18,14 @@ class PhotoType(enum.Enum):
 
 class Photo(db.Model):
     __tablename__ = "photo"
+    __table_args__ = (
+        # Lookups by filename (fail), filename + status (exit) and filename + status + type (delete_photo)
+        db.Index("ix_photo_filename_status_type", "filename", "status", "type"),
+        # Lookup by path (success)
+        db.Index("ix_photo_path", "path"),
+        # Stale PENDING photos (expiry sweeper)
+        db.Index("ix_photo_status_date_of_save", "status", "date_of_save"),
+    )
     id   = db.Column(db.Integer, primary_key=True)
     filename = db.Column(db.String(100), nullable=False)
     type = db.Column(Enum(PhotoType, name="photo_type_enum"), nullable=False, default=PhotoType.ORIGINAL)
@@ -38,4 +46,19 @@ class Payment(db.Model):
     price = db.Column(db.Float, nullable=False)
     start_time = db.Column(db.DateTime, nullable=False)
     end_time = db.Column(db.DateTime, nullable=False)
-    
+    photo_filename = db.Column(db.String(100), nullable=True)   # AI photo paid for, to prepare its QR code
+
+class WebhookEvent(db.Model):
+    __tablename__ = "webhook_event"
+    __table_args__ = (
+        # One event per payment request and status, retried deliveries are ignored
+        db.UniqueConstraint("payment_request_id", "status", name="uq_webhook_event_payment_status"),
+        db.Index("ix_webhook_event_processed_at", "processed_at"),
+    )
+    id   = db.Column(db.Integer, primary_key=True)
+    payment_request_id = db.Column(db.String(50), nullable=False)
+    payment_id = db.Column(db.String(50), nullable=True)
+    status = db.Column(db.String(20), nullable=False)
+    raw_body = db.Column(db.Text, nullable=False)
+    received_at = db.Column(db.DateTime, nullable=False)
+    processed_at = db.Column(db.DateTime, nullable=True)
@@ -1,6 +1,11 @@
-from flask import Blueprint, render_template, request, redirect, url_for, session, current_app, flash, jsonify
-from utils import get_secure_image_url
+from flask import Blueprint, render_template, request, redirect, url_for, session, current_app, flash, jsonify, Response
+from utils import get_secure_image_url, stream_zip
 from models import Photo, PhotoStatus
+from extensions import prints
+from datetime import datetime, timedelta, UTC
+
+import json
+import os
 
 # routes/admin.py
 
@@ -71,26 +76,117 @@ def download():
     if not photo:
         return jsonify({"error": "Photo Not found"}), 404
     
-    photo_status = photo.status
-    
     # Check if the photo status is PAID
+    status_error = get_photo_status_error(photo.status)
+    if status_error:
+        return jsonify({"error": status_error}), 403
+    print(f"Photo with unique code {unique_code} is paid.")
+    
+    # Generate secure URL for the photo
+    photo_filename = photo.filename
+    secure_url = get_secure_image_url(photo_filename, add_expiration=False, download=False)
+    
+    # Secure URLs of the print files rendered when the photo was paid
+    print_urls = {
+        image_format: get_secure_image_url(os.path.basename(print_path), add_expiration=False, download=True)
+        for image_format, print_path in prints.get_print_paths(photo.path.lstrip("/")).items()
+    }
+    
+    # Send the file as an attachment
+    return jsonify(success=True, url=secure_url, print_urls=print_urls)
+
+@bp.route('/download/bulk', methods=['POST'])
+def bulk_download():
+    """Download the HD photos of several unique codes as one ZIP file (ADMIN ONLY).
+       The archive is streamed and starts with report.json, the status of every code.
+
+    Returns:
+        Response: Streamed ZIP file, or JSON with the per-code report if no photo can be downloaded.
+    """
+    if session.get("is_admin") != True:
+        return jsonify({"error": "Admin login required"}), 403
+    
+    data = request.get_json(silent=True) or {}
+    file_format = data.get("file_format", "original")
+    if file_format not in ("original", *prints.formats):
+        return jsonify({"error": "Invalid file format"}), 400
+    
+    # Normalise the codes and drop the duplicates, keeping their order
+    codes = data.get("unique_codes") or []
+    if isinstance(codes, str):
+        codes = codes.replace(",", " ").split()
+    codes = list(dict.fromkeys(str(code).strip().upper() for code in codes if str(code).strip()))
+    if not codes:
+        return jsonify({"error": "Unique Codes are Required"}), 400
+    max_codes = current_app.config["BULK_DOWNLOAD_MAX_CODES"]
+    if len(codes) > max_codes:
+        return jsonify({"error": f"At most {max_codes} codes can be downloaded at once"}), 400
+    
+    # Resolve every code with one query
+    photos = {
+        photo.unique_code: photo
+        for photo in Photo.query.filter(Photo.unique_code.in_(codes)).all()
+    }
+    
+    report = []
+    entries = []
+    for code in codes:
+        photo = photos.get(code)
+        if not photo:
+            report.append({"unique_code": code, "status": "error", "error": "Photo Not found"})
+            continue
+        
+        status_error = get_photo_status_error(photo.status)
+        if status_error:
+            report.append({"unique_code": code, "status": "error", "error": status_error})
+            continue
+        
+        # Use the print file if asked and ready, else the original photo
+        path = photo.path.lstrip("/")
+        file_used = "original"
+        if file_format != "original":
+            print_path = prints.get_print_paths(path).get(file_format)
+            if print_path:
+                path, file_used = print_path, file_format
+        
+        if not os.path.exists(path):
+            report.append({"unique_code": code, "status": "error", "error": "Photo file not found"})
+            continue
+        
+        filename = f"{code}_{os.path.basename(path)}"
+        report.append({"unique_code": code, "status": "ok", "file": filename, "format": file_used})
+        entries.append((filename, path))
+    
+    if not entries:
+        return jsonify({"error": "No photo can be downloaded", "report": report}), 404
+    
+    print(f"Bulk download of {len(entries)} of {len(codes)} photos.")
+    entries.insert(0, ("report.json", json.dumps(report, indent=2).encode("utf-8")))
+    archive_name = f"photos_{(datetime.now(UTC) + timedelta(hours=8)).strftime('%Y%m%d_%H%M%S')}.zip"
+    response = Response(stream_zip(entries), mimetype="application/zip")
+    response.headers.set("Content-Disposition", "attachment", filename=archive_name)
+    response.headers["X-Accel-Buffering"] = "no"   # Do not let a proxy buffer the archive
+    return response
+
+def get_photo_status_error(photo_status):
+    """Get the reason a photo cannot be downloaded.
+
+    Args:
+        photo_status (PhotoStatus): Status of the photo.
+
+    Returns:
+        str: Error message, or None if the photo is paid.
+    """
     match photo_status:
         case PhotoStatus.PAID:
-            print(f"Photo with unique code {unique_code} is paid.")
+            return None
         case PhotoStatus.EXPIRED:
-            return jsonify({"error": "The Photo has Expired. Unable to Download."}), 403
+            return "The Photo has Expired. Unable to Download."
         case PhotoStatus.FAILED:
-            return jsonify({"error": "The Photo's Payment Failed. Unable to Download."}), 403
+            return "The Photo's Payment Failed. Unable to Download."
         case PhotoStatus.CANCELED:
-            return jsonify({"error": "The Photo's Payment was Canceled. Unable to Download."}), 403
+            return "The Photo's Payment was Canceled. Unable to Download."
         case PhotoStatus.PENDING:
-            return jsonify({"error": "The Photo is still Pending Payment. Unable to Download."}), 403
+            return "The Photo is still Pending Payment. Unable to Download."
         case _:
-            return jsonify({"error": "Invalid Photo Status. Unable to Download."}), 403
-    
-    # Generate secure URL for the photo
-    photo_filename = photo.filename
-    secure_url = get_secure_image_url(photo_filename, add_expiration=False, download=False)
-    
-    # Send the file as an attachment
-    return jsonify(success=True, url=secure_url)
\ No newline at end of file
+            return "Invalid Photo Status. Unable to Download."
@@ -1,4 +1,7 @@
-from flask import Blueprint, render_template
+from flask import Blueprint, jsonify, render_template
+from services.upstreams import UpstreamUnavailable
+
+import math
 
 bp = Blueprint("error", __name__)
 
@@ -15,4 +18,11 @@ def not_found_error(error):
 @bp.app_errorhandler(500)
 def internal_error(error):
     """Handle 500 Internal Server Errors by rendering the 500 error page."""
-    return render_template('500.html'), 500
\ No newline at end of file
+    return render_template('500.html'), 500
+
+@bp.app_errorhandler(UpstreamUnavailable)
+def upstream_unavailable(error):
+    """Handle a call refused by the circuit breaker or bulkhead of an upstream API with a 503."""
+    response = jsonify({"error": str(error), "upstream": error.upstream, "reason": error.reason})
+    response.headers["Retry-After"] = str(math.ceil(error.retry_after))
+    return response, 503
@@ -1,11 +1,10 @@
 from flask import render_template, request, redirect, url_for, session, Blueprint, current_app
-from tkinter import *
-from utils import clear_session
+from utils import clear_session, remove_preview_image
 from models import db
 from models import Photo, PhotoStatus
+from extensions import storage
 
 import uuid
-import os
 
 
 bp = Blueprint("main", __name__, template_folder="templates", static_folder="static")
@@ -63,14 +62,10 @@ def exit_app():
         db.session.commit()
         
         # Remove the HD photo from the server if it exists
-        if os.path.exists(full_image_original_filename_url):
-            os.remove(full_image_original_filename_url)
-            print(f"HD photo {full_image_original_filename_url} deleted from server.")
+        storage.delete(full_image_original_filename_url)
         
         # Remove the preview photo from the server if it exists
-        if os.path.exists(preview_image_filename_url):
-            os.remove(preview_image_filename_url)
-            print(f"Preview photo {preview_image_filename_url} deleted from server.")
+        remove_preview_image(preview_image_filename_url)
     
     # Process of deleting the AI photo only for pending status (if the customer leaves the page without payment)
     current_photo_ai = Photo.query.filter_by(filename=full_image_ai_filename, status=PhotoStatus.PENDING).first()
@@ -81,9 +76,7 @@ def exit_app():
         db.session.commit()
         
         # Remove the AI photo from the server if it exists
-        if os.path.exists(full_image_ai_filename_url):
-            os.remove(full_image_ai_filename_url)
-            print(f"AI photo {full_image_ai_filename_url} deleted from server.")
+        storage.delete(full_image_ai_filename_url)
     
     # Clear the session data
     clear_session()
@@ -0,0 +1,34 @@
+from flask import Blueprint, Response, abort, current_app, jsonify, request
+from extensions import metrics, upstreams
+
+bp = Blueprint("metrics", __name__)
+
+# Only let the configured scrapers read the metrics
+@bp.before_request
+def limit_remote_address():
+    """Check if the request is from an allowed metrics scraper."""
+    if request.remote_addr not in current_app.config["METRICS_ALLOWED_IPS"]:
+        print(f"Metrics access denied for IP: {request.remote_addr}")
+        abort(403)
+
+@bp.route('/metrics')
+def metrics_endpoint():
+    """Serve the metrics of this worker process in the Prometheus text format.
+
+    Returns:
+        Response: Metrics exposition, or 404 when METRICS_ENABLED is off.
+    """
+    if not metrics.enabled:
+        abort(404)
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4; charset=utf-8")
+
+@bp.route('/metrics/upstreams')
+def upstreams_endpoint():
+    """Serve the circuit breaker and bulkhead state of each upstream API of this worker process.
+
+    Returns:
+        Response: JSON object of the upstream states by name, or 404 when METRICS_ENABLED is off.
+    """
+    if not metrics.enabled:
+        abort(404)
+    return jsonify(upstreams.snapshot())
@@ -1,15 +1,17 @@
-from flask import Blueprint, redirect, url_for, render_template, session, abort, current_app, jsonify, request
-from utils import verify_hitpay_signature, get_secure_image_url
+from flask import Blueprint, redirect, url_for, render_template, session, abort, current_app, jsonify, request, Response, stream_with_context
+from utils import verify_hitpay_signature, remove_preview_image
 from models import Photo, PhotoStatus, Payment, db  
 from datetime import datetime, timedelta, UTC
-from io import BytesIO
+from extensions import hitpay, webhook_processor, payment_status_hub, qr_codes, prints
+from services.webhooks import record_webhook_event
+from services.payment_status import FINAL_PAYMENT_STATUSES
+from services.upstreams import UpstreamUnavailable
+from sqlalchemy import select
 
-import qrcode
-import base64
-import requests
 import uuid
-import os
 import secrets
+import json
+import time
 
 bp = Blueprint("payment", __name__)
 
@@ -43,11 +45,10 @@ def payment_summary():
         abort(404)
         
     selected_size = session.get('photo_size')
+    frame_data = current_app.config["FRAME_LABELS"].get(selected_size, "")
     if selected_size == "frame1":
-        frame_data = "7 cm x 10 cm"
         price = "10.00"  
     elif selected_size == "frame2":
-        frame_data = "14 cm x 10 cm" 
         price = "20.00"
         
     # Store the frame data and price in the session    
@@ -86,15 +87,8 @@ def create_payment_request():
         return jsonify({"error": "Price not found in session"}), 400
     
     reference_id = "REF-" + str(uuid.uuid4())[:8].upper()
-    url = current_app.config["HITPAY_URL"]                                          # Use the Hitpay URL from the config
     redirect_url = url_for("payment.redirect_user", _external=True)                       # Use the Hitpay redirect URL from the config
     
-    headers = {
-        "X-BUSINESS-API-KEY": current_app.config["HITPAY_API_KEY"],                 # Use the Hitpay API key from the config
-        "X-Requested-With": "XMLHttpRequest",
-        "Content-Type": "application/x-www-form-urlencoded"
-    }
-    
     payload = {
         "amount": str(price),                                                       # Example amount for testing, adjust as needed
         "currency": "SGD",                                                          # For testing, use SGD. Other currencies not supported in sandbox
@@ -105,8 +99,8 @@ def create_payment_request():
         "send_email": True                                                         # Send email notification
     }
 
-    # Send post request to Hitpay API to create payment request
-    response = requests.post(url, headers=headers, data=payload, timeout=10) 
+    # Send post request to Hitpay API to create payment request, over the pooled HitPay session
+    response = hitpay.create_payment_request(payload)
 
     if response.status_code == 201:
         payment_data = response.json()
@@ -117,7 +111,8 @@ def create_payment_request():
             frame=frame_data,
             price=float(price), 
             start_time=datetime.now(UTC) + timedelta(hours=8),
-            end_time=datetime.now(UTC) + timedelta(hours=8) + timedelta(minutes=10) # Set end time to 10 minutes later to avoid null error
+            end_time=datetime.now(UTC) + timedelta(hours=8) + timedelta(minutes=10), # Set end time to 10 minutes later to avoid null error
+            photo_filename=session.get('full_image_ai_filename')
         )
         db.session.add(payment_database)
         db.session.commit()
@@ -158,6 +153,8 @@ def pay():
         else:
             return jsonify({"error": "Failed to create payment request"}), 400
         
+    except UpstreamUnavailable:
+        raise                                   # 503 with Retry-After, see routes/error.py
     except Exception as e:
         print("❌ Internal Server Error:", e)
         return jsonify({"error": "Internal server error", "detail": str(e)}), 500  
@@ -201,7 +198,7 @@ def webhook():
         return jsonify({"status": "failed", "message": "Invalid Signature"}), 400
     
     # Extract payment ID and status from the payload
-    payload = request.get_json()
+    payload = request.get_json(silent=True)
     
     # Process the webhook event
     print(f"Received event {event_type} on object {event_obj}: {payload}")
@@ -215,58 +212,113 @@ def webhook():
     payment_request_id = payload.get('payment_request_id')
     status = payload.get('status')
     
-    # Check the payment status
-    if payment_id and status:
-        print(f"Payment ID: {payment_id}, Status: {status}")
-        
-        # Update the payment status in the database
-        current_payment = Payment.query.filter_by(payment_request_id=payment_request_id).first()
-        if current_payment:
-            current_payment.status = status  
-            current_payment.payment_id = payment_id
-            current_payment.end_time = datetime.now(UTC) + timedelta(hours=8)
-            db.session.commit()
-            session['payment_request_id'] = payment_request_id
-            
-            if status == 'succeeded':
-                print("Payment successful!")
-                return jsonify({"status": "success", "message": "Payment successful"}), 200
-            elif status == 'refunded':
-                print("Payment refunded.")
-                return jsonify({"status": "refunded", "message": "Payment refunded"}), 200
-        
-        print("Payment failed or pending.")
-        return jsonify({"status": "failed", "message": "Payment failed or pending"}), 400
+    if not (payment_request_id and status):
+        print("❌ Missing payment request ID or status")
+        return jsonify({"error": "Missing payment request ID or status"}), 400
+    
+    # Store the event in the inbox and let the webhook processor apply it to the payment
+    if not record_webhook_event(payment_request_id, payment_id, status, raw_body):
+        print(f"Duplicate webhook event for {payment_request_id} ({status}), ignored.")
+        return jsonify({"status": "duplicate"}), 200
+    
+    webhook_processor.notify(payment_request_id)
+    return jsonify({"status": "accepted"}), 200
         
 @bp.route('/payment-status', methods=['GET'])
 def payment_status():
     """Retrieve the payment status based on the payment request ID.
+       With the "wait" argument, wait up to that many seconds for the status to change (long-poll).
 
     Returns:
         Response: JSON response containing the payment status or an error message.
     """
     payment_request_id = request.args.get('payment_request_id')
+    wait = request.args.get('wait', 0, type=float)
     
     if not payment_request_id:
         return jsonify({"error": "Payment Request ID is required"}), 400
     
-    # Check if the payment ID exists in the store
-    record = Payment.query.filter_by(payment_request_id=payment_request_id).first()  
-    if not record:
+    status = get_payment_status(payment_request_id)
+    if status is None:
         print(f"Payment Request ID {payment_request_id} not found in database.")
         return jsonify({"error": "Payment Request ID not found"}), 404
     
-    # Get the status from the record
-    status = None
-    if record:
-        status = record.status
+    # Long-poll: hold the request until the status changes or the wait is over
+    if wait > 0 and status not in FINAL_PAYMENT_STATUSES:
+        timeout = min(wait, current_app.config["PAYMENT_STATUS_WAIT_TIMEOUT"])
+        status = payment_status_hub.wait(payment_request_id, status, timeout) or status
 
-    if status:
-        print(f"Payment ID: {payment_request_id}, Status: {status}")
+    print(f"Payment ID: {payment_request_id}, Status: {status}")
+    if session.get("payment_request_id") != payment_request_id:
         session["payment_request_id"] = payment_request_id
-        return jsonify({"payment_request_id": payment_request_id, "status": status}), 200
-    else:
-        return jsonify({"payment_request_id": payment_request_id, "status": "pending"}), 404   
+    return jsonify({"payment_request_id": payment_request_id, "status": status}), 200
+
+@bp.route('/payment-status/stream', methods=['GET'])
+def payment_status_stream():
+    """Stream the payment status changes as Server-Sent Events, until a final status or the timeout.
+
+    Returns:
+        Response: Event stream with a "status" event per change, or a "timeout" event at the end.
+    """
+    payment_request_id = request.args.get('payment_request_id')
+    
+    if not payment_request_id:
+        return jsonify({"error": "Payment Request ID is required"}), 400
+    
+    status = get_payment_status(payment_request_id)
+    if status is None:
+        print(f"Payment Request ID {payment_request_id} not found in database.")
+        return jsonify({"error": "Payment Request ID not found"}), 404
+    
+    # The session cookie is sent with the headers, so update it before streaming
+    if session.get("payment_request_id") != payment_request_id:
+        session["payment_request_id"] = payment_request_id
+    
+    timeout = current_app.config["PAYMENT_STATUS_WAIT_TIMEOUT"]
+    heartbeat = current_app.config["PAYMENT_STATUS_HEARTBEAT"]
+    
+    def events(status):
+        deadline = time.monotonic() + timeout
+        yield status_event(payment_request_id, status)
+        while status not in FINAL_PAYMENT_STATUSES:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                yield "event: timeout\ndata: {}\n\n"
+                return
+            new_status = payment_status_hub.wait(payment_request_id, status, min(remaining, heartbeat))
+            if new_status is None:
+                yield ": keep-alive\n\n"
+            else:
+                status = new_status
+                yield status_event(payment_request_id, status)
+    
+    response = Response(stream_with_context(events(status)), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"   # Do not let a proxy buffer the stream
+    return response
+
+def get_payment_status(payment_request_id):
+    """Get the status of a payment request from the database.
+
+    The database connection is returned to the pool right after, since the callers
+    then hold the request open while they wait for a change.
+
+    Args:
+        payment_request_id (str): HitPay payment request id.
+
+    Returns:
+        str: Payment status, or None if the payment request does not exist.
+    """
+    status = db.session.execute(
+        select(Payment.status).filter_by(payment_request_id=payment_request_id)
+    ).scalar_one_or_none()
+    db.session.close()
+    return status
+
+def status_event(payment_request_id, status):
+    """Format a payment status as a Server-Sent Event."""
+    data = json.dumps({"payment_request_id": payment_request_id, "status": status})
+    return f"event: status\ndata: {data}\n\n"
     
 @bp.route('/fail')
 def fail():
@@ -341,35 +393,26 @@ def success():
     current_photo = Photo.query.filter_by(path=image_url).first()  
     if current_photo:
         print(f"Current photo found: {current_photo.path}")
+        already_paid = current_photo.status == PhotoStatus.PAID
         current_photo.status = PhotoStatus.PAID
         db.session.commit()
+        
+        # Render the print files in the background, once per photo
+        if not already_paid:
+            prints.submit(current_photo.path.lstrip("/"), current_photo.frame)
     else:
         print("❌ Current photo not found in database.") 
     print(f"Image URL: {image_url}")  # Debug
     
     # Remove the preview image from the server
-    if os.path.exists(preview_image_url):
-        os.remove(preview_image_url)  # Remove the preview image from the server     
+    remove_preview_image(preview_image_url)
     
-    qr_base64 = None
+    qr_code = None
     if image_url:
-        # Generate a QR code with a secure URL to the image
-        secure_url = get_secure_image_url(image_filename, add_expiration=True, download=True)
-        print(f"Secure URL generated: {secure_url}")
-        qr = qrcode.QRCode(version=1, box_size=6, border=4)
-        qr.add_data(secure_url)
-        qr.make(fit=True)
-        img = qr.make_image(fill='black', back_color='white')
-        
-        # Save QR code to a bytes buffer
-        buffer = BytesIO()
-        img.save(buffer, "PNG")
-        buffer.seek(0)
-        
-        # Convert QR code to base64 for embedding in HTML
-        qr_base64 = base64.b64encode(buffer.getvalue()).decode('ascii')
+        # Get the QR code of the secure URL to the image, usually prepared when the webhook arrived
+        qr_code = qr_codes.get_download_qr_code(image_filename)
         
-    return render_template('success.html', qr_code=qr_base64, index=False, photo=current_photo)    
+    return render_template('success.html', qr_code=qr_code, index=False, photo=current_photo)    
 
 @bp.route('/redirect', methods=['GET'])
 def redirect_user():
@@ -405,10 +448,12 @@ def redirect_user():
             current_payment.status = 'canceled'
             current_payment.end_time = datetime.now(UTC) + timedelta(hours=8)
             db.session.commit()
+            payment_status_hub.publish(payment_request_id, 'canceled')
             
         if current_photo:
             current_photo.status = PhotoStatus.CANCELED
             db.session.commit()
   
     print(request.args.to_dict())
-    return render_template('redirect.html', payment_request_id=payment_request_id, payment_status=status_param, index=False)
\ No newline at end of file
+    return render_template('redirect.html', payment_request_id=payment_request_id, payment_status=status_param,
+                           status_timeout=current_app.config["PAYMENT_STATUS_WAIT_TIMEOUT"], index=False)
\ No newline at end of file
@@ -7,31 +7,44 @@ from flask import (
     url_for,
     jsonify,
     current_app,
-    send_file,
+    send_from_directory,
+    Response,
+    stream_with_context,
 )
 from models import Photo, db, PhotoStatus, PhotoType
 from datetime import datetime, timedelta, UTC
 from PIL import Image, ImageDraw, ImageFont
 from utils import (
-    encode_image,
-    encode_image_to_data_url,
     is_valid_base64,
     save_image_to_db,
     save_preview_image,
+    remove_preview_image,
+    record_photo,
+    stream_image_to_file,
+    read_image_stream,
+    InvalidImageUpload,
 )
+from extensions import generation_queue, background_registry, storage
+from services.backgrounds import UnknownBackground
+from services.generation import GenerationJob, GenerationQueueFull, generation_cache_key
+from services.upstreams import UpstreamUnavailable
+from werkzeug.exceptions import NotFound
+from urllib.parse import quote
 
-import jwt
 import base64
+import json
 import time
 import string
 import secrets
-import requests
 import os
-import socket
+import mimetypes
 
 # Blueprint for photo-related routes
 bp = Blueprint("photo", __name__)
 
+# Content types accepted as a raw image request body
+BINARY_IMAGE_MIMETYPES = ("application/octet-stream", "image/png", "image/jpeg", "image/webp")
+
 
 # Choose print size for photo
 @bp.route("/choose_size")
@@ -65,12 +78,8 @@ def set_size():
     session["photo_size"] = selected_size
 
     # Set the width and height based on the selected size
-    if selected_size == "frame1":
-        image_width = 832
-        image_height = 1184
-    elif selected_size == "frame2":
-        image_width = 1664
-        image_height = 1184
+    if selected_size in current_app.config["FRAME_SIZES"]:
+        image_width, image_height = current_app.config["FRAME_SIZES"][selected_size]
 
     # Store the selected size in the session
     session["image_width"] = image_width
@@ -133,17 +142,15 @@ def preview():
 
 @bp.route("/upload", methods=["POST"])
 def upload():
-    """Upload an image and generate a pixar-style photo using the ChatGPT/Together API.
+    """Queue a pixar-style generation of the uploaded image using the ChatGPT API.
+
+    With "stream": true, OpenAI also sends partial images while it generates, which
+    are relayed on the stream_url of the job.
 
     Returns:
-        Response: JSON response containing the generated image URL or an error message.
+        Response: JSON response containing the generation job id and stream URL or an error message.
     """
     try:
-        # Initialize OpenAI client
-        client = current_app.config["OPENAI_CLIENT"]
-        if not client:
-            return jsonify({"error": "OpenAI client cannot be initialized"}), 500
-
         # Request data from the client
         data = request.get_json()
 
@@ -152,85 +159,138 @@ def upload():
             print("❌ No image data provided.")
             return "No image data provided", 400
 
-        # Encode the image and background image to base64
-        encoded_background_image = encode_image(
-            os.path.join("static/images/", data.get("background_filename"))
-        )
+        # "fast" only uses the local cartoon engine, "ai" the OpenAI image model
+        mode = data.get("mode", GenerationJob.AI)
+        if mode not in (GenerationJob.AI, GenerationJob.FAST):
+            return jsonify({"error": f"Unknown generation mode: {mode}"}), 400
+
+        # Get the pre-encoded background image for the selected frame
+        photo_size = session.get("photo_size")
+        try:
+            background_data_url = background_registry.get_data_url(
+                data.get("background_filename"), photo_size
+            )
+        except UnknownBackground as e:
+            print(f"❌ {e}")
+            return jsonify({"error": str(e)}), 400
 
         # Check if the image is a valid base64 string
-        if is_valid_base64(data.get("image")):
-            encoded_image = encode_image_to_data_url(data.get("image"))
+        image = data.get("image")
+        if is_valid_base64(image):
+            capture = base64.b64decode(image.split(",", 1)[-1])
         else:
-            encoded_image = encode_image(data.get("image"))
+            # The capture may still be queued in the storage executor
+            capture = storage.read(image)
+
+        # A retry of the same capture gets the running or cached generation back
+        cache_key = None
+        if mode == GenerationJob.AI:
+            cache_key = generation_cache_key(capture, background_data_url, photo_size, generation_queue.precomposite)
+            job = generation_queue.find(session.get("session_id"), cache_key, photo_size)
+            if job is not None:
+                print(f"Generation job {job.id} reused for the same capture.")
+                return jsonify(job_response(job)), 202
+
+        # Fail fast while the circuit breakers of every provider are open and nothing falls back
+        if mode == GenerationJob.AI and not generation_queue.fallback_on_error:
+            retry_after = generation_queue.router.retry_after()
+            if retry_after is not None:
+                raise UpstreamUnavailable("AI generation", "circuit_open", retry_after)
+
+        # The capture is sent as it is, the worker prepares it for OpenAI (AI_CAPTURE_*)
+        encoded_image = base64.b64encode(capture).decode("utf-8")
+
+        # Queue the generation, the worker pool calls the ChatGPT API
+        job = generation_queue.submit(
+            session.get("session_id"),
+            encoded_image,
+            background_data_url,
+            photo_size,
+            cache_key=cache_key,
+            mode=mode,
+            stream=bool(data.get("stream")),
+        )
+        print(f"Generation job {job.id} queued.")
+        return jsonify(job_response(job)), 202
+    except GenerationQueueFull as e:
+        print("❌ Generation queue is full")
+        return jsonify({"error": str(e)}), 503
+    except UpstreamUnavailable:
+        raise                                   # 503 with Retry-After, see routes/error.py
 
-        # Retrieve current session requested photo width and height
-        photo_size = session.get("photo_size")
+    except Exception as e:
+        print(f"❌ API Error: {e}")
+        return jsonify({"error": str(e)}), 500
 
-        # Set the prompt text for the image generation
-        prompt_text = (
-            "Change the style of this image into a 3D pixar-style image. "
-            "Use the second image as the background image for the first image. "
-            "Make it look cartoonish."
-        )
 
-        # Call ChatGPT API to generate the image
-        response = client.responses.create(
-            model="gpt-4o-mini",
-            input=[
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "input_text", "text": prompt_text},
-                        {
-                            "type": "input_image",
-                            "image_url": f"data:image/png;base64,{encoded_image}",
-                        },
-                        {
-                            "type": "input_image",
-                            "image_url": f"data:image/png;base64,{encoded_background_image}",
-                        },
-                    ],
-                }
-            ],
-            tools=[
-                {
-                    "type": "image_generation",
-                    "size": "1024x1536" if photo_size == "frame1" else "1536x1024",
-                    "quality": "medium",  # medium quality for faster response
-                }
-            ],
-        )
+@bp.route("/upload/<job_id>", methods=["GET"])
+def upload_status(job_id):
+    """Get the status of a generation job queued by /upload.
 
-        # DEBUG: Print the response from the API
-        print("Image has been successfully generated.")
-
-        # Extract the image URL
-        image_outputs = [
-            output
-            for output in response.output
-            if output.type == "image_generation_call"
-        ]
-        if image_outputs:
-            image_base64 = image_outputs[0].result
-            image_url = f"data:image/png;base64,{image_base64}"
-            return jsonify({"image_url": image_url})
-        else:
-            return jsonify({"error": "No image generated"}), 400
-    except requests.exceptions.Timeout:
-        print("❌ Request to OpenAI timed out")
-        return jsonify({"error": "The request to OpenAI timeout"}), 503
+    Returns:
+        Response: JSON response with the job status, the generated image URL or an error message.
+    """
+    job = generation_queue.get(job_id, session_id=session.get("session_id"))
+    if not job:
+        return jsonify({"error": "Generation job not found"}), 404
 
-    except requests.exceptions.ConnectionError:
-        print("❌ Network error")
-        return jsonify({"error": "Network Connection Error"}), 503
+    if job.status == GenerationJob.FAILED:
+        return jsonify(job.to_dict()), job.http_status
+    return jsonify(job.to_dict()), 200
 
-    except socket.timeout:
-        print("❌ Socket timeout")
-        return jsonify({"error": "Socket Timeout"}), 504
 
-    except Exception as e:
-        print(f"❌ API Error: {e}")
-        return jsonify({"error": str(e)}), 500
+@bp.route("/upload/<job_id>/stream", methods=["GET"])
+def upload_stream(job_id):
+    """Stream the progress of a generation job as Server-Sent Events.
+
+    Sends a "partial" event with each partial image received from OpenAI, a "status"
+    event when the job starts running, and a "done" event with the result, as
+    returned by /upload/<job_id>, when it finishes.
+
+    Returns:
+        Response: Event stream of the job, or a JSON error if it does not exist.
+    """
+    job = generation_queue.get(job_id, session_id=session.get("session_id"))
+    if not job:
+        return jsonify({"error": "Generation job not found"}), 404
+
+    timeout = current_app.config["GENERATION_STREAM_TIMEOUT"]
+    heartbeat = current_app.config["GENERATION_STREAM_HEARTBEAT"]
+
+    def events():
+        deadline = time.monotonic() + timeout
+        progress = None
+        while True:
+            status, partial_index = job.progress
+            if job.done:
+                yield f"event: done\ndata: {json.dumps(job.to_dict())}\n\n"
+                return
+            partial_image = job.partial_image_base64
+            if partial_image and (progress is None or partial_index != progress[1]):
+                data = json.dumps({"index": partial_index, "image_url": f"data:image/png;base64,{partial_image}"})
+                yield f"event: partial\ndata: {data}\n\n"
+            elif progress is None or status != progress[0]:
+                yield f"event: status\ndata: {json.dumps({'job_id': job.id, 'status': status})}\n\n"
+            progress = (status, partial_index)
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                yield "event: timeout\ndata: {}\n\n"
+                return
+            if not generation_queue.wait(job, progress, min(remaining, heartbeat)):
+                yield ": keep-alive\n\n"
+
+    response = Response(stream_with_context(events()), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"   # Do not let a proxy buffer the stream
+    return response
+
+
+def job_response(job):
+    """Body of the /upload response: the job status and the URL of its event stream."""
+    data = job.to_dict()
+    data["stream_url"] = url_for("photo.upload_stream", job_id=job.id)
+    return data
 
 
 # Capture Photo
@@ -238,6 +298,10 @@ def upload():
 def save_image(method):
     """Save the captured image from the request to the server.
 
+    The image can be sent as raw bytes (image/* or application/octet-stream body),
+    as a multipart upload with an "image" file field, or as a base64 data URL in
+    a JSON body.
+
     Returns:
         Response: JSON response with the filename of the saved image or an error message.
     """
@@ -245,17 +309,33 @@ def save_image(method):
     if method not in ["preview", "full", "ai"]:
         return jsonify({"error": "Invalid method specified"}), 400
 
-    data = request.get_json()
-    image_data = data.get("image")
-    if not image_data:
-        return jsonify({"error": "No Image Provided"}), 400
+    # Binary upload, either multipart or the raw request body
+    max_bytes = current_app.config["MAX_CAPTURE_BYTES"]
+    image_stream = None
+    if request.mimetype == "multipart/form-data":
+        image_file = request.files.get("image")
+        if not image_file:
+            return jsonify({"error": "No Image Provided"}), 400
+        image_stream = image_file.stream
+    elif request.mimetype in BINARY_IMAGE_MIMETYPES:
+        if request.content_length and request.content_length > max_bytes:
+            return jsonify({"error": f"Image is larger than {max_bytes} bytes"}), 413
+        image_stream = request.stream
+
+    image_data = None
+    if image_stream is None:
+        data = request.get_json()
+        image_data = data.get("image")
+        if not image_data:
+            return jsonify({"error": "No Image Provided"}), 400
 
-    try:
-        header, base64_image = image_data.split(",", 1)
-    except ValueError:
-        return jsonify({"error": "Invalid base64 image format"}), 400
+        try:
+            header, base64_image = image_data.split(",", 1)
+        except ValueError:
+            return jsonify({"error": "Invalid base64 image format"}), 400
+
+        image_data = base64.b64decode(base64_image)
 
-    image_data = base64.b64decode(base64_image)
     timestamp = time.strftime("%d%m%Y-%H%M%S")
     directories = {
         "original": current_app.config["ORIGINAL_PHOTO_DIR"],
@@ -263,24 +343,46 @@ def save_image(method):
         "ai": current_app.config["AI_GENERATED_PHOTO_DIR"],
     }
 
-    if method == "full":
-        save_path = f"{directories['original']}/photo_{timestamp}.png"
-        save_image_to_db(save_path, image_data, timestamp, method)
-        session["full_image_original_filename_url"] = save_path
-        session["full_image_original_filename"] = f"photo_{timestamp}.png"
-        return jsonify({"full_image_original_filename_url": save_path}), 200
-    elif method == "preview":
-        save_path = f"{directories['preview']}/photo_{timestamp}.jpeg"
-        save_preview_image(save_path, image_data)
-        session["preview_image_filename_url"] = save_path
-        session["preview_image_filename"] = f"photo_{timestamp}.jpeg"
-        return jsonify({"preview_image_filename_url": save_path}), 200
-    elif method == "ai":
-        save_path = f"{directories['ai']}/photo_{timestamp}.png"
-        save_image_to_db(save_path, image_data, timestamp, method)
-        session["full_image_ai_filename_url"] = save_path
-        session["full_image_ai_filename"] = f"photo_{timestamp}.png"
-        return jsonify({"full_image_ai_filename_url": save_path}), 200
+    try:
+        if method == "full":
+            save_path = f"{directories['original']}/photo_{timestamp}.png"
+            photo = save_capture(save_path, image_stream, image_data, timestamp, method)
+            session["full_image_original_filename_url"] = save_path
+            session["full_image_original_filename"] = f"photo_{timestamp}.png"
+            return jsonify({"full_image_original_filename_url": save_path, "photo_id": photo.id}), 200
+        elif method == "preview":
+            save_path = f"{directories['preview']}/photo_{timestamp}.jpeg"
+            if image_stream is not None:
+                image_data = read_image_stream(image_stream, max_bytes)
+            save_preview_image(save_path, image_data)
+            session["preview_image_filename_url"] = save_path
+            session["preview_image_filename"] = f"photo_{timestamp}.jpeg"
+            return jsonify({"preview_image_filename_url": save_path}), 200
+        elif method == "ai":
+            save_path = f"{directories['ai']}/photo_{timestamp}.png"
+            photo = save_capture(save_path, image_stream, image_data, timestamp, method)
+            session["full_image_ai_filename_url"] = save_path
+            session["full_image_ai_filename"] = f"photo_{timestamp}.png"
+            return jsonify({"full_image_ai_filename_url": save_path, "photo_id": photo.id}), 200
+    except InvalidImageUpload as e:
+        print(f"❌ Invalid image upload: {e}")
+        return jsonify({"error": str(e)}), e.http_status
+
+
+def save_capture(save_path, image_stream, image_data, timestamp, method):
+    """Save a full or AI photo, streaming binary uploads straight to the file.
+
+    Returns:
+        Photo: The stored photo.
+    """
+    if image_stream is None:
+        return save_image_to_db(save_path, image_data, timestamp, method)
+
+    written = stream_image_to_file(
+        image_stream, save_path, current_app.config["MAX_CAPTURE_BYTES"]
+    )
+    print(f"{method.capitalize()} Photo captured and saved as {save_path} ({written} bytes)")
+    return record_photo(save_path, timestamp, method)
 
 
 # Delete current photo
@@ -312,24 +414,14 @@ def delete_photo():
             db.session.commit()
 
             # Remove the original photo from the server if it exists
-            if os.path.exists(full_image_original_filename_url):
-                os.remove(full_image_original_filename_url)
-                print(
-                    f"Original photo {full_image_original_filename_url} deleted from server."
-                )
+            storage.delete(full_image_original_filename_url)
 
             # Remove the preview photo from the server if it exists
-            if os.path.exists(preview_image_filename_url):
-                os.remove(preview_image_filename_url)
-                print(
-                    f"Preview photo {preview_image_filename_url} deleted from server."
-                )
+            remove_preview_image(preview_image_filename_url)
 
             if "full_image_ai_filename" in session:
                 # Remove the AI-generated photo from the server if it exists
-                if os.path.exists(full_image_ai_filename_url):
-                    os.remove(full_image_ai_filename_url)
-                    print(f"AI photo {full_image_ai_filename_url} deleted from server.")
+                storage.delete(full_image_ai_filename_url)
 
                 # Clear session data related to the photo
                 session.pop("full_image_ai_filename", None)
@@ -355,6 +447,8 @@ def delete_photo():
 @bp.route("/view-secure-image")
 def view_secure_image():
     """View a secure image using a JWT token.
+       Supports conditional requests (ETag, Last-Modified) and byte ranges, and can hand the
+       file over to the front proxy with X-Accel-Redirect or X-Sendfile.
 
     Returns:
         Response: The image file if the token is valid, otherwise an error message.
@@ -364,28 +458,75 @@ def view_secure_image():
     if not token:
         return "Invalid or missing token", 400
 
+    import jwt
     try:
         # Decode the token
         payload = jwt.decode(
             token, current_app.config["SECRET_KEY"], algorithms=["HS256"]
         )
-        image_filename = payload.get("image_filename")
-        full_path = os.path.join(
-            current_app.config["AI_GENERATED_PHOTO_DIR"], image_filename
-        )
-
-        # Check if the image exists
-        if not full_path or not os.path.exists(full_path):
-            return "Image not found", 404
-
-        # Send the image file
-        return send_file(full_path, as_attachment=download)
-
     except jwt.ExpiredSignatureError:
         return render_template('error.html', error="Your link has expired. Please use the unique code given to download your photo."), 403
     except jwt.InvalidTokenError:
         return render_template('error.html', error="Invalid token. Please try again."), 403
 
+    image_filename = payload.get("image_filename")
+    if not image_filename or image_filename != os.path.basename(image_filename):
+        return "Image not found", 404
+
+    # Browsers may cache the image until the link expires, shared caches may not
+    max_age = current_app.config["SECURE_IMAGE_MAX_AGE"]
+    if payload.get("exp") is not None:
+        max_age = max(0, min(max_age, int(payload["exp"] - time.time())))
+
+    sendfile_mode = current_app.config["SECURE_IMAGE_SENDFILE"]
+    if sendfile_mode:
+        response = offload_image(image_filename, download, sendfile_mode)
+    else:
+        try:
+            # Answers If-None-Match / If-Modified-Since with 304 and Range with 206
+            response = send_from_directory(
+                current_app.config["AI_GENERATED_PHOTO_DIR"],
+                image_filename,
+                as_attachment=download,
+                conditional=True,
+                etag=True,
+                max_age=max_age,
+            )
+        except NotFound:
+            return "Image not found", 404
+
+    response.cache_control.public = None
+    response.cache_control.private = True
+    response.cache_control.max_age = max_age
+    response.cache_control.immutable = True     # A filename always refers to the same image
+    return response
+
+
+def offload_image(image_filename, download, sendfile_mode):
+    """Let the front proxy send the image file and handle its conditional and range requests.
+
+    Args:
+        image_filename (str): The name of the AI image file.
+        download (bool): Send the image as an attachment.
+        sendfile_mode (str): "x-accel-redirect" (nginx) or "x-sendfile" (Apache, lighttpd).
+
+    Returns:
+        Response: Empty response with the header telling the proxy which file to send.
+    """
+    response = current_app.response_class()
+    response.mimetype = mimetypes.guess_type(image_filename)[0] or "application/octet-stream"
+    if download:
+        response.headers.set("Content-Disposition", "attachment", filename=image_filename)
+
+    if sendfile_mode == "x-accel-redirect":
+        # Internal nginx location serving AI_GENERATED_PHOTO_DIR
+        prefix = current_app.config["SECURE_IMAGE_ACCEL_PREFIX"].rstrip("/")
+        response.headers["X-Accel-Redirect"] = f"{prefix}/{quote(image_filename)}"
+    else:
+        directory = os.path.join(current_app.root_path, current_app.config["AI_GENERATED_PHOTO_DIR"])
+        response.headers["X-Sendfile"] = os.path.join(directory, image_filename)
+    return response
+
 
 @bp.route("/update_old_photo_status", methods=["POST"])
 def old_photo_size_status():
@@ -0,0 +1,123 @@
+# services/backgrounds.py
+from io import BytesIO
+from PIL import Image, ImageOps
+
+import base64
+import os
+import threading
+import time
+
+
+class UnknownBackground(Exception):
+    """Raised when a background image is not available in the registry."""
+
+
+class BackgroundRegistry:
+    """Backgrounds from static/images/, pre-resized to each frame size and held as base64 JPEG."""
+
+    EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+    def __init__(self, app=None):
+        self._entries = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Load every background using the app configuration.
+           With LAZY_STARTUP they are loaded by a background thread instead, or on first use.
+
+        Args:
+            app (Flask): Flask application instance.
+        """
+        self.directory = app.config["BACKGROUND_DIR"]
+        self.frame_sizes = app.config["FRAME_SIZES"]
+        self.quality = app.config["BACKGROUND_JPEG_QUALITY"]
+        self.check_interval = app.config["BACKGROUND_CHECK_INTERVAL"]
+        app.extensions["background_registry"] = self
+        if app.config["LAZY_STARTUP"]:
+            threading.Thread(target=self.load_all, name="background-warmup", daemon=True).start()
+        else:
+            self.load_all()
+
+    def load_all(self):
+        """Load every background image found in the background directory."""
+        for filename in sorted(os.listdir(self.directory)):
+            if filename.lower().endswith(self.EXTENSIONS) and filename not in self._entries:
+                try:
+                    self._load(filename)
+                except Exception as e:
+                    print(f"❌ Failed to load background {filename}: {e}")
+        print(f"Backgrounds loaded: {list(self._entries.keys())}")
+
+    def get_data_url(self, filename, photo_size):
+        """Get a background as a data URL, resized to the frame size.
+
+        Args:
+            filename (str): Name of the background file in the background directory.
+            photo_size (str): Selected frame ("frame1" or "frame2").
+
+        Raises:
+            UnknownBackground: If the file is not a background image or the frame is unknown.
+
+        Returns:
+            str: base64 JPEG data URL of the background.
+        """
+        if not filename or os.path.basename(filename) != filename \
+                or not filename.lower().endswith(self.EXTENSIONS):
+            raise UnknownBackground(f"Unknown background image: {filename}")
+        if photo_size not in self.frame_sizes:
+            raise UnknownBackground(f"Unknown frame size: {photo_size}")
+
+        entry = self._entries.get(filename)
+        now = time.monotonic()
+
+        # Re-check the file every few seconds, reload it if its mtime changed
+        if entry is None or now - entry["checked_at"] >= self.check_interval:
+            try:
+                mtime = os.stat(os.path.join(self.directory, filename)).st_mtime
+            except FileNotFoundError:
+                with self._lock:
+                    self._entries.pop(filename, None)
+                raise UnknownBackground(f"Unknown background image: {filename}")
+
+            if entry is None or entry["mtime"] != mtime:
+                print(f"Reloading background {filename}")
+                entry = self._load(filename)
+            else:
+                entry["checked_at"] = now
+
+        return entry["encoded"][photo_size]
+
+    def _load(self, filename):
+        """Read, resize and encode a background for every frame size.
+
+        Args:
+            filename (str): Name of the background file in the background directory.
+
+        Returns:
+            dict: Registry entry for the background.
+        """
+        path = os.path.join(self.directory, filename)
+        mtime = os.stat(path).st_mtime
+        largest = (
+            max(width for width, _ in self.frame_sizes.values()),
+            max(height for _, height in self.frame_sizes.values()),
+        )
+
+        with Image.open(path) as image:
+            # Let the JPEG decoder scale down large files while decoding
+            image.draft("RGB", largest)
+            image = ImageOps.exif_transpose(image).convert("RGB")
+
+            encoded = {}
+            for photo_size, size in self.frame_sizes.items():
+                resized = ImageOps.fit(image, size, Image.LANCZOS)
+                buffer = BytesIO()
+                resized.save(buffer, format="JPEG", quality=self.quality, optimize=True)
+                encoded[photo_size] = "data:image/jpeg;base64," + base64.b64encode(buffer.getvalue()).decode("utf-8")
+
+        entry = {"mtime": mtime, "checked_at": time.monotonic(), "encoded": encoded}
+        with self._lock:
+            self._entries[filename] = entry
+        return entry
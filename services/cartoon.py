@@ -0,0 +1,270 @@
+# services/cartoon.py
+from concurrent.futures import ProcessPoolExecutor
+
+import multiprocessing
+import threading
+
+# Long edge (px) the filters run at, the result is scaled up to the frame size after
+WORK_LONG_EDGE = 640
+# Colours left after quantization
+PALETTE_SIZE = 12
+# Bits per channel of the lookup table mapping colours to the palette
+LUT_BITS = 5
+
+
+def decode_image(data):
+    """Decode image bytes into a BGR array."""
+    import cv2
+    import numpy as np
+
+    image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("Cannot decode the image")
+    return image
+
+
+def fit(image, size):
+    """Scale and centre-crop an image to fill a size, like ImageOps.fit."""
+    import cv2
+
+    width, height = size
+    scale = max(width / image.shape[1], height / image.shape[0])
+    resized = cv2.resize(
+        image,
+        (max(width, round(image.shape[1] * scale)), max(height, round(image.shape[0] * scale))),
+        interpolation=cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR,
+    )
+    top = (resized.shape[0] - height) // 2
+    left = (resized.shape[1] - width) // 2
+    return resized[top:top + height, left:left + width]
+
+
+def quantize(image, colours):
+    """Reduce an image to a palette found by k-means on a sample of its pixels.
+
+    Every pixel is mapped through a lookup table of the palette colour nearest to
+    each LUT_BITS-per-channel colour, so the mapping is a single indexing operation.
+    """
+    import cv2
+    import numpy as np
+
+    pixels = image.reshape(-1, 3)
+    sample = pixels[:: max(1, len(pixels) // 20000)].astype(np.float32)
+    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 10, 1.0)
+    _, _, palette = cv2.kmeans(sample, colours, None, criteria, 1, cv2.KMEANS_PP_CENTERS)
+
+    shift = 8 - LUT_BITS
+    levels = (np.arange(1 << LUT_BITS, dtype=np.float32) + 0.5) * (1 << shift)
+    grid = np.stack(np.meshgrid(levels, levels, levels, indexing="ij"), axis=-1).reshape(-1, 1, 3)
+    nearest = np.argmin(((grid - palette[None, :, :]) ** 2).sum(axis=2), axis=1)
+    lut = palette.astype(np.uint8)[nearest]
+
+    index = ((pixels[:, 0] >> shift).astype(np.int32) << (2 * LUT_BITS)) \
+        | ((pixels[:, 1] >> shift).astype(np.int32) << LUT_BITS) \
+        | (pixels[:, 2] >> shift).astype(np.int32)
+    return lut[index].reshape(image.shape)
+
+
+def edge_mask(image):
+    """Dark outlines of an image, as a 0..1 float mask where 0 is an edge."""
+    import cv2
+    import numpy as np
+
+    gray = cv2.medianBlur(cv2.cvtColor(image, cv2.COLOR_BGR2GRAY), 7)
+    edges = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY, 9, 5)
+    # Drop the isolated specks left by textures, keep the outlines
+    edges = cv2.morphologyEx(edges, cv2.MORPH_CLOSE, np.ones((2, 2), np.uint8))
+    return cv2.GaussianBlur(edges, (3, 3), 0).astype(np.float32)[..., None] / 255
+
+
+def subject_mask(image):
+    """Soft mask of the person in front of the camera, from GrabCut on a small copy.
+
+    The outer border of the frame is taken as background and the centre as the
+    probable subject. Falls back to a centred ellipse if GrabCut finds nothing.
+    """
+    import cv2
+    import numpy as np
+
+    height, width = image.shape[:2]
+    scale = 200 / max(height, width)
+    small = cv2.resize(image, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_AREA)
+    small_height, small_width = small.shape[:2]
+    rect = (round(small_width * 0.08), round(small_height * 0.05),
+            round(small_width * 0.84), round(small_height * 0.95))
+
+    mask = np.zeros((small_height, small_width), np.uint8)
+    try:
+        cv2.grabCut(small, mask, rect, np.zeros((1, 65), np.float64), np.zeros((1, 65), np.float64),
+                    3, cv2.GC_INIT_WITH_RECT)
+        subject = np.where((mask == cv2.GC_FGD) | (mask == cv2.GC_PR_FGD), 255, 0).astype(np.uint8)
+    except cv2.error:
+        subject = np.zeros((small_height, small_width), np.uint8)
+
+    if subject.mean() < 255 * 0.05:
+        subject[:] = 0
+        cv2.ellipse(subject, (small_width // 2, round(small_height * 0.6)),
+                    (round(small_width * 0.35), round(small_height * 0.45)), 0, 0, 360, 255, -1)
+
+    subject = cv2.morphologyEx(subject, cv2.MORPH_OPEN, np.ones((5, 5), np.uint8))
+    subject = cv2.resize(subject, (width, height), interpolation=cv2.INTER_LINEAR)
+    return cv2.GaussianBlur(subject, (0, 0), max(1.0, width / 200)).astype(np.float32)[..., None] / 255
+
+
+def cartoonize(capture, background, size):
+    """Cartoon-style render of a capture over a background. Runs in a worker process.
+
+    Smooths the capture with an edge-preserving bilateral filter, reduces it to a
+    small palette, draws dark outlines over it, and composites the subject onto
+    the cartoonized background.
+
+    Args:
+        capture (bytes): Captured image data.
+        background (bytes): Background image data, at the frame size.
+        size (tuple): Width and height of the result.
+
+    Returns:
+        bytes: PNG image data.
+    """
+    import cv2
+    import numpy as np
+
+    capture = fit(decode_image(capture), size)
+    background = fit(decode_image(background), size)
+
+    # Run the filters at a working size, their cost grows with the pixel count
+    scale = min(1.0, WORK_LONG_EDGE / max(size))
+    work_size = (round(size[0] * scale), round(size[1] * scale))
+    small = cv2.resize(capture, work_size, interpolation=cv2.INTER_AREA)
+    small_background = cv2.resize(background, work_size, interpolation=cv2.INTER_AREA)
+
+    smooth = small
+    for _ in range(3):
+        smooth = cv2.bilateralFilter(smooth, 7, 40, 7)
+    subject = quantize(smooth, PALETTE_SIZE).astype(np.float32) * edge_mask(small)
+    scenery = quantize(cv2.bilateralFilter(small_background, 7, 40, 7), PALETTE_SIZE).astype(np.float32)
+
+    alpha = subject_mask(small)
+    composite = (subject * alpha + scenery * (1 - alpha)).astype(np.uint8)
+    composite = cv2.resize(composite, size, interpolation=cv2.INTER_CUBIC)
+
+    ok, encoded = cv2.imencode(".png", composite, [cv2.IMWRITE_PNG_COMPRESSION, 1])
+    if not ok:
+        raise ValueError("Cannot encode the cartoon image")
+    return encoded.tobytes()
+
+
+def compose_capture(capture, background, size, method, long_edge, quality):
+    """Compose the capture and the background into the single image sent to OpenAI. Runs in a worker process.
+
+    "segment" cuts the subject out with the GrabCut mask and places it on the
+    background at the frame size. "stitch" puts the capture and the background
+    side by side with utils.stitch_images.
+
+    Args:
+        capture (bytes): Captured image data.
+        background (bytes): Background image data, at the frame size.
+        size (tuple): Width and height of the frame.
+        method (str): "segment" or "stitch".
+        long_edge (int): Long edge of the composed image in pixels.
+        quality (int): JPEG quality of the composed image.
+
+    Returns:
+        bytes: JPEG image data.
+    """
+    import cv2
+    import numpy as np
+
+    if method == "stitch":
+        from PIL import Image
+        from io import BytesIO
+        from utils import stitch_images
+
+        with Image.open(BytesIO(capture)) as capture_image, Image.open(BytesIO(background)) as background_image:
+            composed = stitch_images(capture_image.convert("RGB"), background_image.convert("RGB"))
+        composed.thumbnail((long_edge, long_edge), Image.LANCZOS)
+        buffer = BytesIO()
+        composed.save(buffer, "JPEG", quality=quality)
+        return buffer.getvalue()
+
+    scale = min(1.0, long_edge / max(size))
+    out_size = (round(size[0] * scale), round(size[1] * scale))
+    capture = cv2.resize(fit(decode_image(capture), size), out_size, interpolation=cv2.INTER_AREA)
+    background = cv2.resize(fit(decode_image(background), size), out_size, interpolation=cv2.INTER_AREA)
+
+    alpha = subject_mask(capture)
+    composed = (capture * alpha + background * (1 - alpha)).astype(np.uint8)
+    ok, encoded = cv2.imencode(".jpg", composed, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise ValueError("Cannot encode the composed image")
+    return encoded.tobytes()
+
+
+class CartoonEngine:
+    """Local CPU image work in a process pool: the cartoon fallback and fast mode, and the pre-compositing."""
+
+    def __init__(self, app=None):
+        self._executor = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Configure the engine. The process pool is started on first use.
+
+        Args:
+            app (Flask): Flask application instance.
+        """
+        self.frame_sizes = app.config["FRAME_SIZES"]
+        self.timeout = app.config["CARTOON_TIMEOUT"]
+        self.compose_long_edge = app.config["PRECOMPOSITE_LONG_EDGE"]
+        self.compose_quality = app.config["PRECOMPOSITE_JPEG_QUALITY"]
+        self.workers = app.config["CARTOON_WORKERS"]
+        app.extensions["cartoon"] = self
+
+    @property
+    def executor(self):
+        """Process pool of the engine, created by the first render or compose.
+
+        create_app() alone (CLI commands, benchmarks, a preloading master) does
+        not start it. The workers are started by the fork server, or spawned,
+        since this process already runs threads when the pool is created.
+        """
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    methods = multiprocessing.get_all_start_methods()
+                    context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+        return self._executor
+
+    def render(self, capture, background, photo_size):
+        """Cartoonize a capture over a background, waiting for the result.
+
+        Args:
+            capture (bytes): Captured image data.
+            background (bytes): Background image data.
+            photo_size (str): Selected frame ("frame1" or "frame2").
+
+        Returns:
+            bytes: PNG image data at the frame size.
+        """
+        future = self.executor.submit(cartoonize, capture, background, self.frame_sizes[photo_size])
+        return future.result(timeout=self.timeout)
+
+    def compose(self, capture, background, photo_size, method):
+        """Compose the capture and the background into one image, waiting for the result.
+
+        Args:
+            capture (bytes): Captured image data.
+            background (bytes): Background image data.
+            photo_size (str): Selected frame ("frame1" or "frame2").
+            method (str): "segment" or "stitch".
+
+        Returns:
+            bytes: JPEG image data.
+        """
+        future = self.executor.submit(
+            compose_capture, capture, background, self.frame_sizes[photo_size], method,
+            self.compose_long_edge, self.compose_quality)
+        return future.result(timeout=self.timeout)
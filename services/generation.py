@@ -0,0 +1,700 @@
+# services/generation.py
+from concurrent.futures import ThreadPoolExecutor
+
+import base64
+import hashlib
+import os
+import socket
+import threading
+import time
+import uuid
+
+
+# Prompt used for the pixar-style image generation
+PROMPT_TEXT = (
+    "Change the style of this image into a 3D pixar-style image. "
+    "Use the second image as the background image for the first image. "
+    "Make it look cartoonish."
+)
+
+# Prompts used when the capture and the background are pre-composed into one image
+COMPOSED_PROMPT_TEXTS = {
+    "segment": (
+        "Change the style of this image into a 3D pixar-style image. "
+        "Keep the people where they are in front of the background. "
+        "Make it look cartoonish."
+    ),
+    "stitch": (
+        "The left part of this image is a photo of people and the right part is a background. "
+        "Place the people from the left part in front of the background from the right part, "
+        "filling the whole image, and change the style into a 3D pixar-style image. "
+        "Make it look cartoonish."
+    ),
+}
+
+
+class GenerationQueueFull(Exception):
+    """Raised when the generation queue cannot accept any more jobs."""
+
+
+class GenerationCancelled(Exception):
+    """Raised in a provider call that lost the race to another provider."""
+
+
+class GenerationError(Exception):
+    """Raised when a generation fails with a known HTTP status for the client."""
+
+    def __init__(self, message, http_status=500):
+        super().__init__(message)
+        self.http_status = http_status
+
+
+class GenerationJob:
+    """State of a single AI generation job."""
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+
+    # Generation modes: the OpenAI image model, or the local cartoon engine only
+    AI = "ai"
+    FAST = "fast"
+
+    def __init__(self, session_id, photo_size, mode=AI):
+        self.id = uuid.uuid4().hex
+        self.session_id = session_id
+        self.photo_size = photo_size
+        self.status = GenerationJob.QUEUED
+        self.image_base64 = None
+        self.error = None
+        self.http_status = 200
+        self.created_at = time.time()
+        self.finished_at = None
+        self.mode = mode
+        self.engine = None          # Provider of the image ("openai", ...), "local" or "cache", once finished
+        self.cache_key = None
+        self.cacheable = True       # False if the image does not come from the OpenAI request cache_key hashes
+        self.followers = []         # Jobs of other sessions waiting for the same generation
+        self.partial_images = 0     # Partial images requested from OpenAI while generating
+        self.partial_index = -1     # Index of the last partial image received
+        self.partial_image_base64 = None
+
+    @property
+    def done(self):
+        return self.status in (GenerationJob.SUCCEEDED, GenerationJob.FAILED)
+
+    @property
+    def progress(self):
+        """Status and last partial image index, which change together with what a client is shown."""
+        return self.status, self.partial_index
+
+    def to_dict(self):
+        """Serialize the job for the status endpoint.
+
+        Returns:
+            dict: Job id, status and the image URL or error when finished.
+        """
+        data = {"job_id": self.id, "status": self.status}
+        if self.status == GenerationJob.SUCCEEDED:
+            data["image_url"] = f"data:image/png;base64,{self.image_base64}"
+            data["engine"] = self.engine
+        elif self.status == GenerationJob.FAILED:
+            data["error"] = self.error
+        return data
+
+
+def generate_image(client, encoded_image, background_data_url, photo_size, composition=None,
+                   capture_mime="image/png", partial_images=0, on_partial=None):
+    """Call the ChatGPT API to generate the pixar-style image.
+
+    Args:
+        client (OpenAI): OpenAI client.
+        encoded_image (str): base64 string of the captured image, or of the composed
+            JPEG image with a composition.
+        background_data_url (str): Data URL of the background image, not sent with a composition.
+        photo_size (str): Selected frame ("frame1" or "frame2").
+        composition (str): "segment" or "stitch" if the image is pre-composed, else None.
+        capture_mime (str): MIME type of the captured image.
+        partial_images (int): Partial images to stream while the image is generated, 0 for none.
+        on_partial (callable): Called with the index and base64 PNG string of each partial image.
+
+    Raises:
+        GenerationError: If no image is generated or the API cannot be reached.
+
+    Returns:
+        str: base64 string of the generated PNG image.
+    """
+    # Imported on first use, they are slow to import and only needed here
+    import openai
+    import requests
+    from extensions import metrics
+
+    started_at = time.perf_counter()
+
+    def record(outcome):
+        metrics.openai_request_duration.labels(outcome).observe(time.perf_counter() - started_at)
+
+    if composition:
+        content = [
+            {"type": "input_text", "text": COMPOSED_PROMPT_TEXTS[composition]},
+            {
+                "type": "input_image",
+                "image_url": f"data:image/jpeg;base64,{encoded_image}",
+            },
+        ]
+    else:
+        content = [
+            {"type": "input_text", "text": PROMPT_TEXT},
+            {
+                "type": "input_image",
+                "image_url": f"data:{capture_mime};base64,{encoded_image}",
+            },
+            {
+                "type": "input_image",
+                "image_url": background_data_url,
+            },
+        ]
+
+    tool = {
+        "type": "image_generation",
+        "size": "1024x1536" if photo_size == "frame1" else "1536x1024",
+        "quality": "medium",  # medium quality for faster response
+    }
+    try:
+        if partial_images and on_partial is not None:
+            tool["partial_images"] = partial_images
+            response = stream_response(client, content, tool, on_partial)
+        else:
+            response = client.responses.create(
+                model="gpt-4o-mini",
+                input=[{"role": "user", "content": content}],
+                tools=[tool],
+            )
+    except (requests.exceptions.Timeout, openai.APITimeoutError):
+        record("timeout")
+        print("❌ Request to OpenAI timed out")
+        raise GenerationError("The request to OpenAI timeout", 503)
+    except (requests.exceptions.ConnectionError, openai.APIConnectionError):
+        record("connection_error")
+        print("❌ Network error")
+        raise GenerationError("Network Connection Error", 503)
+    except socket.timeout:
+        record("timeout")
+        print("❌ Socket timeout")
+        raise GenerationError("Socket Timeout", 504)
+    except GenerationCancelled:
+        record("cancelled")
+        raise
+    except Exception:
+        record("error")
+        raise
+
+    # Extract the generated image
+    image_outputs = [
+        output for output in response.output if output.type == "image_generation_call"
+    ]
+    if not image_outputs:
+        record("no_image")
+        raise GenerationError("No image generated", 400)
+
+    record("success")
+    print("Image has been successfully generated.")
+    return image_outputs[0].result
+
+
+def stream_response(client, content, tool, on_partial):
+    """Call the ChatGPT API as a stream, passing on the partial images as they arrive.
+
+    Args:
+        client (OpenAI): OpenAI client.
+        content (list): Content of the user message.
+        tool (dict): Image generation tool, with partial_images set.
+        on_partial (callable): Called with the index and base64 PNG string of each partial image.
+
+    Raises:
+        GenerationError: If the response fails or the stream ends without it.
+
+    Returns:
+        Response: The completed response.
+    """
+    with client.responses.create(
+        model="gpt-4o-mini",
+        input=[{"role": "user", "content": content}],
+        tools=[tool],
+        stream=True,
+    ) as stream:
+        for event in stream:
+            if event.type == "response.image_generation_call.partial_image":
+                on_partial(event.partial_image_index, event.partial_image_b64)
+            elif event.type == "response.completed":
+                return event.response
+            elif event.type in ("response.failed", "error"):
+                error = getattr(getattr(event, "response", None), "error", None) or event
+                print(f"❌ Generation stream failed: {getattr(error, 'message', None)}")
+                raise GenerationError("The image generation failed", 500)
+    raise GenerationError("The image generation stream ended early", 500)
+
+
+def generation_cache_key(capture, background_data_url, photo_size, composition=None):
+    """Hash of everything a generation depends on, so a retried capture finds its result.
+
+    Args:
+        capture (bytes): Captured image data.
+        background_data_url (str): Data URL of the background image.
+        photo_size (str): Selected frame ("frame1" or "frame2").
+        composition (str): Pre-compositing method, or None.
+
+    Returns:
+        str: sha256 hex digest of the capture, background, frame and prompt.
+    """
+    prompt = COMPOSED_PROMPT_TEXTS[composition] if composition else PROMPT_TEXT
+    digest = hashlib.sha256()
+    for part in (capture, background_data_url.encode("utf-8"), photo_size.encode("utf-8"), prompt.encode("utf-8")):
+        digest.update(hashlib.sha256(part).digest())
+    return digest.hexdigest()
+
+
+class GenerationCache:
+    """Generated images on disk by cache key, evicting the least recently used over a size limit.
+
+    The files are shared by the worker processes. Reading an entry touches its mtime,
+    which is what the eviction orders by.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        if self.enabled:
+            os.makedirs(directory, exist_ok=True)
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def get(self, key):
+        """Get a cached image.
+
+        Args:
+            key (str): Cache key of the generation.
+
+        Returns:
+            bytes: PNG image data, or None if it is not cached.
+        """
+        if not self.enabled:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "rb") as file:
+                data = file.read()
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return data
+
+    def put(self, key, data):
+        """Cache an image, then evict the least recently used ones over the size limit.
+
+        Args:
+            key (str): Cache key of the generation.
+            data (bytes): PNG image data.
+        """
+        if not self.enabled:
+            return
+        path = self._path(key)
+        part_path = f"{path}.{os.getpid()}.{threading.get_ident()}.part"
+        with open(part_path, "wb") as file:
+            file.write(data)
+        os.replace(part_path, path)
+        with self._lock:
+            self._evict()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.png")
+
+    def _evict(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".png"):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+# Guards the creation of the OpenAI client
+_client_lock = threading.Lock()
+
+
+def trace_upload(request):
+    """Time the upload of an OpenAI request body, as an httpx request event hook.
+
+    The request images make most of the body, the time from its first to its
+    last byte sent is recorded in openai_upload_duration_seconds.
+
+    Args:
+        request (httpx.Request): Request about to be sent.
+    """
+    from extensions import metrics
+
+    size = int(request.headers.get("content-length") or 0)
+    started_at = None
+
+    def trace(event, info):
+        nonlocal started_at
+        if event.endswith("send_request_body.started"):
+            started_at = time.perf_counter()
+        elif event.endswith("send_request_body.complete") and started_at is not None:
+            elapsed = time.perf_counter() - started_at
+            metrics.openai_upload_duration.observe(elapsed)
+            metrics.openai_upload_bytes.inc(size)
+            print(f"OpenAI request body of {size / 1024:.0f} KiB uploaded in {elapsed * 1000:.0f} ms")
+
+    # Keep a trace set by someone else
+    if "trace" not in request.extensions:
+        request.extensions["trace"] = trace
+
+
+def get_openai_client(app):
+    """Get the OpenAI client of the app, created on first use.
+
+    Args:
+        app (Flask): Flask application instance.
+
+    Returns:
+        OpenAI: OpenAI client, or None without an OPENAI_API_KEY.
+    """
+    client = app.config.get("OPENAI_CLIENT")
+    if client is None and app.config.get("OPENAI_API_KEY"):
+        with _client_lock:
+            client = app.config.get("OPENAI_CLIENT")
+            if client is None:
+                from openai import OpenAI
+
+                from openai import DefaultHttpxClient
+
+                client = OpenAI(
+                    api_key=app.config["OPENAI_API_KEY"],
+                    timeout=app.config["OPENAI_TIMEOUT"],
+                    http_client=DefaultHttpxClient(event_hooks={"request": [trace_upload]}),
+                )
+                app.config["OPENAI_CLIENT"] = client
+    return client
+
+
+class GenerationQueue:
+    """Bounded worker pool running AI generations off the request workers."""
+
+    def __init__(self, app=None):
+        self.app = None
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)     # Notified when a job makes progress
+        self._executor = None
+        self._slots = None
+        self._inflight = {}
+        self.cache = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Create the worker pool using the app configuration.
+
+        Args:
+            app (Flask): Flask application instance.
+        """
+        self.app = app
+        workers = app.config["GENERATION_WORKERS"]
+        self.job_ttl = app.config["GENERATION_JOB_TTL"]
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="generation")
+
+        # Running and waiting jobs share the same slots, so the backlog stays bounded
+        self._slots = threading.BoundedSemaphore(workers + app.config["GENERATION_QUEUE_SIZE"])
+        self.cache = GenerationCache(app.config["GENERATION_CACHE_DIR"], app.config["GENERATION_CACHE_MAX_BYTES"])
+        self.fallback_after = app.config["GENERATION_FALLBACK_AFTER"]
+        self.precomposite = app.config["GENERATION_PRECOMPOSITE"] or None
+        self.fallback_on_error = app.config["GENERATION_FALLBACK_ON_ERROR"]
+        self.partial_images = app.config["GENERATION_PARTIAL_IMAGES"]
+        from services.providers import ProviderRouter
+
+        self.router = ProviderRouter(app)
+        app.extensions["generation_queue"] = self
+
+    def find(self, session_id, cache_key, photo_size):
+        """Find a generation of the same capture that is running or cached.
+
+        A generation still running is shared, the same job for the same session,
+        otherwise a job that finishes with it. A cached result is returned as a
+        finished job.
+
+        Args:
+            session_id (str): Session that owns the job.
+            cache_key (str): Key from generation_cache_key.
+            photo_size (str): Selected frame ("frame1" or "frame2").
+
+        Returns:
+            GenerationJob: The matching job, or None to start a new generation.
+        """
+        from extensions import metrics
+
+        with self._lock:
+            job = self._follow(session_id, cache_key, photo_size)
+        if job is not None:
+            metrics.generation_cache_lookups.labels("inflight").inc()
+            return job
+
+        data = self.cache.get(cache_key)
+        if data is None:
+            metrics.generation_cache_lookups.labels("miss").inc()
+            return None
+
+        metrics.generation_cache_lookups.labels("hit").inc()
+        job = GenerationJob(session_id, photo_size)
+        job.cache_key = cache_key
+        job.image_base64 = base64.b64encode(data).decode("utf-8")
+        job.engine = "cache"
+        job.status = GenerationJob.SUCCEEDED
+        job.finished_at = time.time()
+        with self._lock:
+            self._purge_finished()
+            self._jobs[job.id] = job
+        print(f"Generation {cache_key[:12]} served from the cache.")
+        return job
+
+    def submit(self, session_id, encoded_image, background_data_url, photo_size, cache_key=None,
+               mode=GenerationJob.AI, stream=False):
+        """Enqueue a generation job.
+
+        Args:
+            session_id (str): Session that owns the job.
+            encoded_image (str): base64 string of the captured image.
+            background_data_url (str): Data URL of the background image.
+            photo_size (str): Selected frame ("frame1" or "frame2").
+            cache_key (str): Key from generation_cache_key, to share and cache the result.
+            mode (str): GenerationJob.AI, or GenerationJob.FAST for the local cartoon engine only.
+            stream (bool): Request GENERATION_PARTIAL_IMAGES partial images from OpenAI,
+                to show while the image is generated.
+
+        Raises:
+            GenerationQueueFull: If every worker is busy and the queue is full.
+
+        Returns:
+            GenerationJob: The queued job.
+        """
+        with self._lock:
+            # The same capture may have been submitted since find() was called
+            job = self._follow(session_id, cache_key, photo_size)
+            if job is not None:
+                return job
+            if not self._slots.acquire(blocking=False):
+                raise GenerationQueueFull("Too many images are being generated. Please try again.")
+
+            job = GenerationJob(session_id, photo_size, mode)
+            job.cache_key = cache_key
+            if stream and mode == GenerationJob.AI:
+                job.partial_images = self.partial_images
+            self._purge_finished()
+            self._jobs[job.id] = job
+            if cache_key is not None:
+                self._inflight[cache_key] = job
+
+        try:
+            self._executor.submit(self._run, job, encoded_image, background_data_url)
+        except Exception:
+            with self._lock:
+                self._inflight.pop(cache_key, None)
+            self._slots.release()
+            raise
+        return job
+
+    def get(self, job_id, session_id=None):
+        """Get a job by id.
+
+        Args:
+            job_id (str): Job id returned by submit.
+            session_id (str): If given, the job must belong to this session.
+
+        Returns:
+            GenerationJob: The job, or None if it does not exist.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None or (session_id is not None and job.session_id != session_id):
+            return None
+        return job
+
+    def wait(self, job, progress, timeout):
+        """Wait until a job makes progress: a new status or a new partial image.
+
+        Args:
+            job (GenerationJob): Job to watch.
+            progress (tuple): job.progress already known by the client.
+            timeout (float): Seconds to wait at most.
+
+        Returns:
+            bool: True if the job progressed, False on timeout.
+        """
+        with self._changed:
+            return self._changed.wait_for(lambda: job.progress != progress, timeout)
+
+    def _follow(self, session_id, cache_key, photo_size):
+        """Share the running generation of a cache key. Caller must hold the lock."""
+        primary = self._inflight.get(cache_key) if cache_key is not None else None
+        if primary is None:
+            return None
+        if primary.session_id == session_id:
+            return primary
+
+        follower = GenerationJob(session_id, photo_size, primary.mode)
+        if primary.done:
+            self._copy_result(primary, follower)
+        else:
+            follower.status = primary.status
+            follower.partial_index = primary.partial_index
+            follower.partial_image_base64 = primary.partial_image_base64
+            primary.followers.append(follower)
+        self._jobs[follower.id] = follower
+        return follower
+
+    def _run(self, job, encoded_image, background_data_url):
+        """Run a job on a worker thread."""
+        with self._changed:
+            for waiting in [job] + job.followers:
+                waiting.status = GenerationJob.RUNNING
+            self._changed.notify_all()
+
+        if job.mode == GenerationJob.FAST:
+            try:
+                if not self._fall_back(job, encoded_image, background_data_url, "fast mode"):
+                    self._complete(job, error="The image cannot be generated", http_status=500)
+            finally:
+                self._finish(job, None)
+                self._slots.release()
+            return
+
+        # Answer with the local cartoon engine if the providers take too long, the calls keep running
+        timer = None
+        if self.fallback_after > 0:
+            timer = threading.Timer(
+                self.fallback_after, self._fall_back,
+                (job, encoded_image, background_data_url, f"no result after {self.fallback_after:g} s"))
+            timer.daemon = True
+            timer.start()
+
+        # The router releases the slot once every provider call of the job has finished, the
+        # losers of a hedge included, so the slots bound the calls running upstream
+        image_base64 = None
+        try:
+            engine, image_base64 = self.router.generate(
+                job, encoded_image, background_data_url,
+                on_partial=lambda index, image: self._set_partial(job, index, image),
+                on_settled=self._slots.release)
+            # The cache key hashes the OpenAI request, the images of the other providers are not cached
+            if engine != "openai":
+                job.cacheable = False
+            self._complete(job, image_base64=image_base64, engine=engine)
+        except GenerationError as e:
+            # The providers are unreachable or timed out, answer with the local engine instead
+            if not (self.fallback_on_error and e.http_status in (503, 504)
+                    and self._fall_back(job, encoded_image, background_data_url, str(e))):
+                self._complete(job, error=str(e), http_status=e.http_status)
+        except Exception as e:
+            print(f"❌ API Error: {e}")
+            self._complete(job, error=str(e), http_status=500)
+        finally:
+            if timer is not None:
+                timer.cancel()
+            self._finish(job, image_base64)
+
+    def _fall_back(self, job, encoded_image, background_data_url, reason):
+        """Finish a job with the local cartoon engine, unless it already finished.
+
+        Returns:
+            bool: True if the job has a result.
+        """
+        from extensions import cartoon
+
+        if job.done:
+            return job.status == GenerationJob.SUCCEEDED
+        print(f"Generation job {job.id} uses the local cartoon engine: {reason}")
+        try:
+            image = cartoon.render(
+                base64.b64decode(encoded_image),
+                base64.b64decode(background_data_url.split(",", 1)[-1]),
+                job.photo_size,
+            )
+        except Exception as e:
+            print(f"❌ Local cartoon engine failed for job {job.id}: {e!r}")
+            return False
+        self._complete(job, image_base64=base64.b64encode(image).decode("utf-8"), engine="local")
+        return job.status == GenerationJob.SUCCEEDED
+
+    def _set_partial(self, job, index, image_base64):
+        """Set the last partial image of a job and of the jobs following it, while it runs."""
+        with self._changed:
+            if job.done:
+                return
+            for waiting in [job] + job.followers:
+                waiting.partial_index = index
+                waiting.partial_image_base64 = image_base64
+            self._changed.notify_all()
+
+    def _complete(self, job, image_base64=None, engine=None, error=None, http_status=200):
+        """Set the result of a job and of the jobs following it. The first result wins."""
+        with self._changed:
+            if job.done:
+                return
+            job.image_base64 = image_base64
+            job.engine = engine
+            job.error = error
+            job.http_status = http_status
+            job.finished_at = time.time()
+            job.status = GenerationJob.FAILED if error else GenerationJob.SUCCEEDED
+            job.partial_image_base64 = None
+            for follower in job.followers:
+                self._copy_result(job, follower)
+            job.followers = []
+            self._changed.notify_all()
+
+    def _copy_result(self, job, follower):
+        follower.image_base64 = job.image_base64
+        follower.engine = job.engine
+        follower.error = job.error
+        follower.http_status = job.http_status
+        follower.finished_at = job.finished_at
+        follower.status = job.status
+        follower.partial_image_base64 = None
+
+    def _finish(self, job, image_base64):
+        """Cache the image generated by OpenAI, even if the job was answered by the local engine."""
+        if image_base64 is not None and job.cache_key is not None and job.cacheable:
+            try:
+                self.cache.put(job.cache_key, base64.b64decode(image_base64))
+            except Exception as e:
+                print(f"❌ Failed to cache generation {job.cache_key[:12]}: {e}")
+
+        with self._lock:
+            if job.cache_key is not None and self._inflight.get(job.cache_key) is job:
+                del self._inflight[job.cache_key]
+
+    def _purge_finished(self):
+        """Forget finished jobs older than the job TTL. Caller must hold the lock."""
+        cutoff = time.time() - self.job_ttl
+        expired = [
+            job_id
+            for job_id, job in self._jobs.items()
+            if job.finished_at is not None and job.finished_at < cutoff
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
@@ -0,0 +1,140 @@
+# services/hitpay.py
+import threading
+import time
+
+
+def is_hitpay_failure(response, error):
+    """Outcome of a HitPay call for the circuit breaker.
+
+    A raised call (timeout, connection error) or a 5xx is a failure, a 4xx tells
+    nothing about the health of HitPay (None), anything else is a success.
+    """
+    if error is not None or response.status_code >= 500:
+        return True
+    return None if response.status_code >= 400 else False
+
+
+class HitPayClient:
+    """App-scoped HTTP client for the HitPay API with a pooled keep-alive session."""
+
+    def __init__(self, app=None):
+        self._session = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Read the app configuration. The pooled session is created on first use.
+
+        Args:
+            app (Flask): Flask application instance.
+        """
+        self.url = app.config["HITPAY_URL"].rstrip("/")
+        self.api_key = app.config["HITPAY_API_KEY"]
+        self.connect_timeout = app.config["HITPAY_CONNECT_TIMEOUT"]
+        self.create_timeout = app.config["HITPAY_CREATE_TIMEOUT"]
+        self.status_timeout = app.config["HITPAY_STATUS_TIMEOUT"]
+        self.retries = app.config["HITPAY_RETRIES"]
+        self.retry_backoff = app.config["HITPAY_RETRY_BACKOFF"]
+        self.pool_size = app.config["HITPAY_POOL_SIZE"]
+        app.extensions["hitpay"] = self
+
+    @property
+    def session(self):
+        """Pooled keep-alive session, created on first use."""
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    self._session = self._create_session()
+        return self._session
+
+    def _create_session(self):
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        # Connection failures are retried for every call, since nothing was sent yet.
+        # Read errors and 5xx/429 responses are only retried for idempotent methods.
+        retries = Retry(
+            total=self.retries,
+            backoff_factor=self.retry_backoff,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset({"GET", "HEAD", "OPTIONS"}),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=self.pool_size,
+            max_retries=retries,
+        )
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers.update({
+            "X-BUSINESS-API-KEY": self.api_key or "",
+            "X-Requested-With": "XMLHttpRequest",
+        })
+        return session
+
+    def create_payment_request(self, payload):
+        """Create a payment request. Not retried once the request was sent.
+
+        Args:
+            payload (dict): Form fields of the payment request.
+
+        Returns:
+            requests.Response: Response from HitPay.
+        """
+        return self._timed(
+            "create",
+            self.session.post,
+            self.url,
+            data=payload,
+            headers={"Content-Type": "application/x-www-form-urlencoded"},
+            timeout=(self.connect_timeout, self.create_timeout),
+        )
+
+    def get_payment_request(self, payment_request_id):
+        """Get the status of a payment request. Retried with backoff.
+
+        Args:
+            payment_request_id (str): HitPay payment request id.
+
+        Returns:
+            requests.Response: Response from HitPay.
+        """
+        return self._timed(
+            "status",
+            self.session.get,
+            f"{self.url}/{payment_request_id}",
+            timeout=(self.connect_timeout, self.status_timeout),
+        )
+
+    def _timed(self, operation, call, *args, **kwargs):
+        """Make a call to HitPay, recording its duration and outcome in the metrics.
+
+        The call goes through the circuit breaker and bulkhead of HitPay, and
+        raises UpstreamUnavailable without being sent while HitPay is down.
+        """
+        from extensions import upstreams
+
+        return upstreams["hitpay"].call(self._send, operation, call, args, kwargs, is_failure=is_hitpay_failure)
+
+    def _send(self, operation, call, args, kwargs):
+        import requests
+        from extensions import metrics
+
+        started_at = time.perf_counter()
+        outcome = "error"
+        try:
+            response = call(*args, **kwargs)
+            outcome = f"{response.status_code // 100}xx"
+            return response
+        except requests.exceptions.Timeout:
+            outcome = "timeout"
+            raise
+        except requests.exceptions.ConnectionError:
+            outcome = "connection_error"
+            raise
+        finally:
+            metrics.hitpay_request_duration.labels(operation, outcome).observe(time.perf_counter() - started_at)
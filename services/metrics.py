@@ -0,0 +1,335 @@
+# services/metrics.py
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from flask import g, request
+
+import math
+import threading
+import time
+
+# Upper bounds (seconds) of the request latency buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# Upper bounds (seconds) of the external API call buckets, generations take up to a minute or more
+API_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 45, 60, 90, 120)
+
+
+def format_value(value):
+    """Format a sample value for the Prometheus text format."""
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def format_labels(names, values):
+    """Format label pairs as {name="value",...}, or an empty string without labels."""
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class CounterValue:
+    """Value of a counter for one set of labels."""
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class GaugeValue:
+    """Value of a gauge for one set of labels."""
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+
+class HistogramValue:
+    """Bucket counts, sum and count of a histogram for one set of labels."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)     # The last one is the +Inf bucket
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+
+class Metric(ABC):
+    """A metric with a value per set of label values."""
+
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        """Get the value of a set of labels, in the order of the label names."""
+        key = tuple(str(value) for value in values)
+        value = self._values.get(key)
+        if value is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects the labels {self.labelnames}")
+            with self._lock:
+                value = self._values.setdefault(key, self._new_value())
+        return value
+
+    def samples(self):
+        """Yield the (name suffix, label names, label values, value) of every sample."""
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield "", self.labelnames, key, value.value
+
+    def render(self):
+        """Render the metric in the Prometheus text format."""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for suffix, names, values, value in self.samples():
+            lines.append(f"{self.name}{suffix}{format_labels(names, values)} {format_value(value)}")
+        return "\n".join(lines)
+
+    @abstractmethod
+    def _new_value(self):
+        """Create the value of a new set of labels."""
+
+
+class Counter(Metric):
+    """A value that only goes up, e.g. requests or bytes written."""
+
+    type = "counter"
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def _new_value(self):
+        return CounterValue()
+
+
+class Gauge(Metric):
+    """A value that goes up and down, e.g. requests in flight.
+
+    With a function, the value is read from it on every scrape instead.
+    """
+
+    type = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        super().__init__(name, documentation, labelnames)
+        self.function = function
+
+    def samples(self):
+        if self.function is not None:
+            try:
+                yield "", self.labelnames, (), float(self.function())
+            except Exception as e:
+                print(f"❌ Failed to read the gauge {self.name}: {e}")
+            return
+        yield from super().samples()
+
+    def _new_value(self):
+        return GaugeValue()
+
+
+class Histogram(Metric):
+    """Distribution of observed values, e.g. request latencies, in cumulative buckets."""
+
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def samples(self):
+        names = self.labelnames + ("le",)
+        with self._lock:
+            items = sorted(self._values.items())
+        for values, histogram in items:
+            with histogram._lock:
+                counts = list(histogram.counts)
+                total = histogram.sum
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                yield "_bucket", names, values + (format_value(bound),), cumulative
+            yield "_sum", self.labelnames, values, total
+            yield "_count", self.labelnames, values, cumulative
+
+    def _new_value(self):
+        return HistogramValue(self.buckets)
+
+
+class Metrics:
+    """In-process metrics of the app, exposed in the Prometheus text format.
+
+    Times every request per blueprint and endpoint, and holds the metrics of the
+    OpenAI and HitPay calls and of the photo storage. Each worker process keeps its
+    own values.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self._metrics = []
+
+        # HTTP requests
+        self.http_request_duration = self.histogram(
+            "http_request_duration_seconds", "Time to handle a request, until its response is sent.",
+            ("blueprint", "endpoint", "method", "status"))
+        self.http_requests_in_flight = self.gauge(
+            "http_requests_in_flight", "Requests being handled.", ("blueprint", "endpoint"))
+
+        # External APIs
+        self.openai_request_duration = self.histogram(
+            "openai_request_duration_seconds", "Duration of the OpenAI image generation calls, by outcome.",
+            ("outcome",), buckets=API_BUCKETS)
+        self.openai_upload_duration = self.histogram(
+            "openai_upload_duration_seconds", "Time to upload the body of the OpenAI requests.")
+        self.openai_upload_bytes = self.counter(
+            "openai_upload_bytes_total", "Bytes of request body uploaded to OpenAI.")
+        self.hitpay_request_duration = self.histogram(
+            "hitpay_request_duration_seconds", "Duration of the HitPay API calls, by operation and outcome.",
+            ("operation", "outcome"), buckets=API_BUCKETS)
+
+        # Circuit breakers and bulkheads of the upstream APIs
+        self.upstream_circuit_state = self.gauge(
+            "upstream_circuit_state", "Circuit breaker state of each upstream: 0 closed, 1 half-open, 2 open.",
+            ("upstream",))
+        self.upstream_calls_in_flight = self.gauge(
+            "upstream_calls_in_flight", "Calls running on each upstream.", ("upstream",))
+        self.upstream_calls_waiting = self.gauge(
+            "upstream_calls_waiting", "Calls waiting for a free slot of each upstream.", ("upstream",))
+        self.upstream_rejected_calls = self.counter(
+            "upstream_rejected_calls_total",
+            "Calls refused without calling the upstream, by reason: circuit_open, queue_full or wait_timeout.",
+            ("upstream", "reason"))
+
+        # Captures sent to the AI API
+        self.ai_capture_bytes = self.counter(
+            "ai_capture_bytes_total", "Capture bytes received from the kiosk and sent to OpenAI after preparation.",
+            ("stage",))
+        self.ai_capture_prepare_duration = self.histogram(
+            "ai_capture_prepare_duration_seconds", "Time to downscale and recompress a capture for OpenAI.")
+
+        # AI generation providers
+        self.generation_provider_duration = self.histogram(
+            "generation_provider_duration_seconds", "Duration of the generation provider calls, by outcome.",
+            ("provider", "outcome"), buckets=API_BUCKETS)
+        self.generation_provider_latency_quantile = self.gauge(
+            "generation_provider_latency_quantile_seconds",
+            "GENERATION_HEDGE_QUANTILE of the recent successful calls of each provider.", ("provider",))
+        self.generation_router_calls = self.counter(
+            "generation_router_calls_total",
+            "Provider calls by role (primary, hedge or failover) and result (won, failed or cancelled).",
+            ("provider", "role", "result"))
+
+        # AI generation cache
+        self.generation_cache_lookups = self.counter(
+            "generation_cache_lookups_total", "Generation lookups by result: hit, inflight (shared) or miss.",
+            ("result",))
+
+        # Photo storage
+        self.storage_bytes_written = self.counter(
+            "storage_bytes_written_total", "Bytes written to the photo storage.", ("directory",))
+        self.storage_bytes_deleted = self.counter(
+            "storage_bytes_deleted_total", "Bytes reclaimed by deleting photos.", ("directory",))
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Time the requests of the app when METRICS_ENABLED is set.
+
+        Args:
+            app (Flask): Flask application instance.
+        """
+        self.enabled = app.config["METRICS_ENABLED"]
+        app.extensions["metrics"] = self
+        if not self.enabled:
+            return
+
+        app.before_request(self._start_request)
+        app.after_request(self._record_status)
+        app.teardown_request(self._finish_request)
+
+    def counter(self, name, documentation, labelnames=()):
+        """Create and register a counter."""
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=(), function=None):
+        """Create and register a gauge, optionally read from a function on every scrape."""
+        return self._register(Gauge(name, documentation, labelnames, function))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        """Create and register a histogram."""
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        """Render every metric in the Prometheus text format.
+
+        Returns:
+            str: Metrics exposition, as served on /metrics.
+        """
+        return "\n".join(metric.render() for metric in self._metrics) + "\n"
+
+    def _register(self, metric):
+        if any(existing.name == metric.name for existing in self._metrics):
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics.append(metric)
+        return metric
+
+    def _route_labels(self):
+        return request.blueprint or "", request.endpoint or "unmatched"
+
+    def _start_request(self):
+        g.metrics_started_at = time.perf_counter()
+        self.http_requests_in_flight.labels(*self._route_labels()).inc()
+
+    def _record_status(self, response):
+        started_at = g.pop("metrics_started_at", None)
+        if started_at is not None:
+            labels, method = self._route_labels(), request.method
+            # Observed once the server closes the response, after the last byte of a
+            # streamed body (generators, send_file and send_from_directory included)
+            response.call_on_close(lambda: self._observe(labels, method, response.status_code, started_at))
+        return response
+
+    def _finish_request(self, error=None):
+        # No response was made, so after_request did not take the observation
+        started_at = g.pop("metrics_started_at", None)
+        if started_at is not None:
+            self._observe(self._route_labels(), request.method, 500, started_at)
+
+    def _observe(self, labels, method, status, started_at):
+        self.http_requests_in_flight.labels(*labels).dec()
+        self.http_request_duration.labels(*labels, method, status).observe(time.perf_counter() - started_at)
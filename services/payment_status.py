@@ -0,0 +1,97 @@
+# services/payment_status.py
+from collections import OrderedDict
+from sqlalchemy import select
+from models import db, Payment
+
+import threading
+import time
+
+# Statuses after which the redirect page stops waiting
+FINAL_PAYMENT_STATUSES = ("succeeded", "failed", "canceled")
+
+
+class PaymentStatusHub:
+    """In-process hub that wakes up the clients waiting for a payment status change.
+
+    The hub only signals that the status of a payment request may have changed, the
+    waiting clients then read it from the database. A status published by another
+    worker process is seen at the next database check, at most
+    PAYMENT_STATUS_RECHECK_INTERVAL seconds later.
+    """
+
+    def __init__(self, app=None, max_entries=1000):
+        self.app = None
+        self.max_entries = max_entries
+        self._versions = OrderedDict()
+        self._condition = threading.Condition()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Register the hub and subscribe it to the webhook processor.
+
+        Args:
+            app (Flask): Flask application instance.
+        """
+        from extensions import webhook_processor
+
+        self.app = app
+        self.recheck_interval = app.config["PAYMENT_STATUS_RECHECK_INTERVAL"]
+        self.wait_timeout = app.config["PAYMENT_STATUS_WAIT_TIMEOUT"]
+        app.extensions["payment_status_hub"] = self
+        webhook_processor.add_listener(self.publish)
+
+    def publish(self, payment_request_id, status):
+        """Wake up the clients waiting for a payment request, once its new status is committed.
+
+        Args:
+            payment_request_id (str): HitPay payment request id.
+            status (str): New payment status. Not kept, the clients read it from the database.
+        """
+        with self._condition:
+            self._versions[payment_request_id] = self._versions.get(payment_request_id, 0) + 1
+            self._versions.move_to_end(payment_request_id)
+            while len(self._versions) > self.max_entries:
+                self._versions.popitem(last=False)
+            self._condition.notify_all()
+
+    def wait(self, payment_request_id, current, timeout):
+        """Wait until the status of a payment request in the database differs from the current one.
+
+        The database is read when the hub is woken up for the payment request, and every
+        PAYMENT_STATUS_RECHECK_INTERVAL seconds for webhooks handled by another worker process.
+
+        Args:
+            payment_request_id (str): HitPay payment request id.
+            current (str): Status already known by the client.
+            timeout (float): Seconds to wait at most.
+
+        Returns:
+            str: The new status, or None if it did not change before the timeout.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            # Taken before the read, so a publish during the read is not missed
+            with self._condition:
+                version = self._versions.get(payment_request_id)
+            status = self._load(payment_request_id)
+            if status is not None and status != current:
+                return status
+
+            next_recheck = time.monotonic() + self.recheck_interval if self.recheck_interval else None
+            with self._condition:
+                while self._versions.get(payment_request_id) == version:
+                    now = time.monotonic()
+                    if now >= deadline:
+                        return None
+                    if next_recheck is not None and now >= next_recheck:
+                        break
+                    wake_at = deadline if next_recheck is None else min(deadline, next_recheck)
+                    self._condition.wait(wake_at - now)
+
+    def _load(self, payment_request_id):
+        """Read the payment status from the database."""
+        with self.app.app_context():
+            return db.session.execute(
+                select(Payment.status).filter_by(payment_request_id=payment_request_id)
+            ).scalar_one_or_none()
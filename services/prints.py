@@ -0,0 +1,151 @@
+# services/prints.py
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image, ImageCms, ImageOps
+from services.storage import write_file_durable
+
+import io
+import multiprocessing
+import os
+import threading
+
+# File extension of each print format
+PRINT_EXTENSIONS = {"jpeg": ".jpg", "tiff": ".tif"}
+
+_srgb_profile = None
+
+
+def get_print_path(path, image_format):
+    """Path of the print file of a photo, next to the photo.
+
+    Args:
+        path (str): Path of the photo.
+        image_format (str): "jpeg" or "tiff".
+
+    Returns:
+        str: Path of the print file.
+    """
+    root, _ = os.path.splitext(path)
+    return f"{root}_print{PRINT_EXTENSIONS[image_format]}"
+
+
+def get_srgb_profile():
+    """sRGB ICC profile embedded in the print files, built once per process."""
+    global _srgb_profile
+    if _srgb_profile is None:
+        _srgb_profile = ImageCms.ImageCmsProfile(ImageCms.createProfile("sRGB")).tobytes()
+    return _srgb_profile
+
+
+def render_print_files(path, size_cm, dpi, formats, jpeg_quality):
+    """Render the print files of a photo at an exact physical size. Runs in a worker process.
+
+    Args:
+        path (str): Path of the photo.
+        size_cm (tuple): Print width and height in centimetres.
+        dpi (int): Print resolution in dots per inch.
+        formats (list): Print formats, "jpeg" and/or "tiff".
+        jpeg_quality (int): JPEG quality of the print file.
+
+    Returns:
+        list: Paths of the written print files.
+    """
+    width, height = (round(cm / 2.54 * dpi) for cm in size_cm)
+    with Image.open(path) as image:
+        image = ImageOps.exif_transpose(image).convert("RGB")
+        image = ImageOps.fit(image, (width, height), Image.LANCZOS)
+
+    options = {"dpi": (dpi, dpi), "icc_profile": get_srgb_profile()}
+    written = []
+    for image_format in formats:
+        buffer = io.BytesIO()
+        if image_format == "jpeg":
+            image.save(buffer, "JPEG", quality=jpeg_quality, subsampling=0, optimize=True, **options)
+        else:
+            image.save(buffer, "TIFF", compression="tiff_lzw", **options)
+        print_path = get_print_path(path, image_format)
+        write_file_durable(print_path, buffer.getvalue())
+        written.append(print_path)
+    return written
+
+
+class PrintRenderer:
+    """Renders the print-ready files of paid photos in a process pool."""
+
+    def __init__(self, app=None):
+        self._executor = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Configure the renderer. The process pool is started on first use.
+
+        Args:
+            app (Flask): Flask application instance.
+        """
+        self.workers = app.config["PRINT_WORKERS"]
+        self.dpi = app.config["PRINT_DPI"]
+        self.formats = app.config["PRINT_FORMATS"]
+        self.jpeg_quality = app.config["PRINT_JPEG_QUALITY"]
+        # Print size of each frame label stored on the photos
+        self.sizes = {
+            app.config["FRAME_LABELS"][frame]: size
+            for frame, size in app.config["FRAME_PRINT_SIZES"].items()
+        }
+        app.extensions["prints"] = self
+
+    @property
+    def executor(self):
+        """Process pool of the renderer, started on first use.
+
+        Only the process serving requests starts it, not the CLI commands, the
+        reloader parent or a gunicorn --preload master. By then the app threads
+        run, so the workers come from a fork server (or are spawned) instead of
+        a fork of this process, which could copy a lock held by another thread.
+        """
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    methods = multiprocessing.get_all_start_methods()
+                    context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+        return self._executor
+
+    def submit(self, path, frame):
+        """Render the print files of a photo in the background.
+
+        Args:
+            path (str): Path of the photo.
+            frame (str): Frame label of the photo, e.g. "7 cm x 10 cm".
+
+        Returns:
+            Future: Resolves to the paths of the print files, or None for an unknown frame.
+        """
+        size_cm = self.sizes.get(frame)
+        if size_cm is None:
+            print(f"❌ No print size for frame {frame}")
+            return None
+
+        future = self.executor.submit(
+            render_print_files, path, size_cm, self.dpi, self.formats, self.jpeg_quality)
+        future.add_done_callback(lambda f: self._report(path, f))
+        return future
+
+    def get_print_paths(self, path):
+        """Print files of a photo that are ready.
+
+        Args:
+            path (str): Path of the photo.
+
+        Returns:
+            dict: Path of each rendered print format.
+        """
+        paths = {image_format: get_print_path(path, image_format) for image_format in self.formats}
+        return {image_format: print_path for image_format, print_path in paths.items() if os.path.exists(print_path)}
+
+    def _report(self, path, future):
+        error = future.exception()
+        if error:
+            print(f"❌ Print files of {path} failed: {error}")
+        else:
+            print(f"Print files ready: {future.result()}")
@@ -0,0 +1,502 @@
+# services/providers.py
+from abc import ABC, abstractmethod
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import base64
+import random
+import threading
+import time
+
+from services.upstreams import UpstreamUnavailable
+from services.generation import (
+    COMPOSED_PROMPT_TEXTS,
+    GenerationCancelled,
+    GenerationError,
+    generate_image,
+    get_openai_client,
+)
+
+# Size of the generated image of each frame, as requested from OpenAI
+OUTPUT_SIZES = {"frame1": (1024, 1536), "frame2": (1536, 1024)}
+
+
+class LatencyTracker:
+    """Latencies of the last successful calls of a provider, to pick its hedging deadline."""
+
+    def __init__(self, window):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def quantile(self, q, min_samples):
+        """The q quantile of the latencies, or None with fewer than min_samples of them."""
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples or len(samples) < min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+
+class Provider(ABC):
+    """An image generation backend the router can send a job to."""
+
+    name = None
+    upstream = None     # Name of the upstream whose circuit breaker guards the calls, if any
+
+    @abstractmethod
+    def generate(self, job, encoded_image, background_data_url, cancelled, on_partial=None):
+        """Generate the image of a job.
+
+        Args:
+            job (GenerationJob): Job being generated.
+            encoded_image (str): base64 string of the captured image, as uploaded.
+            background_data_url (str): Data URL of the background image.
+            cancelled (threading.Event): Set when another provider answered first.
+            on_partial (callable): Called with the index and base64 PNG string of each
+                partial image, for the providers that stream them.
+
+        Raises:
+            GenerationError: If the image cannot be generated.
+            GenerationCancelled: If the call stopped because it was cancelled.
+
+        Returns:
+            str: base64 string of the generated PNG image.
+        """
+
+
+class OpenAIProvider(Provider):
+    """gpt-4o-mini with the image generation tool, see generate_image."""
+
+    name = "openai"
+    upstream = "openai"
+
+    def __init__(self, app):
+        from utils import AI_CAPTURE_MIMETYPES
+
+        self.app = app
+        self.precomposite = app.config["GENERATION_PRECOMPOSITE"] or None
+        if self.precomposite not in (None, *COMPOSED_PROMPT_TEXTS):
+            raise ValueError(f"Unknown GENERATION_PRECOMPOSITE: {self.precomposite}")
+        self.capture_format = app.config["AI_CAPTURE_FORMAT"].lower()
+        if self.capture_format not in AI_CAPTURE_MIMETYPES:
+            raise ValueError(f"Unknown AI_CAPTURE_FORMAT: {self.capture_format}")
+        self.capture_long_edge = app.config["AI_CAPTURE_LONG_EDGE"]
+        self.capture_quality = app.config["AI_CAPTURE_QUALITY"]
+
+    def generate(self, job, encoded_image, background_data_url, cancelled, on_partial=None):
+        """Generate with OpenAI, sending one pre-composed image if GENERATION_PRECOMPOSITE is set."""
+        from extensions import cartoon
+
+        def partial(index, image_base64):
+            # Raised inside the response stream, which closes the connection
+            if cancelled.is_set():
+                raise GenerationCancelled()
+            if on_partial is not None:
+                on_partial(index, image_base64)
+
+        with self.app.app_context():
+            client = get_openai_client(self.app)
+        if not client:
+            raise GenerationError("OpenAI client cannot be initialized", 500)
+
+        if self.precomposite:
+            try:
+                composed = cartoon.compose(
+                    base64.b64decode(encoded_image),
+                    base64.b64decode(background_data_url.split(",", 1)[-1]),
+                    job.photo_size,
+                    self.precomposite,
+                )
+            except Exception as e:
+                print(f"❌ Pre-compositing failed for job {job.id}, sending both images: {e!r}")
+                # The cache key hashes the composed prompt, which is not the one sent now
+                job.cacheable = False
+            else:
+                if cancelled.is_set():
+                    raise GenerationCancelled()
+                return self._call(
+                    client, base64.b64encode(composed).decode("utf-8"), None, job.photo_size,
+                    composition=self.precomposite, partial_images=job.partial_images, on_partial=partial,
+                )
+        encoded_image, capture_mime = self._prepare_capture(job, encoded_image)
+        # Only the streamed call sees a cancellation once sent, do not send one that already lost
+        if cancelled.is_set():
+            raise GenerationCancelled()
+        return self._call(client, encoded_image, background_data_url, job.photo_size,
+                          capture_mime=capture_mime, partial_images=job.partial_images, on_partial=partial)
+
+    def _call(self, *args, **kwargs):
+        """Call generate_image through the circuit breaker and bulkhead of OpenAI."""
+        from extensions import upstreams
+
+        try:
+            return upstreams["openai"].call(generate_image, *args, is_failure=is_openai_failure, **kwargs)
+        except UpstreamUnavailable as e:
+            print(f"❌ {e}")
+            raise GenerationError(str(e), 503)
+
+    def _prepare_capture(self, job, encoded_image):
+        """Downscale and recompress the capture for OpenAI, see utils.prepare_capture_for_ai.
+
+        Returns:
+            tuple: base64 string of the image to send and its MIME type.
+        """
+        from extensions import metrics
+        from utils import prepare_capture_for_ai
+
+        started_at = time.perf_counter()
+        capture = base64.b64decode(encoded_image)
+        prepared, mime = prepare_capture_for_ai(
+            capture, self.capture_long_edge, self.capture_format, self.capture_quality)
+        elapsed = time.perf_counter() - started_at
+
+        received, sent = len(capture), len(prepared) * 3 // 4 - prepared[-2:].count("=")
+        metrics.ai_capture_prepare_duration.observe(elapsed)
+        metrics.ai_capture_bytes.labels("received").inc(received)
+        metrics.ai_capture_bytes.labels("sent").inc(sent)
+        print(f"Capture of job {job.id} prepared in {elapsed * 1000:.0f} ms: {received / 1024:.0f} KiB -> "
+              f"{sent / 1024:.0f} KiB {self.capture_format}, {(received - sent) / 1024:.0f} KiB saved")
+        return prepared, mime
+
+
+def is_openai_failure(image_base64, error):
+    """Outcome of an OpenAI call for the circuit breaker: a success, a failure, or None if
+    it was cancelled or got a 4xx, which tells nothing about the health of OpenAI."""
+    if error is None:
+        return False
+    if isinstance(error, GenerationCancelled) or (isinstance(error, GenerationError) and error.http_status < 500):
+        return None
+    return True
+
+
+class TogetherProvider(Provider):
+    """FLUX Kontext on Together AI, editing the capture composed onto the background.
+
+    Kontext takes a single input image, so the capture and the background are
+    composed with the "segment" method of the local engine first.
+    """
+
+    name = "together"
+
+    def __init__(self, app):
+        self.api_key = app.config["TOGETHER_API_KEY"]
+        self.model = app.config["TOGETHER_MODEL"]
+        self.timeout = app.config["TOGETHER_TIMEOUT"]
+        self._client = None
+        self._lock = threading.Lock()
+
+    def generate(self, job, encoded_image, background_data_url, cancelled, on_partial=None):
+        # Imported on first use, like openai
+        import together
+        from extensions import cartoon
+
+        composed = cartoon.compose(
+            base64.b64decode(encoded_image),
+            base64.b64decode(background_data_url.split(",", 1)[-1]),
+            job.photo_size,
+            "segment",
+        )
+        width, height = OUTPUT_SIZES[job.photo_size]
+        try:
+            response = self._get_client().images.generate(
+                model=self.model,
+                prompt=COMPOSED_PROMPT_TEXTS["segment"],
+                image_url="data:image/jpeg;base64," + base64.b64encode(composed).decode("utf-8"),
+                width=width,
+                height=height,
+                response_format="b64_json",
+                output_format="png",
+            )
+        except together.error.Timeout:
+            print("❌ Request to Together timed out")
+            raise GenerationError("The request to Together timeout", 503)
+        except (together.error.APIConnectionError, together.error.ServiceUnavailableError):
+            print("❌ Network error")
+            raise GenerationError("Network Connection Error", 503)
+
+        if not response.data or not response.data[0].b64_json:
+            raise GenerationError("No image generated", 400)
+        print("Image has been successfully generated by Together.")
+        return response.data[0].b64_json
+
+    def _get_client(self):
+        if self._client is None:
+            if not self.api_key:
+                raise GenerationError("Together client cannot be initialized", 500)
+            with self._lock:
+                if self._client is None:
+                    from together import Together
+
+                    self._client = Together(api_key=self.api_key, timeout=self.timeout)
+        return self._client
+
+
+class LocalProvider(Provider):
+    """The local cartoon engine, see services.cartoon."""
+
+    name = "local"
+
+    def generate(self, job, encoded_image, background_data_url, cancelled, on_partial=None):
+        from extensions import cartoon
+
+        image = cartoon.render(
+            base64.b64decode(encoded_image),
+            base64.b64decode(background_data_url.split(",", 1)[-1]),
+            job.photo_size,
+        )
+        return base64.b64encode(image).decode("utf-8")
+
+
+class StubProvider(Provider):
+    """Provider for load tests and local runs: answers with the capture after a random delay.
+
+    The delay is log-normal with a median of delay seconds, so about one call in
+    ten takes twice as long and one in a hundred three times, like a real API.
+    A share failure_rate of the calls fails as if the provider were unreachable.
+    """
+
+    def __init__(self, name, delay, failure_rate=0.0):
+        self.name = name
+        self.delay = delay
+        self.failure_rate = failure_rate
+
+    def generate(self, job, encoded_image, background_data_url, cancelled, on_partial=None):
+        if cancelled.wait(self.sample_delay()):
+            raise GenerationCancelled()
+        if random.random() < self.failure_rate:
+            raise GenerationError(f"Stub provider {self.name} failed", 503)
+        return self.render(job, encoded_image)
+
+    def sample_delay(self):
+        """Delay of one call in seconds."""
+        return self.delay * random.lognormvariate(0, 0.5)
+
+    def render(self, job, encoded_image):
+        """The capture fitted to the size of the generated image, as a base64 PNG string."""
+        from io import BytesIO
+        from PIL import Image, ImageOps
+
+        with Image.open(BytesIO(base64.b64decode(encoded_image))) as capture:
+            image = ImageOps.fit(capture.convert("RGB"), OUTPUT_SIZES[job.photo_size])
+        buffer = BytesIO()
+        image.save(buffer, "PNG", compress_level=1)
+        return base64.b64encode(buffer.getvalue()).decode("utf-8")
+
+
+def create_provider(app, spec):
+    """Create a provider from an entry of GENERATION_PROVIDERS.
+
+    Args:
+        app (Flask): Flask application instance.
+        spec (str): "openai", "together", "local", or "stub" with an optional delay
+            in seconds, e.g. "stub:2.5".
+
+    Returns:
+        Provider: The provider.
+    """
+    name, _, argument = spec.partition(":")
+    if name == "openai":
+        return OpenAIProvider(app)
+    if name == "together":
+        return TogetherProvider(app)
+    if name == "local":
+        return LocalProvider()
+    if name == "stub":
+        delay = float(argument) if argument else app.config["STUB_PROVIDER_DELAY"]
+        return StubProvider(spec, delay, app.config["STUB_PROVIDER_FAILURE_RATE"])
+    raise ValueError(f"Unknown generation provider: {spec}")
+
+
+class ProviderRouter:
+    """Sends each generation to the providers of GENERATION_PROVIDERS, hedging the slow ones.
+
+    The first provider gets every job. If it has not answered by its hedging
+    deadline, the GENERATION_HEDGE_QUANTILE of its recent latencies, the next
+    provider gets the same job too. The first image to arrive wins and the other
+    calls are cancelled. A provider that fails hands the job to the next one
+    right away.
+    """
+
+    def __init__(self, app=None):
+        self.providers = []
+        self._latencies = {}
+        self._executor = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Create the providers and the thread pool running their calls.
+
+        Args:
+            app (Flask): Flask application instance.
+        """
+        specs = [spec.strip() for spec in app.config["GENERATION_PROVIDERS"].split(",") if spec.strip()]
+        if not specs:
+            raise ValueError("GENERATION_PROVIDERS needs at least one provider")
+        self.providers = [create_provider(app, spec) for spec in specs]
+        self._latencies = {
+            provider.name: LatencyTracker(app.config["GENERATION_LATENCY_WINDOW"]) for provider in self.providers
+        }
+        self.hedge_quantile = app.config["GENERATION_HEDGE_QUANTILE"]
+        self.hedge_after = app.config["GENERATION_HEDGE_AFTER"]
+        self.hedge_min_samples = app.config["GENERATION_HEDGE_MIN_SAMPLES"]
+        # Every job holding a queue slot may have a call running on each provider, the calls
+        # that lost a race included, so a new primary call never waits behind an abandoned one
+        slots = app.config["GENERATION_WORKERS"] + app.config["GENERATION_QUEUE_SIZE"]
+        self._executor = ThreadPoolExecutor(max_workers=slots * len(self.providers), thread_name_prefix="provider")
+
+    def retry_after(self):
+        """Seconds until a provider takes calls again, or None if one does now.
+
+        Only the providers guarded by a circuit breaker can be unavailable.
+        """
+        from extensions import upstreams
+
+        waits = []
+        for provider in self.providers:
+            retry_after = upstreams[provider.upstream].retry_after() if provider.upstream else None
+            if retry_after is None:
+                return None
+            waits.append(retry_after)
+        return min(waits)
+
+    def hedge_deadline(self, provider):
+        """Seconds to wait for a provider before hedging, or None to never hedge.
+
+        Until a provider has GENERATION_HEDGE_MIN_SAMPLES successful calls,
+        GENERATION_HEDGE_AFTER is used instead of its latency quantile.
+        """
+        if self.hedge_after <= 0:
+            return None
+        deadline = self._latencies[provider.name].quantile(self.hedge_quantile, self.hedge_min_samples)
+        return self.hedge_after if deadline is None else deadline
+
+    def generate(self, job, encoded_image, background_data_url, on_partial=None, on_settled=None):
+        """Generate the image of a job with the first provider to answer.
+
+        Only the first provider streams partial images, so the kiosk does not get
+        the previews of two different images. The losing calls are cancelled, but
+        only the providers that check the cancelled event stop early, the others
+        run to the end in the background.
+
+        Args:
+            job (GenerationJob): Job being generated.
+            encoded_image (str): base64 string of the captured image, as uploaded.
+            background_data_url (str): Data URL of the background image.
+            on_partial (callable): Called with the index and base64 PNG string of each partial image.
+            on_settled (callable): Called once every call started for the job has finished,
+                which may be after this method returns or raises.
+
+        Raises:
+            GenerationError: The error of the last provider, if none of them generated the image.
+
+        Returns:
+            tuple: Name of the winning provider and the base64 string of the PNG image.
+        """
+        from extensions import metrics
+
+        pending = list(self.providers)
+        running = {}        # Future -> (provider, role, cancelled event)
+        last_error = None
+
+        def start(role):
+            provider = pending.pop(0)
+            cancelled = threading.Event()
+            future = self._executor.submit(
+                self._call, provider, job, encoded_image, background_data_url, cancelled,
+                on_partial if role == "primary" else None)
+            running[future] = (provider, role, cancelled)
+            if role != "primary":
+                print(f"Generation job {job.id} sent to {provider.name} ({role}).")
+
+        try:
+            start("primary")
+            hedge_at = None
+            deadline = self.hedge_deadline(self.providers[0])
+            if deadline is not None:
+                hedge_at = time.monotonic() + deadline
+
+            while running:
+                timeout = None
+                if hedge_at is not None and pending:
+                    timeout = max(0.0, hedge_at - time.monotonic())
+                done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+                if not done:
+                    hedge_at = None
+                    start("hedge")
+                    continue
+
+                for future in done:
+                    provider, role, _ = running.pop(future)
+                    try:
+                        image_base64 = future.result()
+                    except GenerationError as e:
+                        last_error = e
+                        metrics.generation_router_calls.labels(provider.name, role, "failed").inc()
+                        print(f"❌ Generation job {job.id} failed on {provider.name}: {e}")
+                        continue
+                    metrics.generation_router_calls.labels(provider.name, role, "won").inc()
+                    return provider.name, image_base64
+
+                # Every running call failed, hand the job to the next provider
+                if not running and pending:
+                    start("failover")
+        finally:
+            # The calls still running lost the race or the job ended with an error
+            for provider, role, cancelled in running.values():
+                cancelled.set()
+                metrics.generation_router_calls.labels(provider.name, role, "cancelled").inc()
+            if on_settled is not None:
+                self._when_finished(list(running), on_settled)
+
+        raise last_error or GenerationError("The image cannot be generated", 500)
+
+    @staticmethod
+    def _when_finished(futures, callback):
+        """Call a function once every future has finished, right away if none is left."""
+        if not futures:
+            callback()
+            return
+        remaining = [len(futures)]
+        lock = threading.Lock()
+
+        def finished(_):
+            with lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last:
+                callback()
+
+        for future in futures:
+            future.add_done_callback(finished)
+
+    def _call(self, provider, job, encoded_image, background_data_url, cancelled, on_partial):
+        """Call a provider and record its latency by outcome."""
+        from extensions import metrics
+
+        started_at = time.perf_counter()
+        outcome = "error"
+        try:
+            image_base64 = provider.generate(job, encoded_image, background_data_url, cancelled, on_partial)
+            outcome = "success"
+        except GenerationCancelled:
+            outcome = "cancelled"
+            raise GenerationError(f"{provider.name} was cancelled", 500)
+        except GenerationError:
+            raise
+        except Exception as e:
+            print(f"❌ API Error on {provider.name}: {e!r}")
+            raise GenerationError(str(e), 500)
+        finally:
+            elapsed = time.perf_counter() - started_at
+            metrics.generation_provider_duration.labels(provider.name, outcome).observe(elapsed)
+
+        tracker = self._latencies[provider.name]
+        tracker.observe(elapsed)
+        quantile = tracker.quantile(self.hedge_quantile, 1)
+        metrics.generation_provider_latency_quantile.labels(provider.name).set(quantile)
+        return image_base64
@@ -0,0 +1,162 @@
+# services/qr_codes.py
+from collections import OrderedDict
+from io import BytesIO
+
+import base64
+import threading
+import time
+
+# Base URLs the success page was served under, the QR codes are prewarmed for each of them
+MAX_PREWARM_BASE_URLS = 4
+
+
+class QRCodeRenderer:
+    """Renders the download QR codes as SVG or PNG data URLs, with an LRU cache."""
+
+    def __init__(self, app=None):
+        self.app = None
+        self._cache = OrderedDict()
+        self._base_urls = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Configure the renderer and prewarm the QR code of succeeded payments.
+
+        Args:
+            app (Flask): Flask application instance.
+        """
+        from extensions import webhook_processor
+
+        self.app = app
+        self.image_format = app.config["QR_CODE_FORMAT"]
+        self.box_size = app.config["QR_CODE_BOX_SIZE"]
+        self.border = app.config["QR_CODE_BORDER"]
+        self.cache_size = app.config["QR_CODE_CACHE_SIZE"]
+        self.bucket_seconds = app.config["SECURE_URL_EXPIRY_BUCKET"]
+        app.extensions["qr_codes"] = self
+        webhook_processor.add_listener(self._prewarm_payment)
+
+    def current_bucket(self):
+        """Index of the current expiry bucket of the secure links."""
+        return int(time.time() // self.bucket_seconds)
+
+    def get_download_qr_code(self, filename):
+        """Get the QR code of the secure download link of a photo.
+
+        Args:
+            filename (str): The name of the AI image file.
+
+        Returns:
+            str: Data URL of the QR code image.
+        """
+        from flask import request
+
+        # The link is built under the host of the request, remember it for the prewarm
+        with self._lock:
+            self._base_urls[request.url_root] = None
+            self._base_urls.move_to_end(request.url_root)
+            while len(self._base_urls) > MAX_PREWARM_BASE_URLS:
+                self._base_urls.popitem(last=False)
+        return self._download_qr_code(filename)
+
+    def _download_qr_code(self, filename):
+        """Get the QR code of the secure download link of a photo, under the host of the request."""
+        from utils import get_secure_image_url
+
+        bucket = self.current_bucket()
+        secure_url = get_secure_image_url(filename, add_expiration=True, download=True, expiry_bucket=bucket)
+        return self.render(secure_url, bucket)
+
+    def render(self, url, bucket):
+        """Render a QR code, or get it from the cache.
+
+        Args:
+            url (str): The data of the QR code.
+            bucket (int): Expiry bucket of the URL.
+
+        Returns:
+            str: Data URL of the QR code image.
+        """
+        key = (url, bucket)
+        with self._lock:
+            data_url = self._cache.get(key)
+            if data_url is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return data_url
+            self.misses += 1
+
+        data_url = self._render(url)
+
+        with self._lock:
+            # Links of the older buckets are not rendered again, drop their QR codes
+            for stale_key in [k for k in self._cache if k[1] < bucket]:
+                del self._cache[stale_key]
+            self._cache[key] = data_url
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return data_url
+
+    def _render(self, url):
+        """Render a QR code as a data URL in the configured format."""
+        import qrcode
+
+        qr = qrcode.QRCode(box_size=self.box_size, border=self.border)
+        qr.add_data(url)
+        qr.make(fit=True)
+
+        if self.image_format == "svg":
+            return "data:image/svg+xml;base64," + base64.b64encode(self._render_svg(qr.get_matrix())).decode("ascii")
+
+        # 1-bit PNG, already scaled to box_size pixels per module
+        buffer = BytesIO()
+        qr.make_image(fill_color="black", back_color="white").save(buffer, format="PNG", optimize=True)
+        return "data:image/png;base64," + base64.b64encode(buffer.getvalue()).decode("ascii")
+
+    def _render_svg(self, matrix):
+        """Render a QR code matrix as an SVG with one path, one subpath per run of dark modules."""
+        runs = []
+        for y, row in enumerate(matrix):
+            x = 0
+            while x < len(row):
+                if row[x]:
+                    start = x
+                    while x < len(row) and row[x]:
+                        x += 1
+                    runs.append(f"M{start} {y}h{x - start}v1H{start}z")
+                else:
+                    x += 1
+
+        size = len(matrix)
+        pixels = size * self.box_size
+        svg = (
+            f'<svg xmlns="http://www.w3.org/2000/svg" width="{pixels}" height="{pixels}" '
+            f'viewBox="0 0 {size} {size}" shape-rendering="crispEdges">'
+            f'<rect width="{size}" height="{size}" fill="#fff"/>'
+            f'<path d="{"".join(runs)}"/></svg>'
+        )
+        return svg.encode("ascii")
+
+    def _prewarm_payment(self, payment_request_id, status):
+        """Render the QR code of a payment as soon as the webhook marks it succeeded."""
+        from models import db, Payment
+
+        if status != "succeeded":
+            return
+        photo_filename = db.session.execute(
+            db.select(Payment.photo_filename).filter_by(payment_request_id=payment_request_id)
+        ).scalar_one_or_none()
+        if not photo_filename:
+            return
+
+        # Build the link like the success page, under each host the kiosks reach the app through
+        with self._lock:
+            base_urls = list(self._base_urls) or [self.app.config["BASE_URL"]]
+        for base_url in base_urls:
+            with self.app.test_request_context(base_url=base_url):
+                self._download_qr_code(photo_filename)
+        print(f"QR code ready for payment {payment_request_id}")
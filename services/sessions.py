@@ -0,0 +1,229 @@
+# services/sessions.py
+from collections import OrderedDict
+from flask.sessions import SessionInterface, SessionMixin, session_json_serializer
+from itsdangerous import BadSignature, Signer
+from werkzeug.datastructures import CallbackDict
+
+import os
+import secrets
+import sqlite3
+import threading
+import time
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    """Session whose data is kept in a session store, the cookie only carries its id."""
+
+    def __init__(self, initial=None, sid=None, new=False, payload=None):
+        def on_update(self):
+            self.modified = True
+            self.accessed = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.payload = payload                      # Stored data, to skip unchanged writes
+        self.was_permanent = self.permanent
+        self.modified = False
+        self.accessed = False
+
+
+class SQLiteSessionStore:
+    """SQLite session store with an in-memory LRU cache in front of it.
+
+    Offers the get/set/delete calls of a Redis client, so either can be used as the store.
+    The cache is cleared when another process writes to the database, which keeps it
+    correct with several worker processes on the same node.
+    """
+
+    def __init__(self, path, cache_size=1024, purge_every=500):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.cache_size = cache_size
+        self.purge_every = purge_every
+        self._cache = OrderedDict()
+        self._writes = 0
+        self._lock = threading.Lock()
+        # One connection for the whole process, so data_version only changes for other processes
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS session_store ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._data_version = self._read_data_version()
+
+    def get(self, key):
+        """Get the value of a key, or None if it does not exist or has expired."""
+        now = time.time()
+        with self._lock:
+            data_version = self._read_data_version()
+            if data_version != self._data_version:
+                self._data_version = data_version
+                self._cache.clear()
+
+            cached = self._cache.get(key)
+            if cached is not None:
+                value, expires_at = cached
+                if expires_at > now:
+                    self._cache.move_to_end(key)
+                    return value
+                del self._cache[key]
+
+            row = self._connection.execute(
+                "SELECT value, expires_at FROM session_store WHERE key = ? AND expires_at > ?", (key, now)
+            ).fetchone()
+            if row is None:
+                return None
+            self._remember(key, bytes(row[0]), row[1])
+            return bytes(row[0])
+
+    def set(self, key, value, ex=None):
+        """Set the value of a key, expiring after ex seconds."""
+        expires_at = time.time() + (ex if ex is not None else 365 * 24 * 3600)
+        with self._lock:
+            self._connection.execute(
+                "INSERT INTO session_store (key, value, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at",
+                (key, value, expires_at),
+            )
+            self._remember(key, value, expires_at)
+            self._writes += 1
+            if self._writes % self.purge_every == 0:
+                self._connection.execute("DELETE FROM session_store WHERE expires_at <= ?", (time.time(),))
+        return True
+
+    def delete(self, *keys):
+        """Delete keys. Returns the number of keys deleted."""
+        with self._lock:
+            for key in keys:
+                self._cache.pop(key, None)
+            deleted = self._connection.executemany(
+                "DELETE FROM session_store WHERE key = ?", [(key,) for key in keys]
+            ).rowcount
+        return deleted
+
+    def _remember(self, key, value, expires_at):
+        if self.cache_size <= 0:
+            return
+        self._cache[key] = (value, expires_at)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _read_data_version(self):
+        return self._connection.execute("PRAGMA data_version").fetchone()[0]
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """Keeps the session data in a store. The cookie only carries a signed session id."""
+
+    serializer = session_json_serializer
+    key_prefix = "session:"
+    salt = "server-side-session"
+
+    def __init__(self, store):
+        self.store = store
+
+    def _get_signer(self, app):
+        if not app.secret_key:
+            return None
+        return Signer(app.secret_key, salt=self.salt, key_derivation="hmac")
+
+    def open_session(self, app, request):
+        signer = self._get_signer(app)
+        if signer is None:
+            return None
+
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if cookie:
+            try:
+                sid = signer.unsign(cookie).decode("ascii")
+            except BadSignature:
+                sid = None
+            if sid:
+                payload = self.store.get(self.key_prefix + sid)
+                if payload is not None:
+                    try:
+                        data = self.serializer.loads(payload.decode("utf-8"))
+                        return ServerSideSession(data, sid=sid, payload=payload)
+                    except ValueError:
+                        pass
+        return ServerSideSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        secure = self.get_cookie_secure(app)
+        samesite = self.get_cookie_samesite(app)
+        httponly = self.get_cookie_httponly(app)
+        key = self.key_prefix + session.sid
+
+        if session.accessed:
+            response.vary.add("Cookie")
+
+        # An emptied session is removed with its cookie
+        if not session:
+            if session.modified and not session.new:
+                self.store.delete(key)
+                response.delete_cookie(name, domain=domain, path=path, secure=secure,
+                                       samesite=samesite, httponly=httponly)
+            return
+
+        # Only write the session when its data changed
+        payload = self.serializer.dumps(dict(session)).encode("utf-8")
+        if payload != session.payload:
+            ttl = int(app.permanent_session_lifetime.total_seconds())
+            self.store.set(key, payload, ex=ttl)
+
+        # The cookie value never changes, send it again only when its expiry does
+        refresh = session.permanent and app.config["SESSION_REFRESH_EACH_REQUEST"]
+        if session.new or refresh or session.permanent != session.was_permanent:
+            signed_sid = self._get_signer(app).sign(session.sid.encode("ascii")).decode("ascii")
+            response.set_cookie(
+                name,
+                signed_sid,
+                expires=self.get_expiration_time(app, session),
+                httponly=httponly,
+                domain=domain,
+                path=path,
+                secure=secure,
+                samesite=samesite,
+            )
+
+
+class ServerSideSessions:
+    """Replaces the cookie session of the app by a server-side session when configured."""
+
+    def __init__(self, app=None):
+        self.interface = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Install the session interface of SESSION_BACKEND.
+
+        Args:
+            app (Flask): Flask application instance.
+        """
+        backend = app.config["SESSION_BACKEND"]
+        if backend == "cookie":
+            return
+        if backend == "sqlite":
+            store = SQLiteSessionStore(app.config["SESSION_SQLITE_PATH"], cache_size=app.config["SESSION_CACHE_SIZE"])
+        elif backend == "redis":
+            try:
+                import redis
+            except ImportError as e:
+                raise RuntimeError("SESSION_BACKEND=redis needs the redis package (pip install redis)") from e
+            store = redis.Redis.from_url(app.config["SESSION_REDIS_URL"])
+        else:
+            raise ValueError(f"Unknown SESSION_BACKEND: {backend}")
+
+        self.interface = ServerSideSessionInterface(store)
+        app.session_interface = self.interface
+        app.extensions["server_sessions"] = self
+        print(f"Server-side sessions enabled ({backend})")
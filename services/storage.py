@@ -0,0 +1,256 @@
+# services/storage.py
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import atexit
+import os
+import threading
+import time
+
+
+class StorageExecutor:
+    """Photo storage writes, deletes and directory creation off the request path.
+
+    A single storage thread runs the operations in the order they were queued,
+    so a delete queued after a write of the same file always runs after it.
+    Every operation returns a Future that completes once the change is on disk.
+    """
+
+    def __init__(self, app=None):
+        self._executor = None
+        self._futures = set()
+        self._pending = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Create the storage thread using the app configuration.
+
+        Args:
+            app (Flask): Flask application instance.
+        """
+        self.retries = app.config["STORAGE_RETRIES"]
+        self.retry_backoff = app.config["STORAGE_RETRY_BACKOFF"]
+        self.flush_timeout = app.config["STORAGE_FLUSH_TIMEOUT"]
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="storage")
+            atexit.register(self.flush)
+        app.extensions["storage"] = self
+
+    def write(self, path, data):
+        """Queue a durable write of a file.
+
+        Until the write completes, read() returns the queued data for this path.
+
+        Args:
+            path (str): Path of the file.
+            data (bytes): File contents.
+
+        Returns:
+            Future: Completes once the file is written and synced to disk.
+        """
+        with self._lock:
+            self._pending[path] = data
+        return self._submit(self._write, path, data)
+
+    def commit(self, part_path, path):
+        """Queue the sync and rename of a file already written to a temporary path.
+
+        Args:
+            part_path (str): Path of the temporary file.
+            path (str): Final path of the file.
+
+        Returns:
+            Future: Completes once the file is synced and renamed into place.
+        """
+        with self._lock:
+            self._pending[path] = part_path
+        return self._submit(self._commit, part_path, path)
+
+    def delete(self, *paths):
+        """Queue the deletion of files. Missing files are ignored.
+
+        Args:
+            *paths (str): Paths of the files to delete.
+
+        Returns:
+            Future: Completes with the number of bytes reclaimed.
+        """
+        return self._submit(self._delete, [path for path in paths if path])
+
+    def makedirs(self, path):
+        """Queue the creation of a directory and its parents.
+
+        Args:
+            path (str): Path of the directory.
+
+        Returns:
+            Future: Completes once the directory exists.
+        """
+        return self._submit(self._retry, os.makedirs, path, exist_ok=True)
+
+    def read(self, path):
+        """Read a file, including one whose write is still queued.
+
+        Args:
+            path (str): Path of the file.
+
+        Returns:
+            bytes: File contents.
+        """
+        with self._lock:
+            pending = self._pending.get(path)
+        if isinstance(pending, bytes):
+            return pending
+        try:
+            with open(path, "rb") as file:
+                return file.read()
+        except FileNotFoundError:
+            if pending is None:
+                raise
+        # The file is being renamed into place
+        try:
+            with open(pending, "rb") as file:
+                return file.read()
+        except FileNotFoundError:
+            # Renamed between the two opens, it is at its path now
+            with open(path, "rb") as file:
+                return file.read()
+
+    def flush(self, timeout=None):
+        """Wait for every queued operation to finish. Called on shutdown.
+
+        Args:
+            timeout (float): Seconds to wait, defaults to STORAGE_FLUSH_TIMEOUT.
+
+        Returns:
+            bool: True if every operation finished in time.
+        """
+        with self._lock:
+            futures = list(self._futures)
+        if not futures:
+            return True
+        done, not_done = wait(futures, timeout=timeout or self.flush_timeout)
+        if not_done:
+            print(f"❌ {len(not_done)} storage operations still pending after flush")
+        return not not_done
+
+    def _submit(self, fn, *args, **kwargs):
+        """Queue an operation and track it until it finishes."""
+        future = self._executor.submit(fn, *args, **kwargs)
+        with self._lock:
+            self._futures.add(future)
+        future.add_done_callback(self._forget)
+        return future
+
+    def _forget(self, future):
+        with self._lock:
+            self._futures.discard(future)
+
+    def _retry(self, fn, *args, **kwargs):
+        """Run a file operation, retrying with backoff on OS errors."""
+        for attempt in range(self.retries + 1):
+            try:
+                return fn(*args, **kwargs)
+            except FileNotFoundError:
+                raise
+            except OSError as e:
+                if attempt == self.retries:
+                    print(f"❌ Storage operation {fn.__name__} failed: {e}")
+                    raise
+                print(f"Storage operation {fn.__name__} failed, retrying: {e}")
+                time.sleep(self.retry_backoff * (2 ** attempt))
+
+    def _write(self, path, data):
+        try:
+            self._retry(write_file_durable, path, data)
+            record_bytes_written(path, len(data))
+            print(f"Photo written to {path}")
+        except Exception as e:
+            print(f"❌ Failed to write {path}: {e}")
+            raise
+        finally:
+            self._clear_pending(path, data)
+
+    def _commit(self, part_path, path):
+        try:
+            self._retry(commit_file_durable, part_path, path)
+            record_bytes_written(path, os.path.getsize(path))
+        except Exception as e:
+            print(f"❌ Failed to save {path}: {e}")
+            raise
+        finally:
+            self._clear_pending(path, part_path)
+
+    def _delete(self, paths):
+        reclaimed = 0
+        for path in paths:
+            try:
+                size = os.path.getsize(path)
+                self._retry(os.remove, path)
+            except FileNotFoundError:
+                continue
+            reclaimed += size
+            record_bytes_deleted(path, size)
+            print(f"Photo {path} deleted from server.")
+        return reclaimed
+
+    def _clear_pending(self, path, value):
+        with self._lock:
+            if self._pending.get(path) is value:
+                del self._pending[path]
+
+
+def record_bytes_written(path, size):
+    """Count the bytes written to a storage directory in the metrics."""
+    from extensions import metrics
+    metrics.storage_bytes_written.labels(os.path.dirname(path)).inc(size)
+
+
+def record_bytes_deleted(path, size):
+    """Count the bytes deleted from a storage directory in the metrics."""
+    from extensions import metrics
+    metrics.storage_bytes_deleted.labels(os.path.dirname(path)).inc(size)
+
+
+def sync_directory(path):
+    """Sync a directory so a rename inside it survives a power loss."""
+    if os.name != "posix":
+        return
+    fd = os.open(path or ".", os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def commit_file_durable(part_path, path):
+    """Sync a temporary file and rename it to its final path.
+
+    Args:
+        part_path (str): Path of the temporary file.
+        path (str): Final path of the file.
+    """
+    with open(part_path, "rb+") as file:
+        os.fsync(file.fileno())
+    os.replace(part_path, path)
+    sync_directory(os.path.dirname(path))
+
+
+def write_file_durable(path, data):
+    """Write a file through a temporary file, sync it and rename it into place.
+
+    Args:
+        path (str): Path of the file.
+        data (bytes): File contents.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    part_path = path + ".part"
+    with open(part_path, "wb") as file:
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(part_path, path)
+    sync_directory(directory)
@@ -0,0 +1,162 @@
+# services/sweeper.py
+from datetime import datetime, timedelta, UTC
+from sqlalchemy import select, update
+from models import db, Photo, PhotoStatus
+
+import os
+import threading
+import time
+
+
+class ExpirySweeper:
+    """Background sweeper that expires abandoned PENDING photos and deletes their files."""
+
+    def __init__(self, app=None):
+        self.app = None
+        self.last_run = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Register the sweeper and, if enabled, start it on the first request.
+
+        The app is also created by `flask db upgrade`, the other CLI commands and the
+        benchmarks, which serve no requests and so do not start the sweeper thread.
+
+        Args:
+            app (Flask): Flask application instance.
+        """
+        self.app = app
+        self.ttl = timedelta(minutes=app.config["PHOTO_PENDING_TTL_MINUTES"])
+        self.interval = app.config["EXPIRY_SWEEP_INTERVAL"]
+        self.batch_size = app.config["EXPIRY_SWEEP_BATCH_SIZE"]
+        self.max_batches = app.config["EXPIRY_SWEEP_MAX_BATCHES"]
+        self.batch_pause = app.config["EXPIRY_SWEEP_BATCH_PAUSE"]
+        app.extensions["expiry_sweeper"] = self
+
+        @app.cli.command("sweep-expired")
+        def sweep_expired_command():
+            """Expire abandoned PENDING photos and delete their files."""
+            self.run_once()
+
+        if app.config["EXPIRY_SWEEPER_ENABLED"]:
+            app.before_request(self._start_on_first_request)
+
+    def _start_on_first_request(self):
+        if self._thread is None:
+            self.start()
+
+    def start(self):
+        """Start the sweeper thread."""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._loop, name="expiry-sweeper", daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        """Stop the sweeper thread after its current batch."""
+        self._stop.set()
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"❌ Expiry sweep failed: {e}")
+
+    def run_once(self):
+        """Expire stale PENDING photos in batches and delete their files and old previews.
+
+        Returns:
+            dict: Number of expired photos, deleted files and bytes reclaimed.
+        """
+        from extensions import storage
+
+        stats = {"expired": 0, "files": 0, "bytes_reclaimed": 0}
+        # date_of_save is stored as naive UTC+8 time
+        cutoff = (datetime.now(UTC) + timedelta(hours=8)).replace(tzinfo=None) - self.ttl
+
+        with self.app.app_context():
+            for _ in range(self.max_batches):
+                ids = list(db.session.execute(
+                    select(Photo.id)
+                    .where(Photo.status == PhotoStatus.PENDING, Photo.date_of_save < cutoff)
+                    .order_by(Photo.id)
+                    .limit(self.batch_size)
+                ).scalars())
+                if not ids:
+                    break
+
+                expired = self._expire(ids)
+                stats["expired"] += len(expired)
+
+                # Only the files of the photos expired here, not of those paid meanwhile
+                paths = [path.lstrip("/") for path in expired]
+                stats["files"] += len(paths)
+                stats["bytes_reclaimed"] += storage.delete(*paths).result()
+
+                # Rate limit the sweep so it never competes with the kiosk requests
+                if len(ids) == self.batch_size:
+                    time.sleep(self.batch_pause)
+
+            # Previews are not in the database, remove the ones older than the TTL
+            previews = self._stale_previews(time.time() - self.ttl.total_seconds())
+            if previews:
+                stats["files"] += len(previews)
+                stats["bytes_reclaimed"] += storage.delete(*previews).result()
+
+        self.last_run = dict(stats, finished_at=datetime.now(UTC).isoformat())
+        if stats["expired"] or stats["files"]:
+            print(f"Expired {stats['expired']} photos, deleted {stats['files']} files "
+                  f"and reclaimed {stats['bytes_reclaimed']} bytes.")
+        return stats
+
+    def _expire(self, ids):
+        """Expire the photos of a batch that are still PENDING.
+
+        A photo paid between the batch SELECT and this UPDATE keeps its status,
+        so only the paths of the rows this UPDATE changed are returned.
+
+        Args:
+            ids (list): Ids of the selected photos.
+
+        Returns:
+            list: Paths of the photos expired.
+        """
+        statement = (
+            update(Photo)
+            .where(Photo.id.in_(ids), Photo.status == PhotoStatus.PENDING)
+            .values(status=PhotoStatus.EXPIRED)
+            .execution_options(synchronize_session=False)
+        )
+        if db.engine.dialect.update_returning:
+            paths = list(db.session.execute(statement.returning(Photo.path)).scalars())
+            db.session.commit()
+            return paths
+
+        # No UPDATE ... RETURNING on this backend, read back the rows of the batch that are now EXPIRED
+        db.session.execute(statement)
+        db.session.commit()
+        return list(db.session.execute(
+            select(Photo.path).where(Photo.id.in_(ids), Photo.status == PhotoStatus.EXPIRED)
+        ).scalars())
+
+    def _stale_previews(self, cutoff):
+        """List preview files last modified before the cutoff, up to one sweep's worth."""
+        preview_dir = self.app.config["PREVIEW_DIR"]
+        limit = self.batch_size * self.max_batches
+        stale = []
+        try:
+            with os.scandir(preview_dir) as entries:
+                for entry in entries:
+                    if entry.is_file() and entry.stat().st_mtime < cutoff:
+                        stale.append(entry.path)
+                        if len(stale) >= limit:
+                            break
+        except FileNotFoundError:
+            pass
+        return stale
@@ -0,0 +1,231 @@
+# services/upstreams.py
+import threading
+import time
+
+
+class UpstreamUnavailable(Exception):
+    """Raised when a call to an upstream API is refused, without calling it."""
+
+    def __init__(self, upstream, reason, retry_after):
+        super().__init__(f"{upstream} is unavailable ({reason.replace('_', ' ')}), retry in {retry_after:.0f} s")
+        self.upstream = upstream
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class Upstream:
+    """Circuit breaker and bulkhead around the calls to one upstream API.
+
+    The breaker opens after failure_threshold consecutive failures and refuses
+    every call for reset_timeout seconds. It then lets one probe call through
+    (half-open): a success closes it, a failure opens it again.
+
+    At most max_concurrent calls run at once. Up to max_waiting more calls wait
+    for a free slot, for wait_timeout seconds at most. The calls beyond that are
+    refused right away.
+    """
+
+    CLOSED = "closed"
+    HALF_OPEN = "half_open"
+    OPEN = "open"
+
+    # Values of the upstream_circuit_state gauge
+    STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(self, name, failure_threshold, reset_timeout, max_concurrent, max_waiting, wait_timeout):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_concurrent = max_concurrent
+        self.max_waiting = max_waiting
+        self.wait_timeout = wait_timeout
+        self.state = Upstream.CLOSED
+        self.failures = 0           # Consecutive failures while closed
+        self.opened_at = None
+        self.in_flight = 0
+        self.waiting = 0
+        self._probing = False
+        self._condition = threading.Condition()
+
+    def call(self, function, *args, is_failure=None, **kwargs):
+        """Call the upstream through the breaker and the bulkhead.
+
+        Args:
+            function (callable): Function making the call.
+            is_failure (callable): Called with the result and the exception (or None)
+                of the call. Returns True if it counts as a failure of the upstream, False
+                if it shows the upstream works, or None if it tells nothing (a cancelled
+                call, a rejected request). By default every exception is a failure.
+
+        Raises:
+            UpstreamUnavailable: If the breaker is open or no slot is free in time.
+
+        Returns:
+            The result of the function.
+        """
+        probe = self._admit()
+        failed = True
+        try:
+            result = function(*args, **kwargs)
+            failed = is_failure is not None and is_failure(result, None)
+            return result
+        except BaseException as e:
+            failed = is_failure is None or is_failure(None, e)
+            raise
+        finally:
+            self._release(probe, failed)
+
+    def retry_after(self):
+        """Seconds until the breaker lets a call through again, or None if it does now."""
+        with self._condition:
+            if self.state == Upstream.OPEN:
+                return max(0.0, self.opened_at + self.reset_timeout - time.monotonic()) or None
+            if self.state == Upstream.HALF_OPEN and self._probing:
+                return float(self.reset_timeout)
+            return None
+
+    def snapshot(self):
+        """State of the breaker and the bulkhead, for monitoring.
+
+        Returns:
+            dict: State, consecutive failures, calls in flight and waiting, and retry_after.
+        """
+        retry_after = self.retry_after()
+        with self._condition:
+            return {
+                "state": self.state,
+                "failures": self.failures,
+                "in_flight": self.in_flight,
+                "waiting": self.waiting,
+                "max_concurrent": self.max_concurrent,
+                "max_waiting": self.max_waiting,
+                "retry_after": retry_after,
+            }
+
+    def _admit(self):
+        """Take a slot for a call. Returns True if the call is the half-open probe."""
+        from extensions import metrics
+
+        try:
+            with self._condition:
+                self._check_breaker()
+                if self.in_flight >= self.max_concurrent:
+                    if self.waiting >= self.max_waiting:
+                        raise UpstreamUnavailable(self.name, "queue_full", self.wait_timeout)
+                    deadline = time.monotonic() + self.wait_timeout
+                    self.waiting += 1
+                    self._update_gauges()
+                    try:
+                        while self.in_flight >= self.max_concurrent:
+                            remaining = deadline - time.monotonic()
+                            if remaining <= 0:
+                                raise UpstreamUnavailable(self.name, "wait_timeout", self.wait_timeout)
+                            self._condition.wait(remaining)
+                            # Do not keep waiting for an upstream that went down meanwhile
+                            self._check_breaker()
+                    finally:
+                        self.waiting -= 1
+
+                probe = self._check_breaker()
+                if probe:
+                    self._probing = True
+                self.in_flight += 1
+                self._update_gauges()
+                return probe
+        except UpstreamUnavailable as e:
+            metrics.upstream_rejected_calls.labels(self.name, e.reason).inc()
+            raise
+
+    def _check_breaker(self):
+        """Refuse the call while the breaker is open. Caller must hold the lock.
+
+        Returns:
+            bool: True if the call would be the half-open probe.
+        """
+        if self.state == Upstream.OPEN:
+            remaining = self.opened_at + self.reset_timeout - time.monotonic()
+            if remaining > 0:
+                raise UpstreamUnavailable(self.name, "circuit_open", remaining)
+            self._set_state(Upstream.HALF_OPEN)
+        if self.state == Upstream.HALF_OPEN:
+            if self._probing:
+                raise UpstreamUnavailable(self.name, "circuit_open", self.reset_timeout)
+            return True
+        return False
+
+    def _release(self, probe, failed):
+        """Free the slot of a call and update the breaker with its outcome (True, False or None)."""
+        with self._condition:
+            self.in_flight -= 1
+            if probe:
+                # An inconclusive probe leaves the breaker half-open, the next call probes again
+                self._probing = False
+                if failed is not None:
+                    self._set_state(Upstream.OPEN if failed else Upstream.CLOSED)
+            elif self.state == Upstream.CLOSED and failed is not None:
+                # Results of calls started before the breaker opened do not change it
+                self.failures = self.failures + 1 if failed else 0
+                if self.failures >= self.failure_threshold:
+                    self._set_state(Upstream.OPEN)
+            self._update_gauges()
+            self._condition.notify_all()
+
+    def _set_state(self, state):
+        """Change the state of the breaker. Caller must hold the lock."""
+        if state == self.state:
+            return
+        if state == Upstream.OPEN:
+            self.opened_at = time.monotonic()
+            print(f"❌ Circuit breaker of {self.name} opened after {self.failures or 1} failure(s), "
+                  f"retrying in {self.reset_timeout:g} s")
+        elif state == Upstream.CLOSED:
+            print(f"Circuit breaker of {self.name} closed.")
+        self.failures = 0
+        self.state = state
+        # Wake the waiting calls, they fail fast once the breaker is open
+        self._condition.notify_all()
+        self._update_gauges()
+
+    def _update_gauges(self):
+        from extensions import metrics
+
+        metrics.upstream_circuit_state.labels(self.name).set(Upstream.STATE_VALUES[self.state])
+        metrics.upstream_calls_in_flight.labels(self.name).set(self.in_flight)
+        metrics.upstream_calls_waiting.labels(self.name).set(self.waiting)
+
+
+class UpstreamRegistry:
+    """The upstream APIs of the app, each with its circuit breaker and bulkhead."""
+
+    # Config prefix of each upstream
+    UPSTREAMS = {"openai": "OPENAI", "hitpay": "HITPAY"}
+
+    def __init__(self, app=None):
+        self._upstreams = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Create the upstreams from the <PREFIX>_BREAKER_* and <PREFIX>_MAX_* settings.
+
+        Args:
+            app (Flask): Flask application instance.
+        """
+        for name, prefix in UpstreamRegistry.UPSTREAMS.items():
+            upstream = self._upstreams[name] = Upstream(
+                name,
+                failure_threshold=app.config[f"{prefix}_BREAKER_FAILURES"],
+                reset_timeout=app.config[f"{prefix}_BREAKER_RESET"],
+                max_concurrent=app.config[f"{prefix}_MAX_CONCURRENCY"],
+                max_waiting=app.config[f"{prefix}_MAX_WAITING"],
+                wait_timeout=app.config[f"{prefix}_WAIT_TIMEOUT"],
+            )
+            upstream._update_gauges()
+        app.extensions["upstreams"] = self
+
+    def __getitem__(self, name):
+        return self._upstreams[name]
+
+    def snapshot(self):
+        """State of every upstream, by name."""
+        return {name: upstream.snapshot() for name, upstream in self._upstreams.items()}
@@ -0,0 +1,173 @@
+# services/webhooks.py
+from datetime import datetime, timedelta, UTC
+from sqlalchemy import insert, select, update
+from sqlalchemy.exc import IntegrityError
+from models import db, Payment, WebhookEvent
+
+import queue
+import threading
+
+
+def local_now():
+    """Current time in the UTC+8 naive format used by the tables."""
+    return (datetime.now(UTC) + timedelta(hours=8)).replace(tzinfo=None)
+
+
+def record_webhook_event(payment_request_id, payment_id, status, raw_body):
+    """Store a verified webhook event in the inbox, ignoring duplicate deliveries.
+
+    Args:
+        payment_request_id (str): HitPay payment request id.
+        payment_id (str): HitPay payment id.
+        status (str): Payment status of the event.
+        raw_body (bytes): Raw body of the webhook request.
+
+    Returns:
+        bool: True if the event is new, False if it was already received.
+    """
+    values = dict(
+        payment_request_id=payment_request_id,
+        payment_id=payment_id,
+        status=status,
+        raw_body=raw_body.decode("utf-8", errors="replace"),
+        received_at=local_now(),
+    )
+
+    # One insert-or-ignore on the (payment_request_id, status) unique key
+    dialect = db.session.get_bind().dialect.name
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+        statement = sqlite_insert(WebhookEvent).values(**values).on_conflict_do_nothing()
+    elif dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+        statement = postgresql_insert(WebhookEvent).values(**values).on_conflict_do_nothing()
+    elif dialect in ("mysql", "mariadb"):
+        statement = insert(WebhookEvent).values(**values).prefix_with("IGNORE")
+    else:
+        statement = insert(WebhookEvent).values(**values)
+
+    try:
+        result = db.session.execute(statement)
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return False
+    return result.rowcount == 1
+
+
+class WebhookProcessor:
+    """Background processor applying inbox events to payments, once each and in order."""
+
+    def __init__(self, app=None):
+        self.app = None
+        self._queue = queue.Queue()
+        self._thread = None
+        self._listeners = []
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Start the processor thread.
+
+        Args:
+            app (Flask): Flask application instance.
+        """
+        self.app = app
+        self.drain_interval = app.config["WEBHOOK_DRAIN_INTERVAL"]
+        app.extensions["webhook_processor"] = self
+        self._queue.put(None)   # Apply the events left over from the last run first
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._loop, name="webhook-processor", daemon=True)
+            self._thread.start()
+
+    def add_listener(self, listener):
+        """Call a function after a payment status has been updated.
+
+        Args:
+            listener (callable): Called with the payment request id and its new status.
+        """
+        self._listeners.append(listener)
+
+    def notify(self, payment_request_id):
+        """Ask the processor to apply the new events of a payment request.
+
+        Args:
+            payment_request_id (str): HitPay payment request id.
+        """
+        self._queue.put(payment_request_id)
+
+    def _loop(self):
+        while True:
+            try:
+                payment_request_id = self._queue.get(timeout=self.drain_interval)
+            except queue.Empty:
+                # Pick up events left over by a restart or by another worker process
+                payment_request_id = None
+            try:
+                with self.app.app_context():
+                    self.process(payment_request_id)
+            except Exception as e:
+                print(f"❌ Webhook processing failed: {e}")
+
+    def process(self, payment_request_id=None):
+        """Apply unprocessed events, for one payment request or for all of them.
+
+        Args:
+            payment_request_id (str): HitPay payment request id, or None for every payment.
+
+        Returns:
+            int: Number of events applied.
+        """
+        if payment_request_id is not None:
+            return self._process_payment(payment_request_id)
+
+        pending = db.session.execute(
+            select(WebhookEvent.payment_request_id)
+            .where(WebhookEvent.processed_at.is_(None))
+            .distinct()
+        ).scalars().all()
+        db.session.rollback()
+        return sum(self._process_payment(pending_id) for pending_id in pending)
+
+    def _process_payment(self, payment_request_id):
+        """Apply the unprocessed events of one payment request in the order they arrived."""
+        # Lock the payment so other worker processes apply its events one at a time
+        current_payment = db.session.execute(
+            select(Payment).filter_by(payment_request_id=payment_request_id).with_for_update()
+        ).scalar_one_or_none()
+        events = db.session.execute(
+            select(WebhookEvent)
+            .where(WebhookEvent.payment_request_id == payment_request_id,
+                   WebhookEvent.processed_at.is_(None))
+            .order_by(WebhookEvent.id)
+        ).scalars().all()
+        if not events:
+            db.session.rollback()
+            return 0
+
+        now = local_now()
+        for event in events:
+            if current_payment:
+                print(f"Payment ID: {event.payment_id}, Status: {event.status}")
+                current_payment.status = event.status
+                current_payment.payment_id = event.payment_id
+                current_payment.end_time = now
+            else:
+                print(f"❌ Payment Request ID {payment_request_id} not found for webhook event.")
+
+            # Claim the event in the same transaction, so it is applied exactly once
+            db.session.execute(
+                update(WebhookEvent)
+                .where(WebhookEvent.id == event.id, WebhookEvent.processed_at.is_(None))
+                .values(processed_at=now)
+                .execution_options(synchronize_session=False)
+            )
+        db.session.commit()
+
+        if current_payment:
+            for listener in self._listeners:
+                try:
+                    listener(payment_request_id, events[-1].status)
+                except Exception as e:
+                    print(f"❌ Payment status listener failed: {e}")
+        return len(events)
@@ -26,7 +26,9 @@ import {
     selectedTimer,
     showConfirmationMessage,
     fetchFullImageUrl,
-    showAlertWithAction
+    showAlertWithAction,
+    streamGenerationJob,
+    dataUrlToBlob
 } from './utils.js';
 
 // Function to handle preview page buttons and camera functionality
@@ -177,11 +179,14 @@ async function captureButtonHandler() {
             photo.style.display = 'block';
             video.style.display = 'none';
 
-            // Save the full image URL to the server
+            // Send the capture as raw JPEG bytes instead of a base64 data URL
+            const captureBlob = await new Promise((resolve) => canvas.toBlob(resolve, 'image/jpeg'));
+
+            // Save the full image to the server
             const oriRes = await fetch('/save_image/full', {
                 method: 'POST',
-                headers: { 'Content-Type': 'application/json', 'Accept': 'application/json' },
-                body: JSON.stringify({ image: JSON.stringify({ image_url: photo.src }) }),
+                headers: { 'Content-Type': captureBlob.type, 'Accept': 'application/json' },
+                body: captureBlob,
             });
 
             if (!oriRes.ok) {
@@ -204,8 +209,8 @@ async function captureButtonHandler() {
             // Save the image for preview (Only enable this if testing original image). For production, disable this
             const previewRes = await fetch('/save_image/preview', {
                 method: 'POST',
-                headers: { 'Content-Type': 'application/json', 'Accept': 'application/json' },
-                body: JSON.stringify({ image: JSON.stringify({ image_url: photo.src }) }),
+                headers: { 'Content-Type': captureBlob.type, 'Accept': 'application/json' },
+                body: captureBlob,
             });
 
             if (!previewRes.ok) {
@@ -288,10 +293,12 @@ async function uploadButtonHandler() {
 
     // Show loading screen
     showLoading('Generating image, please wait...');
-    // Change the text afte r 15 seconds
+    // Change the text afte r 15 seconds, unless a partial image is already shown
     setTimeout(function () {
-        document.getElementById('loading-text').textContent =
-            'This might take a while, please wait...';
+        const loadingText = document.getElementById('loading-text');
+        if (loadingText.textContent === 'Generating image, please wait...') {
+            loadingText.textContent = 'This might take a while, please wait...';
+        }
     }, 15000);
 
     // Check if the photo element has a valid image source
@@ -309,9 +316,10 @@ async function uploadButtonHandler() {
         const timeoutMs = 90000; // 90 seconds timeout
         const timer = setTimeout(() => controller.abort(), timeoutMs);
 
-        let uploadRes;
+        let uploadData;
         try {
-            uploadRes = await fetch('/upload', {
+            // Queue the generation job
+            const uploadRes = await fetch('/upload', {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
@@ -319,37 +327,47 @@ async function uploadButtonHandler() {
                 body: JSON.stringify({
                     image: imageData,
                     background_filename: 'Terengganu_Drawbridge.png',
+                    stream: true,
                 }),
                 signal: controller.signal, // Attach the abort signal
             });
-        } finally {
-            clearTimeout(timer); // Clear the timeout if fetch completes
-        }
 
-        if (!uploadRes.ok) {
-            // Handle error from upload API
-            let serverMsg = '';
-            try {
-                const errBody = await uploadRes.json();
-                serverMsg = errBody.error?.message || uploadRes.statusText;
-            } catch {
-                serverMsg = uploadRes.statusText;
+            if (!uploadRes.ok) {
+                // Handle error from upload API
+                let serverMsg = '';
+                try {
+                    const errBody = await uploadRes.json();
+                    serverMsg = errBody.error?.message || errBody.error || uploadRes.statusText;
+                } catch {
+                    serverMsg = uploadRes.statusText;
+                }
+                throw new Error(`Upload failed: ${serverMsg || `HTTP ${uploadRes.status}`}`);
             }
-            throw new Error(`Upload failed: ${serverMsg || `HTTP ${uploadRes.status}`}`);
+
+            // Wait for the generation job to finish, showing the partial images as they arrive
+            const job = await uploadRes.json();
+            uploadData = await streamGenerationJob(job, (imageUrl) => {
+                photo.src = imageUrl;
+                photo.style.display = 'block';
+                document.getElementById('blur-overlay').style.display = 'none';
+                document.getElementById('loading-text').textContent = 'Almost there, adding the final touches...';
+            }, controller.signal);
+        } finally {
+            clearTimeout(timer); // Clear the timeout if generation completes
         }
 
-        const uploadData = await uploadRes.json();
         if (!uploadData?.image_url) throw new Error('Upload response missing image_url');
 
         // Log the upload data
         console.log('Image uploaded successfully:', uploadData);
         document.getElementById('loading-text').textContent = 'Showing your image...';
 
-        // Save the image URL to the server
+        // Save the generated image to the server as raw bytes
+        const aiBlob = await dataUrlToBlob(uploadData.image_url);
         const saveRes = await fetch('/save_image/ai', {
             method: 'POST',
-            headers: { 'Content-Type': 'application/json', 'Accept': 'application/json' },
-            body: JSON.stringify({ image: JSON.stringify({ image_url: uploadData.image_url }) }),
+            headers: { 'Content-Type': aiBlob.type, 'Accept': 'application/json' },
+            body: aiBlob,
         });
 
         if (!saveRes.ok) {
@@ -365,8 +383,8 @@ async function uploadButtonHandler() {
 
         const previewAiRes = await fetch('/save_image/preview', {
             method: 'POST',
-            headers: { 'Content-Type': 'application/json', 'Accept': 'application/json' },
-            body: JSON.stringify({ image: JSON.stringify({ image_url: uploadData.image_url }) }),
+            headers: { 'Content-Type': aiBlob.type, 'Accept': 'application/json' },
+            body: aiBlob,
         });
 
         if (!previewAiRes.ok) {
@@ -502,11 +520,15 @@ export function payButtonHandler() {
             },
             credentials: 'include',
         })
-            .then((response) => response.json())
-            .then((data) => {
+            .then((response) => response.json().then((data) => ({ status: response.status, data })))
+            .then(({ status, data }) => {
                 console.log('Test Payment Response:', data);
                 if (data.redirect_url) {
                     window.location.href = data.redirect_url;
+                } else if (status === 503) {
+                    // HitPay is down, the server refused the payment without waiting for it
+                    showAlertMessage('Payment is temporarily unavailable. Please try again in a moment.');
+                    hideLoading();
                 } else {
                     showAlertMessage('Payment failed. Please try again.');
                     hideLoading();
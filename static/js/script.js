@@ -201,6 +201,7 @@ document.addEventListener('DOMContentLoaded', function () {
                 e.preventDefault();
                 showLoading();
                 const code = e.target.unique_code.value;
+                const fileFormat = e.target.file_format.value;
 
                 const response = await fetch('/download', {
                     method: 'POST',
@@ -218,11 +219,60 @@ document.addEventListener('DOMContentLoaded', function () {
                     return;
                 }
 
+                // Print files are rendered after the payment, fall back to the original until they are ready
+                let url = data.url;
+                if (fileFormat !== 'original') {
+                    if (data.print_urls && data.print_urls[fileFormat]) {
+                        url = data.print_urls[fileFormat];
+                    } else {
+                        showAlertMessage('Print file is not ready yet. Downloading the original photo.');
+                    }
+                }
+
                 setTimeout(() => {
-                    window.location.href = data.url;
+                    window.location.href = url;
                     hideLoading();
                 }, 1000);
             });
+
+        document
+            .getElementById('bulk-download-form')
+            .addEventListener('submit', async (e) => {
+                e.preventDefault();
+                showLoading();
+
+                const response = await fetch('/download/bulk', {
+                    method: 'POST',
+                    headers: {
+                        'Content-Type': 'application/json',
+                    },
+                    body: JSON.stringify({
+                        unique_codes: e.target.unique_codes.value,
+                        file_format: e.target.file_format.value,
+                    }),
+                });
+
+                if (!response.ok) {
+                    const data = await response.json();
+                    const details = (data.report || [])
+                        .map((item) => `${item.unique_code}: ${item.error}`)
+                        .join('\n');
+                    showAlertMessage(details ? `${data.error}\n${details}` : data.error);
+                    hideLoading();
+                    return;
+                }
+
+                // The status of every code is in report.json inside the ZIP
+                const blob = await response.blob();
+                const disposition = response.headers.get('Content-Disposition') || '';
+                const match = disposition.match(/filename="?([^"]+)"?/);
+                const link = document.createElement('a');
+                link.href = URL.createObjectURL(blob);
+                link.download = match ? match[1] : 'photos.zip';
+                link.click();
+                URL.revokeObjectURL(link.href);
+                hideLoading();
+            });
     }
 });
 
@@ -174,3 +174,78 @@ export async function fetchFullImageUrl() {
     console.log('Full image URL:', fullImageUrl);
     return fullImageUrl;
 }
+
+// Poll a generation job queued by /upload until it succeeds or fails
+export async function waitForGenerationJob(jobId, signal, pollInterval = 2000) {
+    while (true) {
+        await new Promise((resolve) => setTimeout(resolve, pollInterval));
+        const res = await fetch(`/upload/${encodeURIComponent(jobId)}`, {
+            method: 'GET',
+            signal: signal,
+        });
+        let data = null;
+        try {
+            data = await res.json();
+        } catch {
+            data = null;
+        }
+        if (!res.ok) {
+            throw new Error(`Upload failed: ${data?.error || res.statusText || `HTTP ${res.status}`}`);
+        }
+        if (data?.status === 'succeeded') {
+            return data;
+        }
+        console.log(`Generation job ${jobId} is ${data?.status}...`);
+    }
+}
+
+// Follow a generation job on its event stream, calling onPartial with each partial image,
+// falls back to polling if the stream is not available
+export function streamGenerationJob(job, onPartial, signal) {
+    if (!window.EventSource || !job.stream_url) {
+        return waitForGenerationJob(job.job_id, signal);
+    }
+    return new Promise((resolve, reject) => {
+        const source = new EventSource(job.stream_url);
+        const close = () => {
+            source.close();
+            signal?.removeEventListener('abort', onAbort);
+        };
+        const onAbort = () => {
+            close();
+            reject(new DOMException('Generation aborted', 'AbortError'));
+        };
+        signal?.addEventListener('abort', onAbort);
+
+        source.addEventListener('partial', (event) => {
+            const data = JSON.parse(event.data);
+            console.log(`Generation job ${job.job_id} sent partial image ${data.index}`);
+            onPartial(data.image_url);
+        });
+        source.addEventListener('status', (event) => {
+            console.log(`Generation job ${job.job_id} is ${JSON.parse(event.data).status}...`);
+        });
+        source.addEventListener('done', (event) => {
+            close();
+            const data = JSON.parse(event.data);
+            if (data.status === 'succeeded') {
+                resolve(data);
+            } else {
+                reject(new Error(`Upload failed: ${data.error || 'The image cannot be generated'}`));
+            }
+        });
+        // The stream timed out or dropped, keep waiting by polling
+        const fallBack = () => {
+            close();
+            waitForGenerationJob(job.job_id, signal).then(resolve, reject);
+        };
+        source.addEventListener('timeout', fallBack);
+        source.onerror = fallBack;
+    });
+}
+
+// Convert a base64 data URL into a Blob that can be uploaded as raw bytes
+export async function dataUrlToBlob(dataUrl) {
+    const res = await fetch(dataUrl);
+    return await res.blob();
+}
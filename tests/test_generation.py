@@ -0,0 +1,166 @@
+# tests/test_generation.py
+import base64
+import os
+import threading
+import time
+
+import pytest
+from flask import Flask
+
+import extensions
+from config import Config
+from services.generation import GenerationCache, GenerationJob, GenerationQueue, generation_cache_key
+from services.providers import LatencyTracker, OpenAIProvider, Provider
+
+IMAGE = base64.b64encode(b"capture").decode()
+BACKGROUND = "data:image/jpeg;base64," + base64.b64encode(b"background").decode()
+
+
+class GatedProvider(Provider):
+    """Provider named like OpenAI that answers once its gate is opened, counting its calls."""
+
+    name = "openai"
+
+    def __init__(self):
+        self.gate = threading.Event()
+        self.calls = 0
+
+    def generate(self, job, encoded_image, background_data_url, cancelled, on_partial=None):
+        self.calls += 1
+        self.gate.wait(5)
+        return base64.b64encode(b"generated").decode()
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    app.config.update(GENERATION_PROVIDERS="stub", GENERATION_HEDGE_AFTER=0, GENERATION_FALLBACK_AFTER=0,
+                      GENERATION_FALLBACK_ON_ERROR=False, GENERATION_CACHE_DIR=str(tmp_path / "cache"))
+    return app
+
+
+def make_queue(app, provider):
+    queue = GenerationQueue(app)
+    queue.router.providers = [provider]
+    queue.router._latencies = {provider.name: LatencyTracker(10)}
+    return queue
+
+
+def wait_done(*jobs):
+    deadline = time.monotonic() + 5
+    while not all(job.done for job in jobs) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert all(job.done for job in jobs)
+
+
+def test_retry_of_the_same_session_gets_the_running_job(app):
+    provider = GatedProvider()
+    queue = make_queue(app, provider)
+
+    job = queue.submit("session", IMAGE, BACKGROUND, "frame1", cache_key="key")
+    assert queue.find("session", "key", "frame1") is job
+    assert queue.submit("session", IMAGE, BACKGROUND, "frame1", cache_key="key") is job
+
+    provider.gate.set()
+    wait_done(job)
+    assert provider.calls == 1
+
+
+def test_other_session_follows_the_running_job(app):
+    provider = GatedProvider()
+    queue = make_queue(app, provider)
+
+    job = queue.submit("session", IMAGE, BACKGROUND, "frame1", cache_key="key")
+    follower = queue.find("other session", "key", "frame1")
+    assert follower is not job
+    assert follower.session_id == "other session"
+    assert queue.get(follower.id, "other session") is follower
+    assert queue.get(follower.id, "session") is None
+
+    provider.gate.set()
+    wait_done(job, follower)
+    assert provider.calls == 1
+    assert follower.status == GenerationJob.SUCCEEDED
+    assert follower.image_base64 == job.image_base64
+    assert follower.engine == "openai"
+
+
+def test_follower_of_a_finished_job_gets_its_result(app):
+    queue = make_queue(app, GatedProvider())
+    primary = GenerationJob("session", "frame1")
+    primary.status = GenerationJob.SUCCEEDED
+    primary.image_base64 = IMAGE
+    primary.engine = "openai"
+    queue._inflight["key"] = primary
+
+    follower = queue.find("other session", "key", "frame1")
+    assert follower.done
+    assert follower.image_base64 == IMAGE and follower.engine == "openai"
+
+
+def test_finished_generation_is_served_from_the_cache(app):
+    provider = GatedProvider()
+    provider.gate.set()
+    queue = make_queue(app, provider)
+    assert queue.find("session", "key", "frame1") is None
+
+    wait_done(queue.submit("session", IMAGE, BACKGROUND, "frame1", cache_key="key"))
+    deadline = time.monotonic() + 5
+    while "key" in queue._inflight and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    cached = queue.find("other session", "key", "frame1")
+    assert cached.status == GenerationJob.SUCCEEDED
+    assert cached.engine == "cache"
+    assert base64.b64decode(cached.image_base64) == b"generated"
+    assert provider.calls == 1
+
+
+def test_cache_key_depends_on_every_input():
+    key = generation_cache_key(b"capture", BACKGROUND, "frame1")
+    assert key == generation_cache_key(b"capture", BACKGROUND, "frame1")
+    assert key != generation_cache_key(b"other", BACKGROUND, "frame1")
+    assert key != generation_cache_key(b"capture", "data:,", "frame1")
+    assert key != generation_cache_key(b"capture", BACKGROUND, "frame2")
+    assert key != generation_cache_key(b"capture", BACKGROUND, "frame1", "segment")
+
+
+def test_cache_evicts_the_least_recently_used_images(tmp_path):
+    cache = GenerationCache(str(tmp_path), max_bytes=20)
+    cache.put("a", b"a" * 8)
+    cache.put("b", b"b" * 8)
+    os.utime(cache._path("a"), (1000, 1000))
+    os.utime(cache._path("b"), (2000, 2000))
+
+    assert cache.get("a") == b"a" * 8     # Reading touches the entry
+    cache.put("c", b"c" * 8)
+    assert cache.get("b") is None
+    assert cache.get("a") == b"a" * 8
+    assert cache.get("c") == b"c" * 8
+
+
+def test_disabled_cache_keeps_nothing(tmp_path):
+    cache = GenerationCache(str(tmp_path / "cache"), max_bytes=0)
+    cache.put("a", b"a")
+    assert cache.get("a") is None
+    assert not os.path.exists(tmp_path / "cache")
+
+
+def test_generation_without_its_composed_image_is_not_cached(app, monkeypatch):
+    app.config.update(GENERATION_PRECOMPOSITE="segment", OPENAI_CLIENT=object())
+    provider = OpenAIProvider(app)
+
+    def compose(*args):
+        raise ValueError("Cannot encode the composed image")
+
+    monkeypatch.setattr(extensions.cartoon, "compose", compose)
+    monkeypatch.setattr(provider, "_prepare_capture", lambda job, encoded_image: (encoded_image, "image/jpeg"))
+    monkeypatch.setattr(provider, "_call", lambda *args, **kwargs: base64.b64encode(b"generated").decode())
+    queue = make_queue(app, provider)
+
+    job = queue.submit("session", IMAGE, BACKGROUND, "frame1", cache_key="key")
+    wait_done(job)
+    assert job.status == GenerationJob.SUCCEEDED
+    assert not job.cacheable
+    assert queue.cache.get("key") is None
@@ -0,0 +1,83 @@
+# tests/test_payment_status.py
+from datetime import datetime
+
+import threading
+import time
+
+import pytest
+from flask import Flask
+
+from config import Config
+from models import db, Payment
+from services.payment_status import PaymentStatusHub
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    app.config.update(
+        SQLALCHEMY_DATABASE_URI=f"sqlite:///{tmp_path / 'app.db'}",
+        PAYMENT_STATUS_RECHECK_INTERVAL=1,
+    )
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        now = datetime.now()
+        db.session.add(Payment(payment_request_id="pr-1", reference_id="ref-1", status="pending",
+                               frame="frame1", price=10.0, start_time=now, end_time=now))
+        db.session.commit()
+    yield app
+    with app.app_context():
+        db.drop_all()
+        db.engine.dispose()
+
+
+@pytest.fixture
+def hub(app):
+    hub = PaymentStatusHub()
+    hub.init_app(app)
+    return hub
+
+
+def set_status(app, status):
+    with app.app_context():
+        db.session.execute(db.update(Payment).filter_by(payment_request_id="pr-1").values(status=status))
+        db.session.commit()
+
+
+def later(seconds, action):
+    timer = threading.Timer(seconds, action)
+    timer.start()
+    return timer
+
+
+def test_publish_wakes_up_the_waiting_client(app, hub):
+    def succeed():
+        set_status(app, "succeeded")
+        hub.publish("pr-1", "succeeded")
+
+    later(0.1, succeed)
+    started = time.monotonic()
+    assert hub.wait("pr-1", "pending", timeout=5) == "succeeded"
+    assert time.monotonic() - started < 0.5
+
+
+def test_status_is_read_from_the_database_not_the_published_one(app, hub):
+    # Another worker already moved the payment on, the status published here is stale
+    set_status(app, "failed")
+    hub.publish("pr-1", "succeeded")
+    assert hub.wait("pr-1", "pending", timeout=1) == "failed"
+
+
+def test_publish_without_a_change_keeps_waiting(app, hub):
+    later(0.1, lambda: hub.publish("pr-1", "succeeded"))
+    assert hub.wait("pr-1", "pending", timeout=0.5) is None
+
+
+def test_change_by_another_worker_is_seen_at_the_recheck(app, hub):
+    # No publish in this process, as when the webhook is handled by another worker
+    later(0.1, lambda: set_status(app, "succeeded"))
+    started = time.monotonic()
+    assert hub.wait("pr-1", "pending", timeout=5) == "succeeded"
+    assert 0.9 < time.monotonic() - started < 2
@@ -0,0 +1,198 @@
+# tests/test_providers.py
+import base64
+import threading
+import time
+import types
+
+import pytest
+from flask import Flask
+
+from config import Config
+from services.generation import GenerationError, GenerationJob, GenerationQueue, GenerationQueueFull
+from services.providers import LatencyTracker, Provider, ProviderRouter, StubProvider
+
+IMAGE = "aW1hZ2U="
+
+
+def image_of(name):
+    """base64 image a test provider answers with."""
+    return base64.b64encode(name.encode()).decode()
+
+
+class FixedStub(StubProvider):
+    """Stub provider with a fixed delay that records its calls."""
+
+    def __init__(self, name, delay, fails=False):
+        super().__init__(name, delay, failure_rate=1.0 if fails else 0.0)
+        self.calls = 0
+        self.cancelled = []
+
+    def generate(self, job, encoded_image, background_data_url, cancelled, on_partial=None):
+        self.calls += 1
+        self.cancelled.append(cancelled)
+        return super().generate(job, encoded_image, background_data_url, cancelled, on_partial)
+
+    def sample_delay(self):
+        return self.delay
+
+    def render(self, job, encoded_image):
+        return image_of(self.name)
+
+
+class Uncancellable(Provider):
+    """Provider that ignores the cancellation, like a non-streamed OpenAI call."""
+
+    def __init__(self, name, delay):
+        self.name = name
+        self.delay = delay
+        self.finished = threading.Event()
+
+    def generate(self, job, encoded_image, background_data_url, cancelled, on_partial=None):
+        time.sleep(self.delay)
+        self.finished.set()
+        return image_of(self.name)
+
+
+def make_app(tmp_path, **config):
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    app.config.update(GENERATION_PROVIDERS="stub,stub", GENERATION_HEDGE_AFTER=0.1, GENERATION_HEDGE_MIN_SAMPLES=20,
+                      GENERATION_FALLBACK_AFTER=0, GENERATION_FALLBACK_ON_ERROR=False,
+                      GENERATION_CACHE_DIR=str(tmp_path / "cache"))
+    app.config.update(config)
+    return app
+
+
+def make_router(app, *providers):
+    router = ProviderRouter(app)
+    router.providers = list(providers)
+    router._latencies = {provider.name: LatencyTracker(10) for provider in providers}
+    return router
+
+
+def new_job():
+    return types.SimpleNamespace(id="job", photo_size="frame1", partial_images=0)
+
+
+def test_first_provider_answers_without_hedging(tmp_path):
+    primary, secondary = FixedStub("primary", 0.01), FixedStub("secondary", 0.01)
+    router = make_router(make_app(tmp_path), primary, secondary)
+
+    assert router.generate(new_job(), IMAGE, "data:,") == ("primary", image_of("primary"))
+    assert secondary.calls == 0
+
+
+def test_hedge_fires_at_the_deadline_and_the_first_result_wins(tmp_path):
+    primary, secondary = FixedStub("primary", 5), FixedStub("secondary", 0.05)
+    router = make_router(make_app(tmp_path), primary, secondary)
+
+    started_at = time.monotonic()
+    assert router.generate(new_job(), IMAGE, "data:,") == ("secondary", image_of("secondary"))
+    elapsed = time.monotonic() - started_at
+    assert 0.15 <= elapsed < 1
+    # The losing call is cancelled
+    assert primary.cancelled[0].is_set()
+
+
+def test_primary_still_wins_after_the_hedge_started(tmp_path):
+    primary, secondary = FixedStub("primary", 0.2), FixedStub("secondary", 5)
+    router = make_router(make_app(tmp_path), primary, secondary)
+
+    assert router.generate(new_job(), IMAGE, "data:,") == ("primary", image_of("primary"))
+    assert secondary.calls == 1
+    assert secondary.cancelled[0].is_set()
+
+
+def test_hedge_deadline_follows_the_latency_quantile(tmp_path):
+    router = make_router(make_app(tmp_path, GENERATION_HEDGE_MIN_SAMPLES=3), FixedStub("primary", 0))
+    provider = router.providers[0]
+    assert router.hedge_deadline(provider) == 0.1
+    for seconds in (1.0, 2.0, 3.0):
+        router._latencies[provider.name].observe(seconds)
+    assert router.hedge_deadline(provider) == 3.0
+
+
+def test_failing_provider_fails_over_to_the_next_one(tmp_path):
+    primary, secondary = FixedStub("primary", 0, fails=True), FixedStub("secondary", 0.01)
+    router = make_router(make_app(tmp_path, GENERATION_HEDGE_AFTER=5), primary, secondary)
+
+    started_at = time.monotonic()
+    assert router.generate(new_job(), IMAGE, "data:,") == ("secondary", image_of("secondary"))
+    # The failover does not wait for the hedging deadline
+    assert time.monotonic() - started_at < 1
+
+
+def test_every_provider_failing_raises_the_last_error(tmp_path):
+    router = make_router(make_app(tmp_path), FixedStub("primary", 0, fails=True), FixedStub("secondary", 0, fails=True))
+
+    with pytest.raises(GenerationError) as error:
+        router.generate(new_job(), IMAGE, "data:,")
+    assert "secondary" in str(error.value)
+    assert error.value.http_status == 503
+
+
+def test_on_settled_waits_for_the_losing_call(tmp_path):
+    primary, secondary = Uncancellable("primary", 0.5), FixedStub("secondary", 0.01)
+    router = make_router(make_app(tmp_path), primary, secondary)
+    settled = threading.Event()
+
+    assert router.generate(new_job(), IMAGE, "data:,", on_settled=settled.set)[0] == "secondary"
+    assert not settled.is_set()
+    assert settled.wait(5)
+    assert primary.finished.is_set()
+
+
+def test_on_settled_is_called_when_every_provider_failed(tmp_path):
+    router = make_router(make_app(tmp_path), FixedStub("primary", 0, fails=True))
+    settled = threading.Event()
+
+    with pytest.raises(GenerationError):
+        router.generate(new_job(), IMAGE, "data:,", on_settled=settled.set)
+    assert settled.is_set()
+
+
+def make_queue(app, *providers):
+    queue = GenerationQueue(app)
+    queue.router.providers = list(providers)
+    queue.router._latencies = {provider.name: LatencyTracker(10) for provider in providers}
+    return queue
+
+
+def wait_done(job):
+    deadline = time.monotonic() + 5
+    while not job.done and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert job.done
+
+
+def test_queue_slot_is_held_until_the_losing_call_finishes(tmp_path):
+    app = make_app(tmp_path, GENERATION_WORKERS=1, GENERATION_QUEUE_SIZE=0)
+    primary = Uncancellable("primary", 0.5)
+    queue = make_queue(app, primary, FixedStub("secondary", 0.01))
+
+    job = queue.submit("session", IMAGE, "data:,", "frame1")
+    wait_done(job)
+    assert job.engine == "secondary"
+    assert not primary.finished.is_set()
+    with pytest.raises(GenerationQueueFull):
+        queue.submit("other session", IMAGE, "data:,", "frame1")
+
+    assert primary.finished.wait(5)
+    time.sleep(0.05)
+    wait_done(queue.submit("other session", IMAGE, "data:,", "frame1"))
+
+
+def test_only_openai_results_are_cached(tmp_path):
+    queue = make_queue(make_app(tmp_path), FixedStub("stub", 0))
+
+    job = queue.submit("session", IMAGE, "data:,", "frame1", cache_key="key")
+    wait_done(job)
+    assert job.status == GenerationJob.SUCCEEDED and job.engine == "stub"
+    assert queue.cache.get("key") is None
+
+
+def test_openai_results_are_cached(tmp_path):
+    queue = make_queue(make_app(tmp_path), FixedStub("openai", 0))
+
+    wait_done(queue.submit("session", IMAGE, "data:,", "frame1", cache_key="key"))
+    assert queue.cache.get("key") == b"openai"
@@ -0,0 +1,75 @@
+# tests/test_sweeper.py
+from datetime import datetime, timedelta
+
+import os
+
+import pytest
+from flask import Flask
+from sqlalchemy import update
+
+import services.sweeper
+from config import Config
+from extensions import storage
+from models import db, Photo, PhotoStatus, PhotoType
+from services.sweeper import ExpirySweeper
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    app.config.update(
+        SQLALCHEMY_DATABASE_URI=f"sqlite:///{tmp_path / 'app.db'}",
+        EXPIRY_SWEEPER_ENABLED=False,
+        EXPIRY_SWEEP_BATCH_PAUSE=0,
+        PREVIEW_DIR=str(tmp_path / "previews"),
+    )
+    db.init_app(app)
+    storage.init_app(app)
+    with app.app_context():
+        db.create_all()
+    yield app
+    with app.app_context():
+        db.drop_all()
+        db.engine.dispose()
+
+
+def add_stale_photo(filename):
+    """Add a PENDING photo saved two days ago, with its file on disk."""
+    path = f"photos/{filename}"
+    os.makedirs("photos", exist_ok=True)
+    with open(path, "wb") as file:
+        file.write(b"photo")
+    db.session.add(Photo(filename=filename, type=PhotoType.AI, frame="frame1", path=f"/{path}",
+                         unique_code=filename, date_of_save=datetime.now() - timedelta(days=2),
+                         status=PhotoStatus.PENDING))
+    db.session.commit()
+    return path
+
+
+@pytest.mark.parametrize("update_returning", [True, False])
+def test_photo_paid_during_sweep_keeps_its_file(app, monkeypatch, update_returning):
+    with app.app_context():
+        paid_path = add_stale_photo("paid.png")
+        abandoned_path = add_stale_photo("abandoned.png")
+        monkeypatch.setattr(db.engine.dialect, "update_returning", update_returning)
+
+    # The payment of paid.png completes between the SELECT and the UPDATE of the sweep
+    original_update = services.sweeper.update
+
+    def update_after_payment(table):
+        with db.engine.begin() as connection:
+            connection.execute(update(Photo).where(Photo.filename == "paid.png").values(status=PhotoStatus.PAID))
+        return original_update(table)
+
+    monkeypatch.setattr(services.sweeper, "update", update_after_payment)
+    stats = ExpirySweeper(app).run_once()
+
+    assert stats["expired"] == 1
+    assert stats["files"] == 1
+    assert os.path.exists(paid_path)
+    assert not os.path.exists(abandoned_path)
+    with app.app_context():
+        statuses = dict(db.session.execute(db.select(Photo.filename, Photo.status)).all())
+    assert statuses == {"paid.png": PhotoStatus.PAID, "abandoned.png": PhotoStatus.EXPIRED}
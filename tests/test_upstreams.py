@@ -0,0 +1,187 @@
+# tests/test_upstreams.py
+import threading
+import time
+
+import pytest
+
+from services.generation import GenerationCancelled, GenerationError
+from services.providers import is_openai_failure
+from services.upstreams import Upstream, UpstreamUnavailable
+
+
+def make_upstream(**options):
+    settings = dict(failure_threshold=2, reset_timeout=0.05, max_concurrent=2, max_waiting=0, wait_timeout=0.05)
+    settings.update(options)
+    return Upstream("test", **settings)
+
+
+def fail():
+    raise GenerationError("Network Connection Error", 503)
+
+
+def cancelled():
+    raise GenerationCancelled()
+
+
+def rejected():
+    raise GenerationError("No image generated", 400)
+
+
+def call(upstream, function):
+    """Call through the upstream, swallowing the error of the function itself."""
+    try:
+        return upstream.call(function, is_failure=is_openai_failure)
+    except (GenerationError, GenerationCancelled):
+        return None
+
+
+def open_breaker(upstream):
+    for _ in range(upstream.failure_threshold):
+        call(upstream, fail)
+    assert upstream.state == Upstream.OPEN
+
+
+def test_breaker_opens_after_consecutive_failures():
+    upstream = make_upstream(reset_timeout=60)
+    call(upstream, fail)
+    assert upstream.state == Upstream.CLOSED
+    call(upstream, fail)
+    assert upstream.state == Upstream.OPEN
+
+    with pytest.raises(UpstreamUnavailable) as error:
+        upstream.call(lambda: "image")
+    assert error.value.reason == "circuit_open"
+    assert 0 < error.value.retry_after <= 60
+    assert upstream.retry_after() is not None
+
+
+def test_success_resets_the_failure_count():
+    upstream = make_upstream()
+    call(upstream, fail)
+    call(upstream, lambda: "image")
+    call(upstream, fail)
+    assert upstream.state == Upstream.CLOSED
+
+
+def test_inconclusive_calls_do_not_change_the_failure_count():
+    upstream = make_upstream()
+    call(upstream, fail)
+    call(upstream, cancelled)
+    assert upstream.failures == 1
+    call(upstream, fail)
+    assert upstream.state == Upstream.OPEN
+
+
+def test_successful_probe_closes_the_breaker():
+    upstream = make_upstream()
+    open_breaker(upstream)
+    time.sleep(upstream.reset_timeout)
+    assert upstream.call(lambda: "image", is_failure=is_openai_failure) == "image"
+    assert upstream.state == Upstream.CLOSED
+    assert upstream.retry_after() is None
+
+
+def test_failed_probe_reopens_the_breaker():
+    upstream = make_upstream()
+    open_breaker(upstream)
+    time.sleep(upstream.reset_timeout)
+    call(upstream, fail)
+    assert upstream.state == Upstream.OPEN
+
+
+@pytest.mark.parametrize("outcome", [cancelled, rejected])
+def test_inconclusive_probe_leaves_the_breaker_half_open(outcome):
+    upstream = make_upstream()
+    open_breaker(upstream)
+    time.sleep(upstream.reset_timeout)
+    call(upstream, outcome)
+    assert upstream.state == Upstream.HALF_OPEN
+
+    # The next call is the probe
+    assert upstream.call(lambda: "image", is_failure=is_openai_failure) == "image"
+    assert upstream.state == Upstream.CLOSED
+
+
+def test_only_one_probe_runs_at_a_time():
+    upstream = make_upstream()
+    open_breaker(upstream)
+    time.sleep(upstream.reset_timeout)
+
+    started, release = threading.Event(), threading.Event()
+
+    def slow_probe():
+        started.set()
+        release.wait(5)
+        return "image"
+
+    thread = threading.Thread(target=upstream.call, args=(slow_probe,))
+    thread.start()
+    try:
+        assert started.wait(5)
+        assert upstream.state == Upstream.HALF_OPEN
+        with pytest.raises(UpstreamUnavailable) as error:
+            upstream.call(lambda: "image")
+        assert error.value.reason == "circuit_open"
+    finally:
+        release.set()
+        thread.join(5)
+    assert upstream.state == Upstream.CLOSED
+
+
+def run_blocked(upstream, count):
+    """Start calls that hold their slot until the returned event is set."""
+    release = threading.Event()
+    started = threading.Semaphore(0)
+
+    def blocked():
+        started.release()
+        release.wait(5)
+
+    threads = [threading.Thread(target=upstream.call, args=(blocked,)) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for _ in threads:
+        assert started.acquire(timeout=5)
+    return release, threads
+
+
+def test_bulkhead_refuses_calls_when_the_queue_is_full():
+    upstream = make_upstream(max_concurrent=1, max_waiting=0)
+    release, threads = run_blocked(upstream, 1)
+    try:
+        with pytest.raises(UpstreamUnavailable) as error:
+            upstream.call(lambda: "image")
+        assert error.value.reason == "queue_full"
+    finally:
+        release.set()
+        for thread in threads:
+            thread.join(5)
+    assert upstream.in_flight == 0
+    # Refused calls are not failures of the upstream
+    assert upstream.state == Upstream.CLOSED and upstream.failures == 0
+
+
+def test_bulkhead_refuses_calls_that_wait_too_long():
+    upstream = make_upstream(max_concurrent=1, max_waiting=1, wait_timeout=0.05)
+    release, threads = run_blocked(upstream, 1)
+    try:
+        started_at = time.monotonic()
+        with pytest.raises(UpstreamUnavailable) as error:
+            upstream.call(lambda: "image")
+        assert error.value.reason == "wait_timeout"
+        assert time.monotonic() - started_at >= 0.05
+        assert upstream.waiting == 0
+    finally:
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+
+def test_bulkhead_runs_a_waiting_call_once_a_slot_is_free():
+    upstream = make_upstream(max_concurrent=1, max_waiting=1, wait_timeout=5)
+    release, threads = run_blocked(upstream, 1)
+    threading.Timer(0.05, release.set).start()
+    assert upstream.call(lambda: "image") == "image"
+    for thread in threads:
+        thread.join(5)
+    assert upstream.in_flight == 0 and upstream.waiting == 0
@@ -0,0 +1,110 @@
+"""Local stand-in for the HitPay payment request API.
+
+Serves POST /v1/payment-requests and GET /v1/payment-requests/<id> over
+keep-alive HTTP/1.1, so the app can be run and measured without the sandbox.
+
+Run from the project root:
+    python tools/hitpay_stub.py --port 8900 --delay 0.2
+    HITPAY_URL=http://127.0.0.1:8900/v1/payment-requests python run.py
+
+Each response includes X-Connection-Requests, the number of requests served on
+the same connection, which shows whether the app reuses its connections.
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+
+
+class HitPayStubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # Keep connections alive between requests
+    payment_requests = {}
+    lock = threading.Lock()
+    delay = 0.0
+    fail_rate = 0.0
+
+    def setup(self):
+        super().setup()
+        self.connection_requests = 0
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/v1/payment-requests":
+            return self._send(404, {"message": "Not found"})
+        if not self._begin():
+            return
+
+        length = int(self.headers.get("Content-Length", 0))
+        fields = {key: values[0] for key, values in parse_qs(self.rfile.read(length).decode()).items()}
+        payment_request_id = str(uuid.uuid4())
+        payment_request = {
+            "id": payment_request_id,
+            "status": "pending",
+            "amount": fields.get("amount"),
+            "currency": fields.get("currency"),
+            "purpose": fields.get("purpose"),
+            "reference_number": fields.get("reference_number"),
+            "redirect_url": fields.get("redirect_url"),
+            "webhook": fields.get("webhook"),
+            "url": f"http://{self.headers.get('Host')}/checkout/{payment_request_id}",
+        }
+        with self.lock:
+            self.payment_requests[payment_request_id] = payment_request
+        self._send(201, payment_request)
+
+    def do_GET(self):
+        prefix = "/v1/payment-requests/"
+        if not self.path.startswith(prefix):
+            return self._send(404, {"message": "Not found"})
+        if not self._begin():
+            return
+
+        with self.lock:
+            payment_request = self.payment_requests.get(self.path[len(prefix):])
+        if payment_request is None:
+            return self._send(404, {"message": "Payment request not found"})
+        self._send(200, payment_request)
+
+    def _begin(self):
+        """Check the API key and apply the configured delay and failure rate."""
+        self.connection_requests += 1
+        if not self.headers.get("X-BUSINESS-API-KEY"):
+            self._send(401, {"message": "Missing API key"})
+            return False
+        time.sleep(self.delay)
+        if random.random() < self.fail_rate:
+            self._send(503, {"message": "Service unavailable"})
+            return False
+        return True
+
+    def _send(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("X-Connection-Requests", str(self.connection_requests))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--delay", type=float, default=0.0, help="Seconds to wait before each response")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Fraction of requests answered with 503")
+    args = parser.parse_args()
+
+    HitPayStubHandler.delay = args.delay
+    HitPayStubHandler.fail_rate = args.fail_rate
+    server = ThreadingHTTPServer((args.host, args.port), HitPayStubHandler)
+    print(f"HitPay stand-in listening on http://{args.host}:{args.port}/v1/payment-requests")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
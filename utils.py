@@ -1,25 +1,25 @@
-from PIL import Image, ImageTk
+from PIL import Image
 from io import BytesIO
 from flask import session, current_app, url_for
 from datetime import datetime, timedelta, UTC
 from models import Photo, db, PhotoType, PhotoStatus
-from PIL import Image, ImageDraw, ImageFont
+from extensions import storage
+from PIL import Image, ImageDraw, ImageFont, ImageOps
 
-import pymysql
 import secrets
 import string
-import jwt
 import os
 import time
 import base64 
-import requests
 import socket
 import hmac 
 import hashlib
+import zipfile
 import re 
 
 
 from sqlalchemy.engine.url import make_url, URL
+from functools import lru_cache
 
 
 # Load image from file and convert to data URI
@@ -168,6 +168,42 @@ def encode_image_to_data_url(base64_str, format="PNG"):
     encoded = base64.b64encode(buffered.getvalue()).decode("utf-8")
     return encoded   
 
+# MIME type of each format a capture can be sent to the AI API in
+AI_CAPTURE_MIMETYPES = {"png": "image/png", "jpeg": "image/jpeg", "webp": "image/webp"}
+
+def prepare_capture_for_ai(image_data, long_edge, image_format="jpeg", quality=85):
+    """Shrink a capture for the AI API: downscale, recompress and strip its metadata.
+
+    The EXIF orientation is applied to the pixels first, since the EXIF data is dropped.
+    A capture already in the format, size and without metadata is kept as it is if
+    recompressing it does not make it smaller.
+
+    Args:
+        image_data (bytes): Captured image data.
+        long_edge (int): Largest width or height in pixels, 0 to keep the size.
+        image_format (str): "jpeg", "webp" or "png" (lossless).
+        quality (int): JPEG or WebP quality.
+
+    Returns:
+        tuple: base64 string of the prepared image and its MIME type.
+    """
+    with Image.open(BytesIO(image_data)) as source:
+        unchanged = source.format == image_format.upper() and not source.getexif() and not source.info.get("icc_profile")
+        image = ImageOps.exif_transpose(source).convert("RGB")
+    if long_edge and max(image.size) > long_edge:
+        image.thumbnail((long_edge, long_edge), Image.LANCZOS)
+        unchanged = False
+
+    buffer = BytesIO()
+    if image_format == "jpeg":
+        image.save(buffer, "JPEG", quality=quality, optimize=True)
+    elif image_format == "webp":
+        image.save(buffer, "WEBP", quality=quality, method=4)
+    else:
+        image.save(buffer, "PNG")
+    data = image_data if unchanged and len(image_data) <= buffer.tell() else buffer.getvalue()
+    return base64.b64encode(data).decode("utf-8"), AI_CAPTURE_MIMETYPES[image_format]
+
 def get_local_ip():
     """"Get the local IP address of the machine."""
     s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -237,6 +273,7 @@ def create_database_connection(db_url):
         conn_kwargs["port"] = url.port or 3306
 
     # Connect WITHOUT selecting a DB
+    import pymysql
     conn = pymysql.connect(**conn_kwargs)
     try:
         with conn.cursor() as cur:
@@ -248,11 +285,14 @@ def create_database_connection(db_url):
         conn.close()
         
 # Generate secure link for the image file
-def get_secure_image_url(filename, add_expiration=True, download=False):
+def get_secure_image_url(filename, add_expiration=True, download=False, expiry_bucket=None):
     """Generate a secure link for the image file using JWT token.
 
     Args:
         filename (str): The name of the image file.
+        expiry_bucket (int): Expiry bucket index. Links of the same bucket share their expiry
+            time, so the same link (and QR code) is built for the whole bucket. They are valid
+            for 10 minutes from the start of the bucket.
 
     Returns:
         str: A secure link to access the image file.
@@ -263,9 +303,15 @@ def get_secure_image_url(filename, add_expiration=True, download=False):
     
     if add_expiration:
         # Set expiration time for the token (10 minutes)
-        payload['exp'] = datetime.now(UTC) + timedelta(minutes=10)
+        if expiry_bucket is None:
+            payload['exp'] = datetime.now(UTC) + timedelta(minutes=10)
+        else:
+            # Counted from the start of the bucket, so no link lives longer than 10 minutes
+            bucket_seconds = current_app.config["SECURE_URL_EXPIRY_BUCKET"]
+            payload['exp'] = expiry_bucket * bucket_seconds + 600
     
     # Generate token
+    import jwt
     token = jwt.encode(payload, current_app.config["SECRET_KEY"], algorithm='HS256')
     token = token if isinstance(token, str) else token.decode("utf-8")
     
@@ -274,30 +320,268 @@ def get_secure_image_url(filename, add_expiration=True, download=False):
     return secure_link
 
 def save_image_to_db(path, image_data, timestamp, method):
-    """Save the image to the database."""
-    if not os.path.exists(os.path.dirname(path)):
-        os.makedirs(os.path.dirname(path))
-    with open(path, "wb") as file:
-        file.write(image_data)
-    print(f"{method.capitalize()} Photo captured and saved as {path}")
+    """Save the image to the database. The file is written by the storage executor."""
+    storage.write(path, image_data)
+    print(f"{method.capitalize()} Photo captured and queued for saving as {path}")
+    return record_photo(path, timestamp, method)
+
+def record_photo(path, timestamp, method):
+    """Add a saved photo to the database.
 
+    Args:
+        path (str): Path of the saved photo.
+        timestamp (str): Timestamp used in the photo filename.
+        method (str): Capture method ("full" or "ai").
+
+    Returns:
+        Photo: The stored photo.
+    """
     unique_code = ''.join(secrets.choice(string.ascii_uppercase + string.digits) for _ in range(6))
     photo_frame = session.get('photo_size')
     photo = Photo(path="/" + path, filename=f"photo_{timestamp}.png", unique_code=unique_code, type=PhotoType.AI if method == "ai" else PhotoType.ORIGINAL,
-                  frame="7 cm x 10 cm" if photo_frame == "frame1" else "14 cm x 10 cm",
+                  frame=current_app.config["FRAME_LABELS"].get(photo_frame, current_app.config["FRAME_LABELS"]["frame2"]),
                   date_of_save=datetime.now(UTC) + timedelta(hours=8))
     db.session.add(photo)
     db.session.commit()
+    return photo
 
-def save_preview_image(path, image_data):
-    """Save the preview image with a watermark."""
+class InvalidImageUpload(Exception):
+    """Raised when an uploaded image is too large or is not a supported image."""
+
+    def __init__(self, message, http_status=400):
+        super().__init__(message)
+        self.http_status = http_status
+
+def is_supported_image_header(header):
+    """Check the magic bytes of an image file.
+
+    Args:
+        header (bytes): First 12 bytes of the file.
+
+    Returns:
+        bool: True if the file is a PNG, JPEG or WebP image.
+    """
+    return (header.startswith(b"\x89PNG\r\n\x1a\n")
+            or header.startswith(b"\xff\xd8\xff")
+            or (header[:4] == b"RIFF" and header[8:12] == b"WEBP"))
+
+def iter_image_chunks(stream, max_bytes, chunk_size=64 * 1024):
+    """Read an image upload stream in chunks, checking its size and magic bytes on the way.
+
+    Args:
+        stream (file): Readable binary stream of the upload.
+        max_bytes (int): Maximum size of the image in bytes.
+        chunk_size (int): Size of each chunk read from the stream.
+
+    Raises:
+        InvalidImageUpload: If the upload is empty, too large or not a supported image.
+
+    Yields:
+        bytes: Chunks of the image.
+    """
+    header = b""
+    total = 0
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        total += len(chunk)
+        if total > max_bytes:
+            raise InvalidImageUpload(f"Image is larger than {max_bytes} bytes", 413)
+
+        # Hold back the first bytes until the magic bytes can be checked
+        if len(header) < 12:
+            header += chunk
+            if len(header) < 12:
+                continue
+            if not is_supported_image_header(header):
+                raise InvalidImageUpload("Unsupported image format", 415)
+            chunk, header = header, header[:12]
+        yield chunk
+
+    if total == 0:
+        raise InvalidImageUpload("No Image Provided", 400)
+    if len(header) < 12:
+        raise InvalidImageUpload("Unsupported image format", 415)
+
+def stream_image_to_file(stream, path, max_bytes):
+    """Stream an image upload straight to its final file.
+
+    The upload is written to a temporary file next to the final path. Once the
+    whole image passed the checks, the storage executor syncs it and renames it
+    into place.
+
+    Args:
+        stream (file): Readable binary stream of the upload.
+        path (str): Final path of the image.
+        max_bytes (int): Maximum size of the image in bytes.
+
+    Raises:
+        InvalidImageUpload: If the upload is empty, too large or not a supported image.
+
+    Returns:
+        int: Number of bytes written.
+    """
     if not os.path.exists(os.path.dirname(path)):
         os.makedirs(os.path.dirname(path))
-    with open(path, "wb") as file:
-        file.write(image_data)
+
+    part_path = path + ".part"
+    written = 0
+    try:
+        with open(part_path, "wb") as file:
+            for chunk in iter_image_chunks(stream, max_bytes):
+                file.write(chunk)
+                written += len(chunk)
+        storage.commit(part_path, path)
+    except BaseException:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+    return written
+
+def read_image_stream(stream, max_bytes):
+    """Read an image upload into memory, checking its size and magic bytes.
+
+    Args:
+        stream (file): Readable binary stream of the upload.
+        max_bytes (int): Maximum size of the image in bytes.
+
+    Raises:
+        InvalidImageUpload: If the upload is empty, too large or not a supported image.
+
+    Returns:
+        bytes: The image data.
+    """
+    return b"".join(iter_image_chunks(stream, max_bytes))
+
+@lru_cache(maxsize=1)
+def get_watermark_font():
+    """Load the watermark font once."""
+    return ImageFont.load_default(45)
+
+@lru_cache(maxsize=16)
+def get_preview_watermark(size):
+    """Build the "PREVIEW ONLY" watermark mask for an image size.
+
+    Args:
+        size (tuple): Width and height of the preview image.
+
+    Returns:
+        tuple: Mask cropped to the text and its position, or None if the text does not fit.
+    """
+    mask = Image.new("L", size, 0)
+    ImageDraw.Draw(mask).text((10, 10), "PREVIEW ONLY", fill=255, font=get_watermark_font())
+    bbox = mask.getbbox()
+    if not bbox:
+        return None
+    return mask.crop(bbox), bbox[:2]
+
+def get_preview_thumbnail_path(path, long_edge):
+    """Get the path of a preview thumbnail.
+
+    Args:
+        path (str): Path of the preview image.
+        long_edge (int): Long edge of the thumbnail in pixels.
+
+    Returns:
+        str: Path of the thumbnail.
+    """
+    root, ext = os.path.splitext(path)
+    return f"{root}_{long_edge}{ext}"
+
+def save_preview_image(path, image_data):
+    """Save the preview image with a watermark, and its thumbnails.
+
+    The image is decoded once in memory, watermarked and written once as JPEG.
+    Thumbnails listed in PREVIEW_THUMBNAIL_SIZES are written in the same pass.
+    Only the preview write is waited for, since the kiosk loads it right away.
+
+    Args:
+        path (str): Path of the preview image.
+        image_data (bytes): Captured image data.
+
+    Returns:
+        list: Paths of the preview image and its thumbnails.
+    """
+    preview_image = Image.open(BytesIO(image_data)).convert("RGB")
+    watermark = get_preview_watermark(preview_image.size)
+    if watermark:
+        mask, position = watermark
+        preview_image.paste((255, 255, 255), position, mask)
+
+    quality = current_app.config["PREVIEW_JPEG_QUALITY"]
+    buffer = BytesIO()
+    preview_image.save(buffer, "JPEG", quality=quality)
+    preview_written = storage.write(path, buffer.getvalue())
+
+    saved_paths = [path]
+    for long_edge in sorted(current_app.config["PREVIEW_THUMBNAIL_SIZES"], reverse=True):
+        # Each thumbnail is scaled down from the previous (larger) one
+        preview_image.thumbnail((long_edge, long_edge), Image.LANCZOS)
+        thumbnail_path = get_preview_thumbnail_path(path, long_edge)
+        buffer = BytesIO()
+        preview_image.save(buffer, "JPEG", quality=quality)
+        storage.write(thumbnail_path, buffer.getvalue())
+        saved_paths.append(thumbnail_path)
+
+    preview_written.result()
     print(f"Preview Photo captured and saved as {path}")
+    return saved_paths
+
+def remove_preview_image(path):
+    """Queue the removal of the preview image and its thumbnails from the server.
 
-    preview_image = Image.open(path)
-    draw = ImageDraw.Draw(preview_image)
-    draw.text((10, 10), "PREVIEW ONLY", fill=(255, 255, 255), font=ImageFont.load_default(45))
-    preview_image.save(path, "JPEG")
\ No newline at end of file
+    Args:
+        path (str): Path of the preview image.
+    """
+    if not path:
+        return
+    storage.delete(path, *[get_preview_thumbnail_path(path, long_edge)
+                           for long_edge in current_app.config["PREVIEW_THUMBNAIL_SIZES"]])
+
+class ZipChunkWriter:
+    """Unseekable file object collecting the bytes written by zipfile, to stream them."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        """Take the bytes written since the last call."""
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+def stream_zip(entries, chunk_size=256 * 1024):
+    """Stream a ZIP archive without building it in memory or on disk.
+
+    Args:
+        entries (iterable): (name in the archive, file path or bytes) pairs.
+        chunk_size (int): Bytes read from a file at a time.
+
+    Yields:
+        bytes: The next part of the archive.
+    """
+    writer = ZipChunkWriter()
+    # Images are already compressed, store them as they are
+    with zipfile.ZipFile(writer, mode="w", compression=zipfile.ZIP_STORED) as archive:
+        for name, source in entries:
+            if isinstance(source, bytes):
+                archive.writestr(name, source)
+            else:
+                info = zipfile.ZipInfo.from_file(source, arcname=name)
+                with open(source, "rb") as file, archive.open(info, mode="w") as member:
+                    while chunk := file.read(chunk_size):
+                        member.write(chunk)
+                        if writer.chunks:
+                            yield writer.drain()
+            if writer.chunks:
+                yield writer.drain()
+    # Central directory, written when the archive is closed
+    yield writer.drain()